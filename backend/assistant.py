@@ -1,52 +1,85 @@
 import asyncio
 import base64
+import functools
 import json
 import logging
-import math
 import os
 import re
 import sys
+import time
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
-from typing import Any, AsyncGenerator, Dict, List, Optional, Tuple, Union
+from typing import (
+    Any,
+    AsyncGenerator,
+    Callable,
+    Dict,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+    TypeVar,
+    Union,
+)
+from urllib.parse import urljoin
 
-import requests
 import yaml
 from auth.models import User
-from bs4 import BeautifulSoup
 from config import config
+from extraction import RecipeScanner, extract_visible_text, format_recipe
 from fastapi import HTTPException, UploadFile
-from openai import OpenAI
+from openai import AsyncOpenAI
+from openai.types.chat import ChatCompletionMessageToolCall
+from openai.types.chat.chat_completion_message_tool_call import Function
 from PIL import Image
 from pinecone.grpc import PineconeGRPC as Pinecone
 from prompts import get_prompt
 from sqlalchemy.orm import Session
+from storage import SessionLocal
 from storage.conversations import (
+    Conversation,
     ConversationUpsert,
     get_conversation,
     get_conversation_contents,
     update_conversation_contents,
     upsert_conversation,
 )
-from utils.tokens import get_tokens
+from storage.embeddings import Embedding, EmbeddingCache, content_hash
+from storage.lexical import LexicalIndex, reciprocal_rank_fusion
+from storage.page_cache import PageCache
+from storage.query_cache import QueryResultCache
+from storage.vectors import (
+    LocalVectorStore,
+    PineconeVectorStore,
+    VectorMatch,
+    VectorStore,
+)
+from utils.http import PageFetcher, canonical_url, same_site
+from utils.tokens import (
+    count_tokens,
+    count_tokens_many,
+    estimate_message_tokens,
+    vision_image_size,
+)
+from utils.workers import WorkerPool
 
 # Type aliases for better readability
 MessageContent = Union[str, List[Dict[str, Any]]]
 ConversationMessage = Dict[str, Any]
 RecipeData = Dict[str, Any]
+T = TypeVar("T")
 
 logging.basicConfig(level=getattr(logging, config.LOG_LEVEL.upper()))
+logger = logging.getLogger(__name__)
 
 # Check if we're in test environment to avoid real API calls
 if os.getenv("PYTEST_CURRENT_TEST") or "pytest" in sys.modules:
     # In test mode - use mocks
-    from unittest.mock import Mock
+    from unittest.mock import AsyncMock, Mock
 
-    pc = Mock()
-    index = Mock()
-    index.upsert.return_value = None
-    index.query.return_value = Mock(matches=[])
-    openai_client = Mock()
+    index: VectorStore = LocalVectorStore()
+    openai_client = AsyncMock()
 
     # Setup mock responses
     mock_completion = Mock()
@@ -62,14 +95,61 @@ if os.getenv("PYTEST_CURRENT_TEST") or "pytest" in sys.modules:
     mock_embedding_response = Mock()
     mock_embedding_response.data = [Mock(embedding=[0.1] * 1536)]
     openai_client.embeddings.create.return_value = mock_embedding_response
+
+    embedding_cache = EmbeddingCache(config.EMBEDDING_CACHE_SIZE)
+    page_cache = PageCache(config.URL_CACHE_SIZE, config.URL_CACHE_TTL_SECONDS)
+    query_cache = QueryResultCache(config.QUERY_CACHE_SIZE)
 else:
     # Production mode - use real clients
-    pc = Pinecone(api_key=config.PINECONE_API_KEY)
-    index = pc.Index("recipes1")
-    openai_client = OpenAI(api_key=config.OPENAI_API_KEY)
+    if config.VECTOR_STORE == "local":
+        index = LocalVectorStore(config.LOCAL_VECTOR_STORE_PATH)
+    else:
+        pc = Pinecone(api_key=config.PINECONE_API_KEY)
+        index = PineconeVectorStore(pc.Index(config.PINECONE_INDEX))
+    openai_client = AsyncOpenAI(api_key=config.OPENAI_API_KEY)
+    embedding_cache = EmbeddingCache(
+        config.EMBEDDING_CACHE_SIZE,
+        session_factory=SessionLocal if config.EMBEDDING_CACHE_PERSIST else None,
+    )
+    page_cache = PageCache(
+        config.URL_CACHE_SIZE,
+        config.URL_CACHE_TTL_SECONDS,
+        session_factory=SessionLocal if config.URL_CACHE_PERSIST else None,
+    )
+    query_cache = QueryResultCache(
+        config.QUERY_CACHE_SIZE,
+        session_factory=SessionLocal if config.QUERY_CACHE_PERSIST else None,
+    )
+lexical_index = LexicalIndex(config.LEXICAL_INDEX_NAMESPACES)
+page_fetcher = PageFetcher(
+    max_bytes=config.URL_FETCH_MAX_BYTES,
+    per_host=config.URL_FETCH_PER_HOST,
+    max_connections=config.URL_FETCH_MAX_CONNECTIONS,
+    timeout=config.URL_FETCH_TIMEOUT_SECONDS,
+)
 model = "gpt-4o"
 MAX_TOKENS = 128000
 
+# The vector store, the database and HTML parsing are synchronous, so they
+# run on a bounded pool of worker threads instead of on the event loop.
+blocking_executor = ThreadPoolExecutor(
+    max_workers=config.BLOCKING_IO_WORKERS, thread_name_prefix="blocking-io"
+)
+# Image decoding is CPU-bound, so it gets its own pool rather than competing
+# with I/O waits; Pillow releases the GIL while it decodes and resizes
+image_pool = WorkerPool(
+    "image", workers=config.IMAGE_WORKERS, max_queued=config.IMAGE_QUEUE_SIZE
+)
+
+
+async def run_blocking(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Run a synchronous call on the blocking I/O pool and await its result."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        blocking_executor, functools.partial(func, *args, **kwargs)
+    )
+
+
 TOOLS = [
     {
         "type": "function",
@@ -114,6 +194,10 @@ TOOLS = [
 ]
 
 EMBEDDINGS_MODEL = "text-embedding-3-small"
+# Recipe ids are derived from this, the user and the recipe's content hash
+RECIPE_ID_NAMESPACE = uuid.UUID("b9b793c5-92a5-4693-9110-10e42712f2b3")
+# How many copies of each hash the duplicate check makes room for at first
+HASH_MATCHES_PER_RECIPE = 4
 
 
 async def chat(
@@ -134,31 +218,19 @@ async def chat(
         if thread is None or thread.user_id != user.id:
             raise HTTPException(status_code=404, detail="Conversation not found")
 
-    user_message = process_text_with_urls(user_message)
-    user_message_content: MessageContent = user_message
-
-    if attachment:
-        image_bytes = await attachment.read()
-        encoded_string = normalize_image_to_base64_jpeg(image_bytes)
-        user_message_content = [
-            {"type": "text", "text": user_message},
-            {
-                "type": "image_url",
-                "image_url": {"url": f"data:image/png;base64,{encoded_string}"},
-            },
-        ]
-
-    prompt = get_prompt(
-        get_conversation_contents(thread),
-        find_relevant_recipes(user_message, user.id),
-        max_tokens=MAX_TOKENS - len(get_tokens(json.dumps(user_message_content))),
+    tasks = start_turn_tasks(user_message, user.id, attachment)
+    await gather_turn_tasks(tasks)
+    user_message, user_message_content, user_message_tokens = build_user_message(
+        user_message, tasks
     )
+
+    prompt = build_prompt(thread, tasks["recipe_search"].result(), user_message_tokens)
     messages = [
         {"role": "system", "content": prompt},
         {"role": "user", "content": user_message_content},
     ]
 
-    completion = openai_client.chat.completions.create(  # type: ignore
+    completion = await openai_client.chat.completions.create(  # type: ignore
         model=model,
         messages=messages,  # type: ignore
         tools=TOOLS,  # type: ignore
@@ -166,41 +238,14 @@ async def chat(
 
     tool_calls = completion.choices[0].message.tool_calls
     if tool_calls:
-        for tool_call in tool_calls:
-            attributes = json.loads(tool_call.function.arguments)
-            try:
-                if tool_call.function.name == "add_recipe":
-                    recipe_id = add_recipe(attributes["recipe_yaml"], user.id)
-                    messages.append(
-                        {
-                            "role": "function",
-                            "name": "add_recipe",
-                            "content": json.dumps({"recipe_id": recipe_id}),
-                        }
-                    )
-                elif tool_call.function.name == "update_recipe":
-                    update_recipe(
-                        attributes["recipe_id"], attributes["recipe_yaml"], user.id
-                    )
-                    messages.append(
-                        {
-                            "role": "function",
-                            "name": "add_recipe",
-                            "content": json.dumps({"status": "success"}),
-                        }
-                    )
-            except ValueError as e:
-                # Handle YAML parsing errors gracefully
-                error_msg = f"Error processing recipe: {str(e)}"
-                messages.append(
-                    {
-                        "role": "function",
-                        "name": tool_call.function.name,
-                        "content": json.dumps({"error": error_msg}),
-                    }
-                )
-
-        completion = openai_client.chat.completions.create(  # type: ignore
+        tool_tasks = start_tool_call_tasks(tool_calls, user.id)
+        await gather_turn_tasks(tool_tasks)
+        for tool_task in tool_tasks.values():
+            message, _ = tool_task.result()
+            if message:
+                messages.append(message)
+
+        completion = await openai_client.chat.completions.create(  # type: ignore
             model=model,
             messages=messages,  # type: ignore
         )
@@ -224,6 +269,210 @@ async def chat(
     return response, thread_id
 
 
+def build_prompt(
+    thread: Conversation,
+    matches: List["RecipeMatch"],
+    user_message_tokens: int,
+) -> str:
+    """Builds the system prompt for a turn from the thread and its recipes."""
+    return get_prompt(
+        get_conversation_contents(thread),
+        [match.contents for match in matches],
+        max_tokens=MAX_TOKENS - user_message_tokens,
+        recipe_tokens=[match.tokens for match in matches],
+    )
+
+
+TURN_STAGE_MESSAGES = {
+    "url_extraction": "Extracting content from URLs...",
+    "image_processing": "Processing image attachment...",
+    "recipe_search": "Searching your recipe database...",
+}
+
+
+def start_turn_tasks(
+    user_message: str, user_id: uuid.UUID, attachment: Optional[UploadFile] = None
+) -> Dict[str, "asyncio.Task[Any]"]:
+    """
+    Starts the independent work of a chat turn as concurrent tasks.
+
+    URL extraction, image normalization and recipe retrieval don't depend on
+    each other, so a message with a link and a photo pays for the slowest of
+    them rather than their sum. Retrieval runs against the raw message.
+    """
+    tasks: Dict[str, "asyncio.Task[Any]"] = {}
+    if "http" in user_message:
+        tasks["url_extraction"] = asyncio.create_task(
+            process_text_with_urls(user_message)
+        )
+    if attachment:
+        tasks["image_processing"] = asyncio.create_task(
+            read_image_as_base64_jpeg(attachment)
+        )
+    tasks["recipe_search"] = asyncio.create_task(search_recipes(user_message, user_id))
+    return tasks
+
+
+async def gather_turn_tasks(tasks: Dict[str, "asyncio.Task[Any]"]) -> None:
+    """Waits for all turn tasks, cancelling the rest if any of them fails."""
+    try:
+        await asyncio.gather(*tasks.values())
+    except BaseException:
+        for task in tasks.values():
+            task.cancel()
+        raise
+
+
+async def iterate_finished_turn_tasks(
+    tasks: Dict[str, "asyncio.Task[Any]"],
+) -> AsyncGenerator[str, None]:
+    """Yields the stage names of turn tasks in the order they finish."""
+    pending = set(tasks.values())
+    try:
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for stage, task in tasks.items():
+                if task in done:
+                    task.result()  # Re-raise failures from the task
+                    yield stage
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+def build_user_message(
+    user_message: str, tasks: Dict[str, "asyncio.Task[Any]"]
+) -> Tuple[str, MessageContent, int]:
+    """
+    Assembles the user message text and content from finished turn tasks, with
+    the content's estimated token count. An attached image is charged by its
+    size rather than by tokenizing its base64 data.
+    """
+    if "url_extraction" in tasks:
+        user_message = tasks["url_extraction"].result()
+
+    if "image_processing" not in tasks:
+        return user_message, user_message, estimate_message_tokens(user_message)
+
+    image = tasks["image_processing"].result()
+    content: MessageContent = [
+        {"type": "text", "text": user_message},
+        {
+            "type": "image_url",
+            "image_url": {"url": f"data:image/png;base64,{image.data}"},
+        },
+    ]
+    return (
+        user_message,
+        content,
+        estimate_message_tokens(content, [(image.width, image.height)]),
+    )
+
+
+# Progress messages shown while a tool runs and once it has succeeded
+TOOL_MESSAGES = {
+    "add_recipe": (
+        "Adding new recipe to your database...",
+        "✅ Recipe added successfully!",
+    ),
+    "update_recipe": (
+        "Updating existing recipe in your database...",
+        "✅ Recipe updated successfully!",
+    ),
+}
+
+ToolResult = Tuple[Optional[Dict[str, Any]], Optional[str]]
+
+
+async def execute_tool_call(tool_call: Any, user_id: uuid.UUID) -> ToolResult:
+    """
+    Runs a single tool call requested by the model.
+
+    Returns the function message to send back to the model (None for unknown
+    tools) and the error message if the tool failed.
+    """
+    tool_name = tool_call.function.name
+    try:
+        attributes = json.loads(tool_call.function.arguments)
+        if tool_name == "add_recipe":
+            recipe_id = await add_recipe(attributes["recipe_yaml"], user_id)
+            result: Dict[str, Any] = {"recipe_id": recipe_id}
+        elif tool_name == "update_recipe":
+            await update_recipe(
+                attributes["recipe_id"], attributes["recipe_yaml"], user_id
+            )
+            result = {"status": "success"}
+        else:
+            return None, None
+    except ValueError as e:
+        # Handle YAML parsing errors gracefully
+        error_msg = f"Error processing recipe: {str(e)}"
+        message = {
+            "role": "function",
+            "name": tool_name,
+            "content": json.dumps({"error": error_msg}),
+        }
+        return message, error_msg
+
+    return {"role": "function", "name": tool_name, "content": json.dumps(result)}, None
+
+
+def start_tool_call_tasks(
+    tool_calls: List[Any], user_id: uuid.UUID
+) -> Dict[str, "asyncio.Task[ToolResult]"]:
+    """
+    Starts the model's tool calls concurrently, at most TOOL_CALL_CONCURRENCY at
+    a time. Tasks are keyed by stage name in the order the model issued them.
+    """
+    semaphore = asyncio.Semaphore(config.TOOL_CALL_CONCURRENCY)
+
+    async def run(tool_call: Any) -> ToolResult:
+        async with semaphore:
+            return await execute_tool_call(tool_call, user_id)
+
+    return {
+        f"tool:{i}": asyncio.create_task(run(tool_call))
+        for i, tool_call in enumerate(tool_calls)
+    }
+
+
+class ProgressTimer:
+    """Builds the timed progress events for one streamed chat turn."""
+
+    def __init__(self) -> None:
+        self.started_at = time.perf_counter()
+        self.stage_started_at: Dict[str, float] = {}
+
+    def elapsed_ms(self) -> float:
+        return round((time.perf_counter() - self.started_at) * 1000, 1)
+
+    def start(
+        self, stage: str, message: str, type: str = "status", **fields: Any
+    ) -> Dict[str, Any]:
+        self.stage_started_at[stage] = time.perf_counter()
+        return {
+            "type": type,
+            "stage": stage,
+            "message": message,
+            **fields,
+            "elapsed_ms": self.elapsed_ms(),
+        }
+
+    def finish(
+        self, stage: str, type: str = "stage_complete", **fields: Any
+    ) -> Dict[str, Any]:
+        started_at = self.stage_started_at.pop(stage, self.started_at)
+        return {
+            "type": type,
+            "stage": stage,
+            **fields,
+            "duration_ms": round((time.perf_counter() - started_at) * 1000, 1),
+            "elapsed_ms": self.elapsed_ms(),
+        }
+
+
 async def chat_with_feedback(
     db: Session,
     user: User,
@@ -235,15 +484,24 @@ async def chat_with_feedback(
     Chat function that yields progress updates for real-time feedback.
 
     Yields events with the following structure:
-    - {'type': 'status', 'message': 'Searching your recipe database...'}
-    - {'type': 'recipe_search', 'count': 3, 'message': 'Found 3 relevant recipes'}
-    - {'type': 'tool_use', 'tool': 'add_recipe', 'message': 'Adding new recipe...'}
+    - {'type': 'status', 'stage': 'generating', 'message': '...', 'elapsed_ms': 4.1}
+    - {'type': 'stage_complete', 'stage': 'generating', 'duration_ms': 3.0, ...}
+    - {'type': 'recipe_search', 'count': 3, 'message': '...', 'recipes': [...], ...}
+    - {'type': 'delta', 'content': 'Here is'}
+    - {'type': 'tool_call_delta', 'index': 0, 'tool': 'add_recipe', 'arguments': '{"r'}
+    - {'type': 'tool_use', 'tool': 'add_recipe', 'message': 'Adding new recipe...', ...}
     - {'type': 'response', 'content': 'Here is my response...', 'thread_id': 'abc123'}
+
+    Progress events are emitted when a stage actually starts and finishes.
+    ``elapsed_ms`` is measured from the start of the turn and ``duration_ms``
+    from the start of the stage. ``delta`` events carry answer text as the model
+    generates it; the final ``response`` event still carries the complete answer.
     """
 
+    progress = ProgressTimer()
+
     # Initialize the thread if it's the first message
-    yield {"type": "status", "message": "Initializing conversation..."}
-    await asyncio.sleep(0.1)  # Small delay for UI feedback
+    yield progress.start("initializing", "Initializing conversation...")
 
     if thread_id is None:
         thread = upsert_conversation(
@@ -255,315 +513,737 @@ async def chat_with_feedback(
         if thread is None or thread.user_id != user.id:
             raise HTTPException(status_code=404, detail="Conversation not found")
 
-    # Process URL extraction if needed
-    if "http" in user_message:
-        yield {"type": "status", "message": "Extracting content from URLs..."}
-        await asyncio.sleep(0.1)
-
-    user_message = process_text_with_urls(user_message)
-    user_message_content: MessageContent = user_message
-
-    # Process image attachment if present
-    if attachment:
-        yield {"type": "status", "message": "Processing image attachment..."}
-        await asyncio.sleep(0.1)
-
-        image_bytes = await attachment.read()
-        encoded_string = normalize_image_to_base64_jpeg(image_bytes)
-        user_message_content = [
-            {"type": "text", "text": user_message},
-            {
-                "type": "image_url",
-                "image_url": {"url": f"data:image/png;base64,{encoded_string}"},
-            },
-        ]
+    yield progress.finish("initializing")
 
-    # Search for relevant recipes
-    yield {"type": "status", "message": "Searching your recipe database..."}
-    await asyncio.sleep(0.1)
+    # Extract URLs, process the image and search recipes concurrently
+    tasks = start_turn_tasks(user_message, user.id, attachment)
+    for stage in tasks:
+        yield progress.start(stage, TURN_STAGE_MESSAGES[stage])
 
-    relevant_recipes = find_relevant_recipes(user_message, user.id)
-    recipe_count = len(relevant_recipes)
+    async for stage in iterate_finished_turn_tasks(tasks):
+        if stage != "recipe_search":
+            yield progress.finish(stage)
+            continue
 
-    if recipe_count > 0:
-        yield {
-            "type": "recipe_search",
-            "count": recipe_count,
-            "message": f"Found {recipe_count} relevant recipe{'s' if recipe_count != 1 else ''}",
-        }
-    else:
-        yield {
-            "type": "recipe_search",
-            "count": 0,
-            "message": "No relevant recipes found in your database",
-        }
+        yield progress.finish(
+            stage,
+            type="recipe_search",
+            **recipe_search_event_fields(tasks["recipe_search"].result()),
+        )
 
-    await asyncio.sleep(0.1)
+    user_message, user_message_content, user_message_tokens = build_user_message(
+        user_message, tasks
+    )
 
     # Generate AI response
-    yield {"type": "status", "message": "Generating AI response..."}
-    await asyncio.sleep(0.1)
+    yield progress.start("generating", "Generating AI response...")
 
-    prompt = get_prompt(
-        get_conversation_contents(thread),
-        relevant_recipes,
-        max_tokens=MAX_TOKENS - len(get_tokens(json.dumps(user_message_content))),
-    )
+    prompt = build_prompt(thread, tasks["recipe_search"].result(), user_message_tokens)
     messages = [
         {"role": "system", "content": prompt},
         {"role": "user", "content": user_message_content},
     ]
 
-    completion = openai_client.chat.completions.create(  # type: ignore
-        model=model,
-        messages=messages,  # type: ignore
-        tools=TOOLS,  # type: ignore
-    )
+    completion: Dict[str, Any] = {}
+    async for event in stream_completion(messages, tools=TOOLS):
+        if event["type"] == "completion":
+            completion = event
+        else:
+            yield event
 
-    # Handle tool calls if present
-    tool_calls = completion.choices[0].message.tool_calls
-    if tool_calls:
-        for tool_call in tool_calls:
-            tool_name = tool_call.function.name
+    yield progress.finish("generating")
 
-            if tool_name == "add_recipe":
-                yield {
-                    "type": "tool_use",
-                    "tool": "add_recipe",
-                    "message": "Adding new recipe to your database...",
-                }
-            elif tool_name == "update_recipe":
-                yield {
-                    "type": "tool_use",
-                    "tool": "update_recipe",
-                    "message": "Updating existing recipe in your database...",
-                }
-
-            await asyncio.sleep(0.1)
+    # Handle tool calls if present, running independent calls concurrently
+    tool_calls = completion["tool_calls"]
+    if tool_calls:
+        tool_tasks = start_tool_call_tasks(tool_calls, user.id)
+        tool_names = {
+            stage: tool_call.function.name
+            for stage, tool_call in zip(tool_tasks, tool_calls)
+        }
+        for stage, tool_name in tool_names.items():
+            if tool_name in TOOL_MESSAGES:
+                yield progress.start(
+                    stage,
+                    TOOL_MESSAGES[tool_name][0],
+                    type="tool_use",
+                    tool=tool_name,
+                )
 
-            # Execute the tool
-            attributes = json.loads(tool_call.function.arguments)
-            try:
-                if tool_call.function.name == "add_recipe":
-                    recipe_id = add_recipe(attributes["recipe_yaml"], user.id)
-                    messages.append(
-                        {
-                            "role": "function",
-                            "name": "add_recipe",
-                            "content": json.dumps({"recipe_id": recipe_id}),
-                        }
-                    )
-                    yield {
-                        "type": "tool_complete",
-                        "tool": "add_recipe",
-                        "message": "✅ Recipe added successfully!",
-                    }
-                elif tool_call.function.name == "update_recipe":
-                    update_recipe(
-                        attributes["recipe_id"], attributes["recipe_yaml"], user.id
-                    )
-                    messages.append(
-                        {
-                            "role": "function",
-                            "name": "add_recipe",
-                            "content": json.dumps({"status": "success"}),
-                        }
-                    )
-                    yield {
-                        "type": "tool_complete",
-                        "tool": "update_recipe",
-                        "message": "✅ Recipe updated successfully!",
-                    }
-            except ValueError as e:
-                # Handle YAML parsing errors gracefully
-                error_msg = f"Error processing recipe: {str(e)}"
-                messages.append(
-                    {
-                        "role": "function",
-                        "name": tool_call.function.name,
-                        "content": json.dumps({"error": error_msg}),
-                    }
+        async for stage in iterate_finished_turn_tasks(tool_tasks):
+            tool_name = tool_names[stage]
+            message, error_msg = tool_tasks[stage].result()
+            if error_msg:
+                yield progress.finish(
+                    stage, type="tool_error", tool=tool_name, message=f"❌ {error_msg}"
+                )
+            elif message:
+                yield progress.finish(
+                    stage,
+                    type="tool_complete",
+                    tool=tool_name,
+                    message=TOOL_MESSAGES[tool_name][1],
                 )
-                yield {
-                    "type": "tool_error",
-                    "tool": tool_call.function.name,
-                    "message": f"❌ {error_msg}",
-                }
+
+        # Tool results go back to the model in the order it asked for them
+        for tool_task in tool_tasks.values():
+            message, _ = tool_task.result()
+            if message:
+                messages.append(message)
 
         # Get final response after tool use
-        yield {"type": "status", "message": "Finalizing response..."}
-        await asyncio.sleep(0.1)
+        yield progress.start("finalizing", "Finalizing response...")
 
-        completion = openai_client.chat.completions.create(  # type: ignore
-            model=model,
-            messages=messages,  # type: ignore
-        )
+        async for event in stream_completion(messages):
+            if event["type"] == "completion":
+                completion = event
+            else:
+                yield event
 
-    response = completion.choices[0].message.content or "No response generated"
+        yield progress.finish("finalizing")
+
+    response = completion["content"] or "No response generated"
 
     # Update the conversation with relevant messages
     user_message_dict = messages[1]  # type: ignore
-    assistant_message_dict = completion.choices[0].message.to_dict()
 
     conversation_update_messages = [
         {"role": user_message_dict["role"], "content": user_message_dict["content"]},  # type: ignore
-        {
-            "role": assistant_message_dict["role"],
-            "content": assistant_message_dict["content"],
-        },
+        {"role": "assistant", "content": completion["content"]},
     ]
     update_conversation_contents(thread, conversation_update_messages)
 
     # Final response
-    yield {"type": "response", "content": response, "thread_id": thread_id}
+    yield {
+        "type": "response",
+        "content": response,
+        "thread_id": thread_id,
+        "elapsed_ms": progress.elapsed_ms(),
+    }
 
 
-def normalize_image_to_base64_jpeg(file_contents: bytes) -> str:
-    # Open the PNG image from the file handle
-    with Image.open(BytesIO(file_contents)) as img:
-        # Ensure the image is in RGB mode (JPEG does not support transparency)
-        img = img.convert("RGB")
+async def stream_completion(
+    messages: List[Dict[str, Any]], tools: Optional[List[Dict[str, Any]]] = None
+) -> AsyncGenerator[Dict[str, Any], None]:
+    """
+    Streams a chat completion, yielding events as the deltas arrive.
 
-        # Get current dimensions
-        width, height = img.size
+    Yields ``delta`` events for answer text and ``tool_call_delta`` events while
+    tool-call arguments are being assembled. The last event is always
+    ``{'type': 'completion', 'content': ..., 'tool_calls': ...}`` with the
+    assembled message, for the caller to consume rather than forward.
+    """
+    request: Dict[str, Any] = {"model": model, "messages": messages, "stream": True}
+    if tools:
+        request["tools"] = tools
+
+    content_parts: List[str] = []
+    tool_call_parts: Dict[int, Dict[str, Any]] = {}
+
+    stream = await openai_client.chat.completions.create(**request)
+    async for chunk in stream:
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta
+
+        if delta.content:
+            content_parts.append(delta.content)
+            yield {"type": "delta", "content": delta.content}
+
+        for tool_call_delta in delta.tool_calls or []:
+            parts = tool_call_parts.setdefault(
+                tool_call_delta.index, {"id": "", "name": "", "arguments": []}
+            )
+            if tool_call_delta.id:
+                parts["id"] = tool_call_delta.id
+            function = tool_call_delta.function
+            if function and function.name:
+                parts["name"] = function.name
+            if function and function.arguments:
+                parts["arguments"].append(function.arguments)
+                yield {
+                    "type": "tool_call_delta",
+                    "index": tool_call_delta.index,
+                    "tool": parts["name"],
+                    "arguments": function.arguments,
+                }
 
-        # Resize to fit within 768px on the shorter side, preserving aspect ratio
-        if min(width, height) > 768:
-            scale_factor = 768 / min(width, height)
-            new_width = int(width * scale_factor)
-            new_height = int(height * scale_factor)
-            img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
+    tool_calls = [
+        ChatCompletionMessageToolCall(
+            id=parts["id"],
+            type="function",
+            function=Function(
+                name=parts["name"], arguments="".join(parts["arguments"])
+            ),
+        )
+        for _, parts in sorted(tool_call_parts.items())
+    ]
+    yield {
+        "type": "completion",
+        "content": "".join(content_parts) or None,
+        "tool_calls": tool_calls or None,
+    }
+
+
+class EncodedImage(NamedTuple):
+    data: str  # Base64 JPEG
+    width: int
+    height: int
+
+
+async def read_image_as_base64_jpeg(attachment: UploadFile) -> EncodedImage:
+    image_bytes = await attachment.read()
+    return await image_pool.run(normalize_image_to_base64_jpeg, image_bytes)
+
+
+def normalize_image_to_base64_jpeg(file_contents: bytes) -> EncodedImage:
+    """
+    Re-encodes an uploaded image as a JPEG at the size the vision model will
+    use, without upscaling (see ``vision_image_size``).
 
-        # Ensure both dimensions are divisible by 512 for tiling
-        width, height = img.size
-        new_width = math.ceil(width / 512) * 512
-        new_height = math.ceil(height / 512) * 512
-        img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
+    JPEG photos are decoded at a reduced scale close to that size, which skips
+    most of the work of decoding a full phone photo, and every image is
+    resized once.
+    """
+    with Image.open(BytesIO(file_contents)) as img:
+        size = vision_image_size(*img.size)
+        if img.format == "JPEG":
+            # Decodes at the smallest 1/2, 1/4 or 1/8 scale still at least size
+            img.draft("RGB", size)
+
+        # Ensure the image is in RGB mode (JPEG does not support transparency)
+        img = img.convert("RGB")
+        if img.size != size:
+            img = img.resize(size, Image.Resampling.LANCZOS, reducing_gap=3.0)
 
-        # Save the image as JPEG to a BytesIO stream
         buffer = BytesIO()
         img.save(buffer, format="JPEG", optimize=True, quality=85)
-        buffer.seek(0)
+        base64_string = base64.b64encode(buffer.getvalue()).decode("utf-8")
+        return EncodedImage(base64_string, *size)
+
 
-        # Convert the JPEG bytes to a base64 string
-        base64_string = base64.b64encode(buffer.read()).decode("utf-8")
+async def get_embeddings(contents: str) -> List[List[float]]:
+    return await embed_texts([contents])
 
-        return base64_string
 
+async def embed_texts(texts: List[str]) -> List[Embedding]:
+    """
+    Embeds texts with one API request, serving repeated inputs from the cache.
+
+    Lookups go to the in-memory LRU first, then to the persistent tier; only
+    the remaining texts are sent to OpenAI, and their embeddings are cached.
+    """
+    embeddings: Dict[str, Embedding] = {}
+    for text in texts:
+        cached = embedding_cache.get(EMBEDDINGS_MODEL, text)
+        if cached is not None:
+            embeddings[text] = cached
+
+    missing = [text for text in dict.fromkeys(texts) if text not in embeddings]
+    if missing:
+        embeddings.update(
+            await run_blocking(
+                embedding_cache.load_persistent, EMBEDDINGS_MODEL, missing
+            )
+        )
+        missing = [text for text in missing if text not in embeddings]
 
-def get_embeddings(contents: str) -> List[List[float]]:
-    response = openai_client.embeddings.create(input=contents, model=EMBEDDINGS_MODEL)
-    embeddings = [record.embedding for record in response.data]
-    return embeddings
+    if missing:
+        response = await openai_client.embeddings.create(
+            input=missing, model=EMBEDDINGS_MODEL
+        )
+        fresh = {text: record.embedding for text, record in zip(missing, response.data)}
+        for text, embedding in fresh.items():
+            embedding_cache.put(EMBEDDINGS_MODEL, text, embedding)
+        await run_blocking(embedding_cache.store_persistent, EMBEDDINGS_MODEL, fresh)
+        embeddings.update(fresh)
+
+    return [embeddings[text] for text in texts]
+
+
+class RecipeMatch(NamedTuple):
+    recipe_id: str
+    contents: str
+    # Cosine similarity from the vector search, if it returned the recipe
+    similarity: Optional[float]
+    # BM25 score from the lexical search, if it matched the recipe
+    lexical_score: Optional[float]
+    tokens: int
+
+
+async def find_relevant_recipes(
+    user_query: str,
+    user_id: uuid.UUID,
+    top_k: int = config.RECIPE_SEARCH_CANDIDATES,
+) -> List[RecipeMatch]:
+    """
+    Finds up to top_k of the user's recipes relevant to a query, best first.
 
+    Lexical (BM25 over titles and ingredient names) and vector rankings are
+    merged with reciprocal rank fusion. Queries made only of ingredients the
+    user has recipes for are answered lexically, without an embedding call.
+    Vector matches below RECIPE_MIN_SIMILARITY are dropped unless they also
+    matched lexically, so an unrelated query finds nothing.
+    """
+    namespace = f"user_{user_id}"
+    # Read before searching so a write that lands mid-search isn't cached over
+    version = await namespace_version(namespace)
+    cached = query_cache.get(namespace, user_query, top_k)
+    if cached is not None:
+        return cached
+
+    await load_lexical_index(namespace, version)
+    lexical = lexical_index.search(namespace, user_query, top_k, version)
+    lexical_scores = {recipe_id: score for recipe_id, score, _ in lexical}
+    contents = {recipe_id: recipe_contents for recipe_id, _, recipe_contents in lexical}
+    similarities: Dict[str, float] = {}
+
+    if lexical and lexical_index.is_ingredient_query(namespace, user_query, version):
+        ranked = [recipe_id for recipe_id, _, _ in lexical]
+    else:
+        query_embedding = await get_embeddings(user_query)
+        query_results = await run_blocking(
+            index.query,
+            namespace=namespace,
+            vector=query_embedding[0],
+            top_k=top_k,
+            include_values=False,
+            include_metadata=True,
+        )
 
-def find_relevant_recipes(
-    user_query: str, user_id: uuid.UUID, top_k: int = 5
-) -> List[str]:
-    query_embedding = get_embeddings(user_query)
-    query_results = index.query(
-        namespace=f"user_{user_id}",
-        vector=query_embedding[0],
-        top_k=top_k,
-        include_values=False,
-        include_metadata=True,
-    )
+        for match in query_results.matches:
+            if match.score >= config.RECIPE_MIN_SIMILARITY or match.id in contents:
+                similarities[match.id] = match.score
+                contents[match.id] = match.metadata["contents"]
+        ranked = reciprocal_rank_fusion(
+            [list(similarities), [recipe_id for recipe_id, _, _ in lexical]]
+        )
 
-    results = [result.metadata["contents"] for result in query_results.matches]
+    ranked = ranked[:top_k]
+    tokens = count_tokens_many([contents[recipe_id] for recipe_id in ranked])
+    results = [
+        RecipeMatch(
+            recipe_id=recipe_id,
+            contents=contents[recipe_id],
+            similarity=similarities.get(recipe_id),
+            lexical_score=lexical_scores.get(recipe_id),
+            tokens=count,
+        )
+        for recipe_id, count in zip(ranked, tokens)
+    ]
+    query_cache.put(namespace, user_query, top_k, results, version)
 
     return results
 
 
-def extract_url(url: str) -> str:
+def select_recipes(
+    matches: List[RecipeMatch], max_tokens: int = config.RECIPE_CONTEXT_TOKENS
+) -> List[RecipeMatch]:
+    """
+    Packs matches into the prompt's recipe budget, best first.
+
+    A recipe that doesn't fit is skipped rather than ending the selection, so
+    a smaller, slightly less relevant recipe can still use the space.
+    """
+    # Recipes are joined with a blank line in the prompt
+    separator = count_tokens("\n\n")
+    selected = []
+    remaining = max_tokens
+    for match in matches:
+        cost = match.tokens + separator
+        if cost <= remaining:
+            selected.append(match)
+            remaining -= cost
+    return selected
+
+
+async def search_recipes(user_query: str, user_id: uuid.UUID) -> List[RecipeMatch]:
+    """Retrieves the recipes to put in a turn's prompt."""
+    return select_recipes(await find_relevant_recipes(user_query, user_id))
+
+
+def recipe_search_event_fields(matches: List[RecipeMatch]) -> Dict[str, Any]:
+    """Describes the chosen recipes for the recipe_search progress event."""
+    count = len(matches)
+    if count > 0:
+        message = f"Found {count} relevant recipe{'s' if count != 1 else ''}"
+    else:
+        message = "No relevant recipes found in your database"
+    return {
+        "count": count,
+        "message": message,
+        "recipes": [
+            {
+                "recipe_id": match.recipe_id,
+                "similarity": match.similarity,
+                "lexical_score": match.lexical_score,
+                "tokens": match.tokens,
+            }
+            for match in matches
+        ],
+    }
+
+
+async def namespace_version(namespace: str) -> int:
+    """The namespace's query cache version, moved on by any worker's writes."""
+    shared = await run_blocking(query_cache.load_shared_version, namespace)
+    return query_cache.observe(namespace, shared)
+
+
+async def record_namespace_write(namespace: str) -> int:
+    """Marks the namespace's cached searches stale; returns the new version."""
+    shared = await run_blocking(query_cache.store_shared_bump, namespace)
+    return query_cache.bump(namespace, shared)
+
+
+async def load_lexical_index(namespace: str, version: int) -> None:
+    """Builds the namespace's lexical index from the vector store if it's due."""
+    if not lexical_index.begin_load(namespace, version):
+        return
+
+    def load_documents() -> List[Tuple[str, str]]:
+        return [
+            (vector_id, metadata["contents"])
+            for vector_id, metadata in index.iter_metadata(namespace)
+            if "contents" in metadata
+        ]
+
+    documents: Optional[List[Tuple[str, str]]]
+    try:
+        documents = await run_blocking(load_documents)
+    except Exception as e:
+        logger.warning(f"Lexical search unavailable for {namespace}: {e}")
+        documents = None
+    lexical_index.finish_load(namespace, version, documents)
+
+
+async def extract_url(url: str) -> str:
     """
     Fetches the content from a recipe website URL and extracts the main text content.
 
+    Extracted text is cached by canonical URL. Fresh entries are served
+    without a request, and stale ones are revalidated with their ETag or
+    Last-Modified header, so a popular link is only downloaded and parsed
+    again once it changes. Pages with a JSON-LD recipe are also kept in the
+    shared persistent cache, under both the requested URL and the page's own
+    canonical link, so a recipe any user has pasted before resolves without
+    a download. Other pages, which may be error or bot-check pages served
+    with a 200, stay in this process's cache only.
+
     Args:
         url (str): The URL of the recipe page.
 
     Returns:
         str: The extracted recipe text, or an error message if extraction fails.
     """
+    key = canonical_url(url)
+    cached = page_cache.lookup(key)
+    if cached is not None and page_cache.is_fresh(cached):
+        return cached.text
+
     try:
-        # Spoofing User-Agent to mimic a real browser
-        headers = {
-            "User-Agent": (
-                "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
-                "(KHTML, like Gecko) Chrome/117.0.0.0 Safari/537.36"
+        if cached is None:
+            cached = await run_blocking(page_cache.load_persistent, key)
+            if cached is not None and page_cache.is_fresh(cached):
+                return cached.text
+
+        # Most recipe pages carry a JSON-LD recipe, so stop reading once it's in
+        scanner = RecipeScanner()
+        page = await page_fetcher.fetch(
+            url,
+            etag=cached.etag if cached else None,
+            last_modified=cached.last_modified if cached else None,
+            until=scanner.feed,
+        )
+        if page.not_modified and cached is not None:
+            page_cache.revalidated(key)
+            await run_blocking(page_cache.renew_persistent, key)
+            return cached.text
+
+        if scanner.recipe is not None:
+            text = format_recipe(scanner.recipe)
+        else:
+            text = await run_blocking(
+                extract_visible_text, page.content, config.URL_TEXT_MAX_TOKENS
             )
-        }
-
-        # Fetch the webpage
-        response = requests.get(url, headers=headers, timeout=10)
-        response.raise_for_status()  # Raise an error for unsuccessful requests
 
-        # Parse the HTML
-        soup = BeautifulSoup(response.content, "html.parser")
+        urls = [key]
+        link = scanner.canonical_link
+        # Only trust a canonical link on the same site, or any page could
+        # overwrite the cached copy of another site's recipe
+        if link and same_site(page.url, urljoin(page.url, link)):
+            urls.append(canonical_url(urljoin(page.url, link)))
+        stored = page_cache.put(urls, text, page.etag, page.last_modified)
+        if scanner.recipe is not None:
+            await run_blocking(page_cache.store_persistent, urls, stored)
+        return text
 
-        # Try to find the recipe content based on common HTML structures
-        # 1. Look for schema.org metadata
-        recipe_schema = soup.find("script", type="application/ld+json")
-        if recipe_schema:
-            print(f"Schema: {recipe_schema.string}")
-            import json
+    except Exception as e:
+        return f"An error occurred while processing the URL: {str(e)}"
 
-            schema_data = json.loads(recipe_schema.string)
-            if isinstance(schema_data, dict) and schema_data.get("@type") == "Recipe":
-                return schema_data.get(
-                    "recipeInstructions", "Recipe instructions not found."
-                )
 
-        # 2. Fallback to common HTML elements for recipes
-        main_content = soup.find(class_="recipe-content") or soup.find(id="recipe")
-        if main_content:
-            main_contents = main_content.get_text(strip=True)
-            if main_contents:
-                print(f"Main Contents: {main_contents}")
-                return main_contents
+async def purge_url_cache(url: Optional[str] = None) -> int:
+    """
+    Drops a URL's extracted page from the caches, or every page without one.
+    Returns the number of persistent entries removed.
+    """
+    return await run_blocking(page_cache.purge, canonical_url(url) if url else None)
 
-        # 3. If no specific structure is found, return the page's visible text
-        return soup.get_text(strip=True)
 
-    except Exception as e:
-        return f"An error occurred while processing the URL: {str(e)}"
+URL_PATTERN = re.compile(r"(https?://[^\s]+)")
 
 
-def process_text_with_urls(text: str) -> str:
+async def process_text_with_urls(text: str) -> str:
     """
     Detects URLs in the text, extracts their content, and appends it next to the URL.
 
+    Every URL in the message is fetched concurrently.
+
     Args:
         text (str): The input text containing URLs.
 
     Returns:
         str: The text with extracted content appended next to URLs.
     """
-    print(f"Extracting!: {text}")
-    # Regular expression to detect URLs
-    url_pattern = re.compile(r"(https?://[^\s]+)")
-
-    # Find all URLs in the text
-    urls = re.findall(url_pattern, text)
-
-    for url in urls:
-        print(f"URL: {url}")
-        # Extract content for each URL
-        extracted_content = extract_url(url)
+    urls = list(dict.fromkeys(URL_PATTERN.findall(text)))
+    extracted = await asyncio.gather(*(extract_url(url) for url in urls))
 
+    for url, extracted_content in zip(urls, extracted):
         # Append the extracted content next to the URL in the text
         text = text.replace(url, f"{url} (Extracted Content: {extracted_content})")
-        print(f"PROCESSED: {text}")
 
     return text
 
 
-def add_recipe(recipe_yaml: str, user_id: uuid.UUID) -> str:
-    recipe_id = str(uuid.uuid4())
-    update_recipe(recipe_id, recipe_yaml, user_id)
+async def add_recipe(recipe_yaml: str, user_id: uuid.UUID) -> str:
+    """
+    Stores a new recipe, or returns the id of an identical one the user has.
+
+    Raises:
+        ValueError: If the YAML can't be parsed.
+    """
+    result = (await add_recipes([parse_recipe_yaml(recipe_yaml)], user_id))[0]
+    if isinstance(result, Exception):
+        raise result
+    return result
+
+
+async def update_recipe(recipe_id: str, recipe_yaml: str, user_id: uuid.UUID) -> str:
+    """
+    Replaces a recipe's contents, skipping the embedding and upsert entirely
+    when the stored vector already has the same canonical content hash.
+    """
+    recipe_data = parse_recipe_yaml(recipe_yaml)
+    canonical = canonical_recipe_yaml(recipe_data)
+    digest = content_hash(canonical)
+
+    response = await run_blocking(
+        index.fetch, ids=[recipe_id], namespace=f"user_{user_id}"
+    )
+    stored = response.vectors.get(recipe_id)
+    if stored is not None and (stored.metadata or {}).get("content_hash") == digest:
+        logger.info(f"Recipe {recipe_id} is unchanged; skipping update")
+        return recipe_id
+
+    recipe_data["recipe_id"] = recipe_id
+    yaml_string = yaml.dump(recipe_data)
+    embeddings = await get_embeddings(canonical)
+
+    try:
+        await run_blocking(
+            index.upsert,
+            vectors=[recipe_vector(recipe_id, yaml_string, embeddings[0], digest)],
+            namespace=f"user_{user_id}",
+        )
+    finally:
+        # Even a failed upsert may have been applied, so drop cached searches
+        version = await record_namespace_write(f"user_{user_id}")
+    lexical_index.upsert(f"user_{user_id}", [(recipe_id, yaml_string)], version)
+
     return recipe_id
 
 
-def update_recipe(recipe_id: str, recipe_yaml: str, user_id: uuid.UUID) -> str:
+class PreparedRecipe(NamedTuple):
+    position: int
+    recipe_id: str
+    contents: str
+    canonical: str
+    content_hash: str
+
+
+async def add_recipes(
+    recipes: List[RecipeData], user_id: uuid.UUID
+) -> List[Union[str, Exception]]:
+    """
+    Adds many parsed recipes using batched embeddings and chunked upserts.
+
+    Recipes are embedded EMBEDDING_BATCH_SIZE at a time in a single request and
+    upserted UPSERT_BATCH_SIZE vectors at a time. Returns, in input order, the
+    recipe_id for each recipe or the exception that kept it from being stored;
+    a failed batch only fails the recipes in it.
+
+    Recipes whose canonical content matches one the user already has, or an
+    earlier one in ``recipes``, aren't stored again; they get the existing id.
+    New recipes get an id derived from the user and their content hash, so two
+    adds of the same recipe that race past the check, or a retried import
+    batch, overwrite one vector instead of storing a duplicate.
+    """
+    results: List[Union[str, Exception]] = [
+        ValueError("Recipe was not processed") for _ in recipes
+    ]
+    prepared: List[PreparedRecipe] = []
+    first_by_hash: Dict[str, int] = {}
+    repeats: List[Tuple[int, int]] = []
+    for position, recipe_data in enumerate(recipes):
+        canonical = canonical_recipe_yaml(recipe_data)
+        digest = content_hash(canonical)
+        if digest in first_by_hash:
+            repeats.append((position, first_by_hash[digest]))
+            continue
+        first_by_hash[digest] = position
+
+        recipe_id = recipe_vector_id(user_id, digest)
+        yaml_string = yaml.dump({**recipe_data, "recipe_id": recipe_id})
+        prepared.append(
+            PreparedRecipe(position, recipe_id, yaml_string, canonical, digest)
+        )
+
+    for batch in chunked(prepared, config.EMBEDDING_BATCH_SIZE):
+        try:
+            embeddings = await embed_texts([recipe.canonical for recipe in batch])
+            existing = await find_recipes_by_hash(
+                user_id, [recipe.content_hash for recipe in batch], embeddings[0]
+            )
+        except Exception as e:
+            for recipe in batch:
+                results[recipe.position] = e
+            continue
+
+        embedded = []
+        for recipe, embedding in zip(batch, embeddings):
+            if recipe.content_hash in existing:
+                results[recipe.position] = existing[recipe.content_hash]
+            else:
+                embedded.append((recipe, embedding))
+
+        for upsert_batch in chunked(embedded, config.UPSERT_BATCH_SIZE):
+            vectors = [
+                recipe_vector(
+                    recipe.recipe_id, recipe.contents, embedding, recipe.content_hash
+                )
+                for recipe, embedding in upsert_batch
+            ]
+            try:
+                await run_blocking(
+                    index.upsert, vectors=vectors, namespace=f"user_{user_id}"
+                )
+            except Exception as e:
+                for recipe, _ in upsert_batch:
+                    results[recipe.position] = e
+                continue
+            finally:
+                version = await record_namespace_write(f"user_{user_id}")
+            lexical_index.upsert(
+                f"user_{user_id}",
+                [(recipe.recipe_id, recipe.contents) for recipe, _ in upsert_batch],
+                version,
+            )
+            for recipe, _ in upsert_batch:
+                results[recipe.position] = recipe.recipe_id
+
+    for position, first in repeats:
+        results[position] = results[first]
+
+    return results
+
+
+async def find_recipes_by_hash(
+    user_id: uuid.UUID, hashes: List[str], vector: Embedding
+) -> Dict[str, str]:
+    """
+    Looks up which content hashes the user's namespace already holds.
+
+    Pinecone needs a query vector even for a pure metadata match, so any of
+    the batch's embeddings will do. Returns recipe ids keyed by content hash.
+
+    A user can hold several copies of one recipe from before ids were derived
+    from content, and those can crowd other hashes out of a single query. If
+    the query comes back full, the hashes it missed are looked up one by one.
+    """
+    top_k = len(hashes) * HASH_MATCHES_PER_RECIPE
+    matches = await _query_recipes_by_hash(user_id, hashes, vector, top_k)
+    existing = _recipe_ids_by_hash(matches)
+    if len(matches) >= top_k:
+        for digest in hashes:
+            if digest not in existing:
+                single = await _query_recipes_by_hash(user_id, [digest], vector, 1)
+                existing.update(_recipe_ids_by_hash(single))
+    return existing
+
+
+async def _query_recipes_by_hash(
+    user_id: uuid.UUID, hashes: List[str], vector: Embedding, top_k: int
+) -> List[VectorMatch]:
+    response = await run_blocking(
+        index.query,
+        namespace=f"user_{user_id}",
+        vector=vector,
+        top_k=top_k,
+        filter={"content_hash": {"$in": hashes}},
+        include_values=False,
+        include_metadata=True,
+    )
+    return response.matches
+
+
+def _recipe_ids_by_hash(matches: List[VectorMatch]) -> Dict[str, str]:
+    return {
+        match.metadata["content_hash"]: match.id
+        for match in matches
+        if match.metadata and "content_hash" in match.metadata
+    }
+
+
+def recipe_vector_id(user_id: uuid.UUID, digest: str) -> str:
+    """The id a new recipe with this content hash is stored under."""
+    return str(uuid.uuid5(RECIPE_ID_NAMESPACE, f"{user_id}:{digest}"))
+
+
+def canonical_recipe_yaml(recipe_data: RecipeData) -> str:
+    """
+    Serializes a recipe the same way regardless of key order, quoting or the
+    recipe_id the model may have copied into it. This is what gets embedded
+    and hashed.
+    """
+    if isinstance(recipe_data, dict):
+        recipe_data = {k: v for k, v in recipe_data.items() if k != "recipe_id"}
+    return yaml.safe_dump(recipe_data, sort_keys=True, allow_unicode=True)
+
+
+def recipe_vector(
+    recipe_id: str, yaml_string: str, embedding: Embedding, digest: str
+) -> Dict[str, Any]:
+    return {
+        "id": recipe_id,
+        "values": embedding,
+        "metadata": {
+            "contents": yaml_string,
+            "content_hash": digest,
+        },
+    }
+
+
+def chunked(items: List[T], size: int) -> List[List[T]]:
+    return [items[i : i + size] for i in range(0, len(items), size)]
+
+
+def parse_recipe_yaml(recipe_yaml: str) -> RecipeData:
+    """
+    Parses recipe YAML written by the model, repairing unescaped quotes.
+
+    Raises:
+        ValueError: If the YAML can't be parsed even after the repair.
+    """
     try:
         recipe_data = yaml.safe_load(recipe_yaml)
     except yaml.YAMLError as e:
@@ -609,23 +1289,4 @@ def update_recipe(recipe_id: str, recipe_yaml: str, user_id: uuid.UUID) -> str:
             print(f"Could not fix YAML: {e2}")
             raise ValueError(f"Invalid YAML format in recipe: {e}")
 
-    recipe_data["recipe_id"] = recipe_id
-    yaml_string = yaml.dump(recipe_data)
-    embeddings = get_embeddings(yaml_string)
-
-    index.upsert(
-        vectors=[
-            {
-                "id": recipe_id,
-                "values": embeddings[
-                    0
-                ],  # TODO: Understand why we're only using the first one
-                "metadata": {
-                    "contents": yaml_string,
-                },
-            },
-        ],
-        namespace=f"user_{user_id}",
-    )
-
-    return recipe_id
+    return recipe_data
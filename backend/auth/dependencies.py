@@ -1,5 +1,6 @@
 from typing import Optional
 
+from config import config
 from fastapi import Cookie, Depends, HTTPException, status
 from sqlalchemy.orm import Session
 from storage.dependencies import get_db
@@ -38,6 +39,15 @@ async def get_current_user(
     return user
 
 
+async def get_admin_user(user: User = Depends(get_current_user)) -> User:
+    """Get the current user, who must be listed in ADMIN_EMAILS."""
+    if str(user.email).lower() not in config.ADMIN_EMAILS:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN, detail="Admin access required"
+        )
+    return user
+
+
 async def get_optional_user(
     access_token: Optional[str] = Cookie(None), db: Session = Depends(get_db)
 ) -> Optional[User]:
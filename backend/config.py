@@ -1,4 +1,5 @@
 import os
+from typing import List
 
 
 class Config:
@@ -24,6 +25,67 @@ class Config:
     DEBUG: bool = os.getenv("DEBUG", "false").lower() == "true"
     RELOAD: bool = os.getenv("RELOAD", "true").lower() == "true"
     SECRET_KEY: str = os.getenv("SECRET_KEY", "dev-secret-key-change-in-production")
+    # Comma-separated emails of users allowed to use the /admin endpoints
+    ADMIN_EMAILS: List[str] = [
+        email.strip().lower()
+        for email in os.getenv("ADMIN_EMAILS", "").split(",")
+        if email.strip()
+    ]
+
+    # Concurrency
+    BLOCKING_IO_WORKERS: int = int(os.getenv("BLOCKING_IO_WORKERS", "32"))
+    TOOL_CALL_CONCURRENCY: int = int(os.getenv("TOOL_CALL_CONCURRENCY", "4"))
+    # Photo attachments are decoded and resized on their own pool; turns past
+    # IMAGE_WORKERS + IMAGE_QUEUE_SIZE are turned away until it drains
+    IMAGE_WORKERS: int = int(os.getenv("IMAGE_WORKERS", "4"))
+    IMAGE_QUEUE_SIZE: int = int(os.getenv("IMAGE_QUEUE_SIZE", "8"))
+
+    # Bulk ingest
+    EMBEDDING_BATCH_SIZE: int = int(os.getenv("EMBEDDING_BATCH_SIZE", "100"))
+    UPSERT_BATCH_SIZE: int = int(os.getenv("UPSERT_BATCH_SIZE", "100"))
+    IMPORT_WORKER_ENABLED: bool = (
+        os.getenv("IMPORT_WORKER_ENABLED", "true").lower() == "true"
+    )
+    IMPORT_POLL_INTERVAL_SECONDS: float = float(
+        os.getenv("IMPORT_POLL_INTERVAL_SECONDS", "2")
+    )
+    IMPORT_JOB_LEASE_SECONDS: int = int(os.getenv("IMPORT_JOB_LEASE_SECONDS", "300"))
+
+    # Vector store: "pinecone", or "local" for the in-process NumPy index
+    VECTOR_STORE: str = os.getenv("VECTOR_STORE", "pinecone").lower()
+    PINECONE_INDEX: str = os.getenv("PINECONE_INDEX", "recipes1")
+    LOCAL_VECTOR_STORE_PATH: str = os.getenv("LOCAL_VECTOR_STORE_PATH", "data/vectors")
+
+    # Recipe retrieval
+    RECIPE_SEARCH_CANDIDATES: int = int(os.getenv("RECIPE_SEARCH_CANDIDATES", "10"))
+    RECIPE_MIN_SIMILARITY: float = float(os.getenv("RECIPE_MIN_SIMILARITY", "0.25"))
+    RECIPE_CONTEXT_TOKENS: int = int(os.getenv("RECIPE_CONTEXT_TOKENS", "3000"))
+
+    # Caching
+    EMBEDDING_CACHE_SIZE: int = int(os.getenv("EMBEDDING_CACHE_SIZE", "4096"))
+    EMBEDDING_CACHE_PERSIST: bool = (
+        os.getenv("EMBEDDING_CACHE_PERSIST", "true").lower() == "true"
+    )
+    QUERY_CACHE_SIZE: int = int(os.getenv("QUERY_CACHE_SIZE", "1024"))
+    # Share write versions through the database, so every worker's caches see
+    # every worker's writes
+    QUERY_CACHE_PERSIST: bool = (
+        os.getenv("QUERY_CACHE_PERSIST", "true").lower() == "true"
+    )
+    LEXICAL_INDEX_NAMESPACES: int = int(os.getenv("LEXICAL_INDEX_NAMESPACES", "256"))
+    URL_CACHE_SIZE: int = int(os.getenv("URL_CACHE_SIZE", "256"))
+    URL_CACHE_TTL_SECONDS: int = int(os.getenv("URL_CACHE_TTL_SECONDS", "3600"))
+    URL_CACHE_PERSIST: bool = os.getenv("URL_CACHE_PERSIST", "true").lower() == "true"
+
+    # URL extraction
+    URL_FETCH_TIMEOUT_SECONDS: float = float(
+        os.getenv("URL_FETCH_TIMEOUT_SECONDS", "10")
+    )
+    URL_FETCH_MAX_BYTES: int = int(os.getenv("URL_FETCH_MAX_BYTES", "2000000"))
+    URL_FETCH_PER_HOST: int = int(os.getenv("URL_FETCH_PER_HOST", "2"))
+    URL_FETCH_MAX_CONNECTIONS: int = int(os.getenv("URL_FETCH_MAX_CONNECTIONS", "20"))
+    # Cap on page text sent to the model when a page has no structured recipe
+    URL_TEXT_MAX_TOKENS: int = int(os.getenv("URL_TEXT_MAX_TOKENS", "2000"))
 
     @property
     def DATABASE_URL(self) -> str:
@@ -36,10 +98,11 @@ class Config:
         """Validate that required environment variables are set."""
         required_vars = [
             ("OPENAI_API_KEY", self.OPENAI_API_KEY),
-            ("PINECONE_API_KEY", self.PINECONE_API_KEY),
             ("GOOGLE_CLIENT_ID", self.GOOGLE_CLIENT_ID),
             ("GOOGLE_CLIENT_SECRET", self.GOOGLE_CLIENT_SECRET),
         ]
+        if self.VECTOR_STORE == "pinecone":
+            required_vars.append(("PINECONE_API_KEY", self.PINECONE_API_KEY))
 
         missing_vars = [name for name, value in required_vars if not value]
 
@@ -0,0 +1,293 @@
+import codecs
+import html
+import json
+import re
+from typing import Any, Dict, Iterator, List, Optional, Union
+
+import yaml
+from bs4 import BeautifulSoup
+from utils.tokens import truncate_tokens
+
+try:
+    from selectolax.lexbor import LexborHTMLParser
+except ImportError:  # selectolax isn't installed
+    LexborHTMLParser = None  # type: ignore
+
+try:
+    import lxml  # noqa: F401
+
+    SOUP_FEATURES = "lxml"
+except ImportError:  # lxml isn't installed
+    SOUP_FEATURES = "html.parser"
+
+JSON_LD_TYPE_PATTERN = re.compile(
+    r"\btype\s*=\s*[\"']?application/ld\+json", re.IGNORECASE
+)
+SCRIPT_CLOSE = "</script"
+LINK_TAG_PATTERN = re.compile(r"<link\b[^>]*>", re.IGNORECASE)
+CANONICAL_REL_PATTERN = re.compile(r"\brel\s*=\s*[\"']?canonical\b", re.IGNORECASE)
+HREF_PATTERN = re.compile(r"\bhref\s*=\s*(?:\"([^\"]*)\"|'([^']*)'|([^\s>]+))", re.I)
+# How much of a page to search for its <head> links
+HEAD_MAX_CHARS = 262144
+TAG_PATTERN = re.compile(r"<[^>]+>")
+DURATION_PATTERN = re.compile(
+    r"P(?:(?P<days>\d+)D)?(?:T(?:(?P<hours>\d+)H)?(?:(?P<minutes>\d+)M)?"
+    r"(?:(?P<seconds>\d+(?:\.\d+)?)S)?)?$",
+    re.IGNORECASE,
+)
+
+UNITS = (
+    r"g|grams?|kg|kilograms?|mg|ml|millilit(?:er|re)s?|l|lit(?:er|re)s?|cl|dl|"
+    r"oz|ounces?|lbs?|pounds?|cups?|c|tbsps?|tablespoons?|tsps?|teaspoons?|"
+    r"cloves?|pinch(?:es)?|dash(?:es)?|cans?|tins?|slices?|sticks?|"
+    r"bunch(?:es)?|handfuls?|sprigs?|quarts?|pints?|inch(?:es)?"
+)
+FRACTIONS = "¼½¾⅓⅔⅛⅜⅝⅞"
+NUMBER = rf"(?:\d+(?:[.,/]\d+)?[{FRACTIONS}]?|[{FRACTIONS}])"
+# "400g spaghetti", "1 1/2 cups flour", "2-3 cloves garlic", "½ tsp salt"
+QUANTITY_PATTERN = re.compile(
+    rf"^(?P<qty>(?:about\s+)?{NUMBER}(?:\s*(?:-|–|to)\s*{NUMBER}|\s+{NUMBER})*"
+    rf"(?:\s*(?:{UNITS})\b\.?)?)\s+(?P<name>\S.*)$",
+    re.IGNORECASE,
+)
+
+# Elements that never hold the recipe itself
+BOILERPLATE_TAGS = [
+    "script",
+    "style",
+    "noscript",
+    "template",
+    "svg",
+    "iframe",
+    "form",
+    "nav",
+    "header",
+    "footer",
+    "aside",
+]
+
+RecipeData = Dict[str, Any]
+
+
+def find_canonical_link(page: str) -> Optional[str]:
+    """Returns the href of the page's ``<link rel="canonical">``, if any."""
+    for tag in LINK_TAG_PATTERN.findall(page):
+        if CANONICAL_REL_PATTERN.search(tag):
+            href = HREF_PATTERN.search(tag)
+            if href:
+                return html.unescape(next(group for group in href.groups() if group))
+    return None
+
+
+def format_recipe(recipe: RecipeData) -> str:
+    return yaml.safe_dump(
+        {"recipe": recipe}, sort_keys=False, allow_unicode=True, width=1000
+    )
+
+
+class RecipeScanner:
+    """
+    Looks for a JSON-LD recipe in a page as it downloads.
+
+    ``feed`` takes the body a chunk at a time and returns True once a recipe
+    has been found, so the caller can stop reading the rest of the page. Only
+    the text since the last closing ``</script>`` is kept, and each byte is
+    searched once. The page's ``<head>`` is kept too, for its canonical link.
+    """
+
+    def __init__(self) -> None:
+        self.recipe: Optional[RecipeData] = None
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self._buffer = ""
+        self._search_from = 0
+        self._head = ""
+        self._head_done = False
+
+    @property
+    def canonical_link(self) -> Optional[str]:
+        return find_canonical_link(self._head)
+
+    def feed(self, chunk: bytes) -> bool:
+        if self.recipe is not None:
+            return True
+        text = self._decoder.decode(chunk)
+        self._buffer += text
+        if not self._head_done:
+            self._head += text
+            self._head_done = (
+                "</head" in self._head or len(self._head) >= HEAD_MAX_CHARS
+            )
+
+        while True:
+            close = self._buffer.find(SCRIPT_CLOSE, self._search_from)
+            if close == -1:
+                # A closing tag may be split across chunks
+                self._search_from = max(0, len(self._buffer) - len(SCRIPT_CLOSE))
+                return False
+
+            start = self._buffer.rfind("<script", 0, close)
+            tag_end = self._buffer.find(">", start, close) if start != -1 else -1
+            if tag_end != -1 and JSON_LD_TYPE_PATTERN.search(
+                self._buffer, start, tag_end
+            ):
+                self.recipe = _parse_json_ld(self._buffer[tag_end + 1 : close])
+                if self.recipe is not None:
+                    self._buffer = ""
+                    return True
+
+            self._buffer = self._buffer[close + len(SCRIPT_CLOSE) :]
+            self._search_from = 0
+
+
+def recipe_from_json_ld(node: Dict[str, Any]) -> RecipeData:
+    """Maps schema.org Recipe fields onto the recipe YAML structure."""
+    recipe: RecipeData = {}
+    title = _clean(node.get("name"))
+    if title:
+        recipe["title"] = title
+
+    cooking_time = _duration(node.get("totalTime")) or _duration(node.get("cookTime"))
+    if cooking_time:
+        recipe["estimated_cooking_time"] = cooking_time
+
+    serves = _serves(node.get("recipeYield"))
+    if serves is not None:
+        recipe["serves"] = serves
+
+    ingredients = [
+        _ingredient(text)
+        for text in map(_clean, _as_list(node.get("recipeIngredient")))
+        if text
+    ]
+    if ingredients:
+        recipe["ingredients"] = ingredients
+
+    steps = [{"step": step} for step in _instructions(node.get("recipeInstructions"))]
+    if steps:
+        recipe["steps"] = steps
+
+    notes = _clean(node.get("description"))
+    if notes:
+        recipe["notes"] = notes
+
+    # Without ingredients or steps there's nothing to cook from
+    return recipe if ingredients or steps else {}
+
+
+def extract_visible_text(content: bytes, max_tokens: int) -> str:
+    """
+    The page's main visible text without boilerplate, capped at max_tokens.
+
+    Parses with selectolax when it's installed, which is several times faster
+    than BeautifulSoup on large pages; BeautifulSoup uses lxml if available.
+    """
+    if LexborHTMLParser is not None:
+        tree = LexborHTMLParser(content)
+        tree.strip_tags(BOILERPLATE_TAGS)
+        main = (
+            tree.css_first(".recipe-content")
+            or tree.css_first("#recipe")
+            or tree.css_first("article")
+            or tree.css_first("main")
+            or tree.root
+        )
+        text = main.text(separator="\n", strip=True) if main is not None else ""
+    else:
+        soup = BeautifulSoup(content, SOUP_FEATURES)
+        for element in soup(BOILERPLATE_TAGS):
+            element.decompose()
+        main = (
+            soup.find(class_="recipe-content")
+            or soup.find(id="recipe")
+            or soup.find("article")
+            or soup.find("main")
+            or soup
+        )
+        text = main.get_text(separator="\n", strip=True)
+    return truncate_tokens(text, max_tokens)
+
+
+def _parse_json_ld(block: str) -> Optional[RecipeData]:
+    try:
+        data = json.loads(block.strip())
+    except ValueError:
+        return None
+    for node in _iter_recipe_nodes(data):
+        recipe = recipe_from_json_ld(node)
+        if recipe:
+            return recipe
+    return None
+
+
+def _iter_recipe_nodes(data: Any) -> Iterator[Dict[str, Any]]:
+    if isinstance(data, list):
+        for item in data:
+            yield from _iter_recipe_nodes(item)
+    elif isinstance(data, dict):
+        types = _as_list(data.get("@type"))
+        if any(
+            isinstance(t, str) and re.split(r"[/:]", t)[-1] == "Recipe" for t in types
+        ):
+            yield data
+        for key in ("@graph", "mainEntity"):
+            if key in data:
+                yield from _iter_recipe_nodes(data[key])
+
+
+def _instructions(value: Any) -> List[str]:
+    if isinstance(value, str):
+        return [line for line in (_clean(line) for line in value.splitlines()) if line]
+    if isinstance(value, list):
+        return [step for item in value for step in _instructions(item)]
+    if isinstance(value, dict):
+        if "itemListElement" in value:  # HowToSection
+            return _instructions(value["itemListElement"])
+        text = _clean(value.get("text") or value.get("name"))
+        return [text] if text else []
+    return []
+
+
+def _ingredient(text: str) -> Dict[str, str]:
+    match = QUANTITY_PATTERN.match(text)
+    if match is None:
+        return {"name": text}
+    return {"name": match.group("name"), "qty": match.group("qty").strip()}
+
+
+def _serves(value: Any) -> Union[int, str, None]:
+    for item in _as_list(value):
+        if isinstance(item, int) and not isinstance(item, bool):
+            return item
+        text = _clean(item)
+        if text:
+            return int(text) if text.isdigit() else text
+    return None
+
+
+def _duration(value: Any) -> Optional[str]:
+    """Turns an ISO 8601 duration like PT1H30M into "1 hour 30 minutes"."""
+    if not isinstance(value, str):
+        return None
+    match = DURATION_PATTERN.match(value.strip())
+    if match is None:
+        return _clean(value) or None
+
+    parts = []
+    for unit in ("days", "hours", "minutes"):
+        amount = int(match.group(unit) or 0)
+        if amount:
+            parts.append(f"{amount} {unit if amount != 1 else unit[:-1]}")
+    return " ".join(parts) or None
+
+
+def _as_list(value: Any) -> List[Any]:
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+
+def _clean(value: Any) -> str:
+    if not isinstance(value, str):
+        return ""
+    text = TAG_PATTERN.sub(" ", html.unescape(value))
+    return " ".join(text.split())
@@ -0,0 +1,389 @@
+import asyncio
+import codecs
+import logging
+import uuid
+from itertools import islice
+from typing import (
+    Any,
+    AsyncIterator,
+    BinaryIO,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+)
+
+import yaml
+from assistant import add_recipes, run_blocking
+from config import config
+from sqlalchemy.orm import Session
+from storage import SessionLocal
+from storage.imports import (
+    ImportJob,
+    ImportJobRecipe,
+    add_import_job_recipes,
+    claim_import_job,
+    complete_import_job,
+    create_import_job,
+    get_pending_import_recipes,
+    queue_import_job,
+    record_import_batch,
+)
+
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:  # libyaml isn't available
+    from yaml import SafeLoader  # type: ignore
+
+logger = logging.getLogger(__name__)
+
+RecipeData = Dict[str, Any]
+# (position in the file, recipe, error)
+UploadItem = Tuple[Optional[int], Optional[RecipeData], Optional[str]]
+
+
+def iter_upload_recipes(stream: BinaryIO) -> Iterator[UploadItem]:
+    """
+    Parses an uploaded recipe file one recipe at a time.
+
+    The YAML can contain a single recipe, a ``recipes:`` list, or multiple
+    recipe documents separated by ``---``. Items of a ``recipes:`` list are
+    yielded as soon as each one is parsed, so memory use is bounded by the
+    largest recipe rather than the size of the file.
+
+    Yields ``(position, recipe, None)`` for each valid recipe and
+    ``(position, None, error)`` for each invalid one. Errors about the file as
+    a whole have no position.
+
+    Raises:
+        yaml.YAMLError: If the file isn't valid YAML. Recipes before the error
+            have already been yielded.
+        UnicodeDecodeError: If the file isn't UTF-8.
+    """
+    loader = SafeLoader(codecs.getreader("utf-8")(stream))
+    try:
+        loader.get_event()  # StreamStartEvent
+        documents = 0
+        position = 0
+        # An invalid first document is a file-level error unless more follow
+        pending: Optional[Tuple[str, str]] = None
+
+        while not loader.check_event(yaml.StreamEndEvent):
+            loader.get_event()  # DocumentStartEvent
+            documents += 1
+            if documents == 2 and pending is not None:
+                yield 0, None, pending[1]
+                pending = None
+
+            anchors: Dict[str, yaml.Node] = {}
+            if loader.check_event(yaml.MappingStartEvent):
+                items = _iter_document_mapping(loader, anchors)
+            else:
+                items = iter([loader.construct_document(_compose(loader, anchors))])
+
+            for item in items:
+                if isinstance(item, _RecipeListItem):
+                    yield _check_recipe(position, item.value)
+                    position += 1
+                elif isinstance(item, dict) and "recipe" in item:
+                    yield position, item, None
+                    position += 1
+                elif documents == 1:
+                    pending = _invalid_document(item)
+                    position += 1
+                else:
+                    yield _check_recipe(position, item)
+                    position += 1
+
+            loader.get_event()  # DocumentEndEvent
+
+        if pending is not None:
+            yield None, None, pending[0]
+    finally:
+        loader.dispose()
+
+
+async def iter_upload_batches(
+    stream: BinaryIO, batch_size: int
+) -> AsyncIterator[List[UploadItem]]:
+    """Parses an upload in batches, off the event loop."""
+    items = iter_upload_recipes(stream)
+    while True:
+        batch = await run_blocking(lambda: list(islice(items, batch_size)))
+        if not batch:
+            return
+        yield batch
+
+
+def upload_error(position: Optional[int], error: str) -> str:
+    return error if position is None else f"Recipe {position + 1}: {error}"
+
+
+async def import_recipe_upload(
+    stream: BinaryIO, user_id: uuid.UUID
+) -> Tuple[int, List[str]]:
+    """
+    Embeds and stores an uploaded file's recipes as they are parsed.
+
+    Each batch is sent to the embed/upsert pipeline before the next one is
+    read. Returns the number of recipes added and the errors, in file order.
+    A YAML error stops the import but keeps the recipes stored before it.
+    """
+    recipes_added = 0
+    errors: List[str] = []
+
+    try:
+        async for batch in iter_upload_batches(stream, config.EMBEDDING_BATCH_SIZE):
+            valid = [
+                (position, data) for position, data, _ in batch if data is not None
+            ]
+            results = await add_recipes([data for _, data in valid], user_id)
+            failed = {
+                position: str(result)
+                for (position, _), result in zip(valid, results)
+                if isinstance(result, Exception)
+            }
+            recipes_added += len(valid) - len(failed)
+            failed.update(
+                (position, error) for position, _, error in batch if error is not None
+            )
+            errors.extend(
+                upload_error(position, error)
+                for position, error in sorted(
+                    failed.items(), key=lambda item: -1 if item[0] is None else item[0]
+                )
+            )
+    except yaml.YAMLError as e:
+        errors.append(f"YAML parsing error: {str(e)}")
+
+    return recipes_added, errors
+
+
+async def queue_recipe_upload(
+    db: Session, user_id: uuid.UUID, filename: Optional[str], stream: BinaryIO
+) -> ImportJob:
+    """
+    Parses an upload into a queued import job, one batch of rows at a time.
+    Parsing and the database writes run on the blocking pool.
+
+    Raises:
+        yaml.YAMLError: If the file isn't valid YAML. Nothing is queued.
+        UnicodeDecodeError: If the file isn't UTF-8.
+    """
+    job = await run_blocking(create_import_job, db, user_id, filename)
+    errors: List[str] = []
+    try:
+        async for batch in iter_upload_batches(stream, config.EMBEDDING_BATCH_SIZE):
+            await run_blocking(add_upload_batch, db, job, batch)
+            errors.extend(
+                upload_error(position, error)
+                for position, _, error in batch
+                if error is not None
+            )
+    except Exception:
+        await run_blocking(db.rollback)
+        raise
+
+    await run_blocking(queue_import_job, db, job, errors)
+    return job
+
+
+def add_upload_batch(db: Session, job: ImportJob, batch: List[UploadItem]) -> None:
+    """Writes a parsed batch's valid recipes to the job. Blocking."""
+    add_import_job_recipes(
+        db,
+        job,
+        [
+            (position, yaml.dump(data))
+            for position, data, _ in batch
+            if data is not None
+        ],
+    )
+
+
+class _RecipeListItem:
+    """An item of a ``recipes:`` list, as opposed to a whole document."""
+
+    def __init__(self, value: Any) -> None:
+        self.value = value
+
+
+def _iter_document_mapping(
+    loader: SafeLoader, anchors: Dict[str, yaml.Node]
+) -> Iterator[Any]:
+    """
+    Walks a top-level mapping, yielding ``recipes:`` items as they're parsed.
+
+    Any other keys are composed as usual. The document itself is yielded last,
+    unless it held a ``recipes:`` list.
+    """
+    start = loader.get_event()
+    node = yaml.MappingNode(
+        _resolve_tag(loader, yaml.MappingNode, start),
+        [],
+        start.start_mark,
+        None,
+        flow_style=start.flow_style,
+    )
+    if start.anchor is not None:
+        anchors[start.anchor] = node
+
+    streamed = False
+    while not loader.check_event(yaml.MappingEndEvent):
+        key = _compose(loader, anchors)
+        if (
+            isinstance(key, yaml.ScalarNode)
+            and key.value == "recipes"
+            and loader.check_event(yaml.SequenceStartEvent)
+        ):
+            loader.get_event()
+            while not loader.check_event(yaml.SequenceEndEvent):
+                item = _compose(loader, anchors)
+                yield _RecipeListItem(loader.construct_document(item))
+            loader.get_event()
+            streamed = True
+        else:
+            node.value.append((key, _compose(loader, anchors)))
+    node.end_mark = loader.get_event().end_mark
+
+    if not streamed:
+        yield loader.construct_document(node)
+
+
+def _compose(loader: SafeLoader, anchors: Dict[str, yaml.Node]) -> yaml.Node:
+    """
+    Builds the node for the next value from parser events.
+
+    This is what ``yaml.compose`` does, but it works with the libyaml loader,
+    which only exposes whole documents through its own composer.
+    """
+    event = loader.get_event()
+    if isinstance(event, yaml.AliasEvent):
+        if event.anchor not in anchors:
+            raise yaml.composer.ComposerError(
+                None, None, f"found undefined alias {event.anchor}", event.start_mark
+            )
+        return anchors[event.anchor]
+
+    node: yaml.Node
+    if isinstance(event, yaml.ScalarEvent):
+        node = yaml.ScalarNode(
+            _resolve_tag(loader, yaml.ScalarNode, event),
+            event.value,
+            event.start_mark,
+            event.end_mark,
+            style=event.style,
+        )
+        if event.anchor is not None:
+            anchors[event.anchor] = node
+    elif isinstance(event, yaml.SequenceStartEvent):
+        node = yaml.SequenceNode(
+            _resolve_tag(loader, yaml.SequenceNode, event),
+            [],
+            event.start_mark,
+            None,
+            flow_style=event.flow_style,
+        )
+        if event.anchor is not None:
+            anchors[event.anchor] = node
+        while not loader.check_event(yaml.SequenceEndEvent):
+            node.value.append(_compose(loader, anchors))
+        node.end_mark = loader.get_event().end_mark
+    else:
+        node = yaml.MappingNode(
+            _resolve_tag(loader, yaml.MappingNode, event),
+            [],
+            event.start_mark,
+            None,
+            flow_style=event.flow_style,
+        )
+        if event.anchor is not None:
+            anchors[event.anchor] = node
+        while not loader.check_event(yaml.MappingEndEvent):
+            key = _compose(loader, anchors)
+            node.value.append((key, _compose(loader, anchors)))
+        node.end_mark = loader.get_event().end_mark
+    return node
+
+
+def _resolve_tag(loader: SafeLoader, kind: type, event: yaml.NodeEvent) -> str:
+    tag = getattr(event, "tag", None)
+    if tag is None or tag == "!":
+        value = event.value if isinstance(event, yaml.ScalarEvent) else None
+        tag = loader.resolve(kind, value, event.implicit)
+    return tag
+
+
+def _check_recipe(position: int, item: Any) -> UploadItem:
+    if not isinstance(item, dict):
+        return position, None, "Must be an object"
+    if "recipe" not in item:
+        return position, None, "Missing 'recipe' key"
+    return position, item, None
+
+
+def _invalid_document(document: Any) -> Tuple[str, str]:
+    """Returns the file-level and per-document errors for a bad document."""
+    if not isinstance(document, dict):
+        return "Invalid format: YAML document must be an object", "Must be an object"
+    return (
+        "Invalid format: YAML must contain 'recipe' or 'recipes' key",
+        "Missing 'recipe' key",
+    )
+
+
+async def process_import_job(db: Session, job: ImportJob) -> None:
+    """
+    Imports a claimed job's pending recipes one batch at a time.
+
+    Progress is committed after every batch, so a job interrupted by a restart
+    picks up at the first batch that wasn't recorded. Recipe ids are derived
+    from their content, so a batch that is re-run overwrites its vectors
+    rather than duplicating them. Database work runs on the blocking pool.
+    """
+    # Reading the job's columns may reload it after the claim's commit
+    job_id, user_id = await run_blocking(lambda: (job.id, job.user_id))
+    logger.info(f"Processing import job {job_id}")
+    while True:
+        recipes, contents = await run_blocking(load_import_batch, db, job_id)
+        if not recipes:
+            break
+
+        results = await add_recipes(contents, user_id)
+        await run_blocking(record_import_batch, db, job, recipes, results)
+
+    await run_blocking(complete_import_job, db, job)
+
+
+def load_import_batch(
+    db: Session, job_id: uuid.UUID
+) -> Tuple[List[ImportJobRecipe], List[RecipeData]]:
+    """Loads the next pending recipes with their parsed contents."""
+    recipes = get_pending_import_recipes(db, job_id, config.EMBEDDING_BATCH_SIZE)
+    return recipes, [yaml.safe_load(str(recipe.contents)) for recipe in recipes]
+
+
+async def run_import_worker(
+    session_factory: Callable[[], Session] = SessionLocal,
+) -> None:
+    """Claims and processes queued import jobs until cancelled."""
+    while True:
+        try:
+            db = session_factory()
+            try:
+                job = await run_blocking(
+                    claim_import_job, db, config.IMPORT_JOB_LEASE_SECONDS
+                )
+                if job is not None:
+                    await process_import_job(db, job)
+                    continue
+            finally:
+                await run_blocking(db.close)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Import worker failed; the job will be retried")
+
+        await asyncio.sleep(config.IMPORT_POLL_INTERVAL_SECONDS)
@@ -1,10 +1,23 @@
+import asyncio
 import json
 import os
-from typing import List, Optional
+import uuid
+from contextlib import asynccontextmanager, suppress
+from typing import Any, AsyncIterator, Dict, List, Optional
 
 import yaml
-from assistant import add_recipe, chat, chat_with_feedback
-from auth.dependencies import get_current_user
+from assistant import (
+    chat,
+    chat_with_feedback,
+    embedding_cache,
+    image_pool,
+    page_cache,
+    page_fetcher,
+    purge_url_cache,
+    query_cache,
+    run_blocking,
+)
+from auth.dependencies import get_admin_user, get_current_user
 from auth.models import User
 from auth.routes import router as auth_router
 from config import config
@@ -12,14 +25,44 @@ from fastapi import Depends, FastAPI, File, Form, HTTPException, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import FileResponse, HTMLResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
+from importer import import_recipe_upload, queue_recipe_upload, run_import_worker
 from pydantic import BaseModel
+from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm import Session
+from storage import SessionLocal
 from storage.dependencies import get_db
+from storage.imports import (
+    COMPLETED,
+    ImportJob,
+    ImportJobResponse,
+    get_import_job,
+    import_job_progress,
+    import_job_response,
+)
+from utils.tokens import prewarm_encoding
+from utils.workers import PoolSaturated
 
 # Validate required environment variables on startup
 config.validate_required_vars()
 
-app = FastAPI()
+IMPORT_PROGRESS_INTERVAL_SECONDS = 1
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    prewarm_encoding()
+    worker = None
+    if config.IMPORT_WORKER_ENABLED:
+        worker = asyncio.create_task(run_import_worker())
+    yield
+    if worker is not None:
+        worker.cancel()
+        with suppress(asyncio.CancelledError):
+            await worker
+    await page_fetcher.aclose()
+
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -72,6 +115,28 @@ async def favicon() -> FileResponse:
     return FileResponse(os.path.join("static", "favicon.ico"))
 
 
+@app.get("/metrics")
+async def metrics() -> Dict[str, Any]:
+    """Cache and worker pool counters for sizing and monitoring."""
+    return {
+        "embedding_cache": embedding_cache.stats(),
+        "query_cache": query_cache.stats(),
+        "url_cache": page_cache.stats(),
+        "image_pool": image_pool.stats(),
+    }
+
+
+@app.delete("/admin/url-cache")
+async def purge_extracted_pages(
+    url: Optional[str] = None, admin: User = Depends(get_admin_user)
+) -> Dict[str, int]:
+    """Purge a URL's cached extraction, or every cached page without one."""
+    try:
+        return {"purged": await purge_url_cache(url)}
+    except SQLAlchemyError as e:
+        raise HTTPException(status_code=503, detail=f"Cache purge failed: {str(e)}")
+
+
 @app.post("/chat", response_model=MessageResponse)
 async def chat_with_assistant(
     message: str = Form(...),
@@ -89,9 +154,16 @@ async def chat_with_assistant(
     thread_id = payload.thread_id
 
     # Call the chat function with the message and attachment
-    response, new_thread_id = await chat(
-        db, current_user, user_message, thread_id, attachment
-    )
+    try:
+        response, new_thread_id = await chat(
+            db, current_user, user_message, thread_id, attachment
+        )
+    except PoolSaturated:
+        raise HTTPException(
+            status_code=503,
+            detail="Too many images are being processed, please try again",
+            headers={"Retry-After": "1"},
+        )
     db.commit()
     return MessageResponse(response=response, thread_id=new_thread_id)
 
@@ -137,6 +209,7 @@ async def chat_with_assistant_stream(
         headers={
             "Cache-Control": "no-cache",
             "Connection": "keep-alive",
+            "X-Accel-Buffering": "no",  # Let proxies flush token deltas immediately
             "Access-Control-Allow-Origin": "*",
             "Access-Control-Allow-Headers": "*",
         },
@@ -166,62 +239,9 @@ async def bulk_upload_recipes(
         )
 
     try:
-        # Read file contents
-        contents = await file.read()
-        yaml_content = contents.decode("utf-8")
-
-        recipes_added = 0
-        errors = []
-
-        try:
-            # Try to parse as multiple YAML documents first
-            documents = list(yaml.safe_load_all(yaml_content))
-
-            if len(documents) == 1:
-                # Single document - check if it's a recipes list or single recipe
-                doc = documents[0]
-                if isinstance(doc, dict):
-                    if "recipes" in doc and isinstance(doc["recipes"], list):
-                        # Format: recipes: [recipe1, recipe2, ...]
-                        recipes_to_process = doc["recipes"]
-                    elif "recipe" in doc:
-                        # Single recipe format
-                        recipes_to_process = [doc]
-                    else:
-                        errors.append(
-                            "Invalid format: YAML must contain 'recipe' or 'recipes' key"
-                        )
-                        recipes_to_process = []
-                else:
-                    errors.append("Invalid format: YAML document must be an object")
-                    recipes_to_process = []
-            else:
-                # Multiple documents
-                recipes_to_process = documents
-
-            # Process each recipe
-            for i, recipe_data in enumerate(recipes_to_process):
-                try:
-                    if not isinstance(recipe_data, dict):
-                        errors.append(f"Recipe {i+1}: Must be an object")
-                        continue
-
-                    if "recipe" not in recipe_data:
-                        errors.append(f"Recipe {i+1}: Missing 'recipe' key")
-                        continue
-
-                    # Convert back to YAML for storage
-                    recipe_yaml = yaml.dump(recipe_data, default_flow_style=False)
-
-                    # Add the recipe using existing function
-                    recipe_id = add_recipe(recipe_yaml, current_user.id)
-                    recipes_added += 1
-
-                except Exception as e:
-                    errors.append(f"Recipe {i+1}: {str(e)}")
-
-        except yaml.YAMLError as e:
-            errors.append(f"YAML parsing error: {str(e)}")
+        # Recipes are parsed from the upload stream and stored batch by batch
+        await file.seek(0)
+        recipes_added, errors = await import_recipe_upload(file.file, current_user.id)
 
         # Commit changes
         db.commit()
@@ -251,3 +271,92 @@ async def bulk_upload_recipes(
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+
+@app.post("/recipes/imports", response_model=ImportJobResponse, status_code=202)
+async def create_recipe_import(
+    file: UploadFile = File(...),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+) -> ImportJobResponse:
+    """
+    Queue a YAML recipe file for background import.
+
+    Accepts the same formats as /recipes/bulk-upload, but returns as soon as
+    the recipes are queued. Poll /recipes/imports/{job_id} or stream
+    /recipes/imports/{job_id}/events for progress.
+    """
+    if not file.filename or not file.filename.endswith((".yaml", ".yml")):
+        raise HTTPException(
+            status_code=400, detail="File must be a YAML file (.yaml or .yml)"
+        )
+
+    try:
+        await file.seek(0)
+        job = await queue_recipe_upload(db, current_user.id, file.filename, file.file)
+    except UnicodeDecodeError:
+        raise HTTPException(
+            status_code=400, detail="File must be valid UTF-8 encoded text"
+        )
+    except yaml.YAMLError as e:
+        raise HTTPException(status_code=400, detail=f"YAML parsing error: {str(e)}")
+
+    # Reading the job after its last commit reloads it from the database
+    return await run_blocking(import_job_response, job)
+
+
+def get_owned_import_job(db: Session, job_id: str, user: User) -> ImportJob:
+    try:
+        job = get_import_job(db, uuid.UUID(job_id))
+    except ValueError:
+        job = None
+    if job is None or job.user_id != user.id:
+        raise HTTPException(status_code=404, detail="Import job not found")
+    return job
+
+
+@app.get("/recipes/imports/{job_id}", response_model=ImportJobResponse)
+async def get_recipe_import(
+    job_id: str,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+) -> ImportJobResponse:
+    return import_job_response(get_owned_import_job(db, job_id, current_user))
+
+
+@app.get("/recipes/imports/{job_id}/events")
+async def stream_recipe_import(
+    job_id: str,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """Stream import progress as Server-Sent Events until the job completes."""
+    job_uuid = get_owned_import_job(db, job_id, current_user).id
+
+    def load_progress() -> Optional[Dict[str, Any]]:
+        # The request's session is closed by the time the body streams
+        with SessionLocal() as session:
+            job = get_import_job(session, job_uuid)
+            return import_job_progress(job) if job is not None else None
+
+    async def generate_stream():
+        while True:
+            progress = await run_blocking(load_progress)
+            if progress is None:
+                break
+            yield f"data: {json.dumps(progress, ensure_ascii=False)}\n\n"
+            if progress["status"] == COMPLETED:
+                break
+            await asyncio.sleep(IMPORT_PROGRESS_INTERVAL_SECONDS)
+
+        yield f"data: {json.dumps({'type': 'end'}, ensure_ascii=False)}\n\n"
+
+    return StreamingResponse(
+        generate_stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "Connection": "keep-alive",
+            "X-Accel-Buffering": "no",
+        },
+    )
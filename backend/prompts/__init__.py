@@ -1,18 +1,20 @@
 import os
 from typing import Any, Dict, List, Optional
 
-from utils.tokens import get_tokens
+from utils.tokens import count_tokens, format_message, message_tokens
 
 prompt_template: Optional[str] = None
+prompt_template_tokens = 0
 
 
 def _get_prompt_template() -> str:
-    global prompt_template
+    global prompt_template, prompt_template_tokens
     if not prompt_template:
         current_dir = os.path.dirname(__file__)
         prompt_file_path = os.path.join(current_dir, "prompt.txt")
         with open(prompt_file_path, "r") as file:
             prompt_template = file.read()
+        prompt_template_tokens = count_tokens(prompt_template)
 
     return prompt_template
 
@@ -21,31 +23,55 @@ def get_prompt(
     conversation_history: List[Dict[str, Any]],
     relevant_recipes: List[str],
     max_tokens: int = 100000,
+    recipe_tokens: Optional[List[int]] = None,
 ) -> str:
+    """
+    Builds the system prompt from the history and the relevant recipes.
+    ``recipe_tokens`` holds the recipes' token counts where the caller already
+    knows them.
+
+    Only text that is new this turn is tokenized; the template is counted
+    once and stored messages carry their own counts.
+    """
     template = _get_prompt_template()
-    recipes_formatted = format_relevant_recipes(relevant_recipes)
-    prompt_tokens = len(get_tokens(template) + get_tokens(recipes_formatted))
-    conversation_max_tokens = max_tokens - prompt_tokens
-    conversation_formatted = format_conversation_history(
-        conversation_history, max_tokens=conversation_max_tokens
+    if recipe_tokens is None:
+        recipe_tokens = [count_tokens(recipe) for recipe in relevant_recipes]
+    separators = count_tokens("\n\n") * max(len(relevant_recipes) - 1, 0)
+    conversation_max_tokens = (
+        max_tokens - prompt_template_tokens - sum(recipe_tokens) - separators
     )
+    retained = conversation_history[
+        pack_conversation_history(conversation_history, conversation_max_tokens) :
+    ]
     return template.format(
-        conversation_history=conversation_formatted,
-        relevant_recipes=recipes_formatted,
+        conversation_history="\n\n".join(map(format_message, retained)),
+        relevant_recipes=format_relevant_recipes(relevant_recipes),
     )
 
 
-def format_conversation_history(
-    conversation_history: List[Dict[str, Any]], max_tokens: int = 50000
-) -> str:
-    result = "\n\n".join(
-        f"{message['role']}: {message['content']}" for message in conversation_history
-    )
-    if result:
-        result = result[:max_tokens]
-        result = result[result.index("\n\n") + 2 :]
+def pack_conversation_history(
+    conversation_history: List[Dict[str, Any]], max_tokens: int
+) -> int:
+    """
+    Returns the index of the oldest message kept when packing as many of the
+    most recent messages as fit in max_tokens.
 
-    return result
+    Messages are taken newest first and always whole, stopping at the first
+    one that doesn't fit, so the history is the latest stretch of the
+    conversation with no gaps.
+    """
+    separator = count_tokens("\n\n")
+    used = 0
+    start = len(conversation_history)
+    for message in reversed(conversation_history):
+        cost = message_tokens(message)
+        if start < len(conversation_history):
+            cost += separator
+        if used + cost > max_tokens:
+            break
+        used += cost
+        start -= 1
+    return start
 
 
 def format_relevant_recipes(relevant_recipes: List[str]) -> str:
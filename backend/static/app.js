@@ -399,6 +399,31 @@ document.addEventListener("DOMContentLoaded", () => {
     responsePane.scrollTop = responsePane.scrollHeight;
   }
 
+  let streamingMessage = null;
+  let streamingText = '';
+
+  function appendStreamingDelta(delta) {
+    if (!streamingMessage) {
+      streamingMessage = document.createElement("div");
+      streamingMessage.className = "message bot-message";
+      responsePane.appendChild(streamingMessage);
+      streamingText = '';
+    }
+    streamingText += delta;
+    streamingMessage.innerHTML = marked.parse(streamingText);
+    responsePane.scrollTop = responsePane.scrollHeight;
+  }
+
+  function finishStreamingMessage(content) {
+    if (streamingMessage) {
+      streamingMessage.innerHTML = marked.parse(content);
+      streamingMessage = null;
+      streamingText = '';
+    } else {
+      appendMessage(content, "bot-message");
+    }
+  }
+
   function removeStatusMessage() {
     const statusElement = document.getElementById('status-message');
     if (statusElement) {
@@ -535,10 +560,23 @@ document.addEventListener("DOMContentLoaded", () => {
         showStatusMessage(event.message, 'tool_complete');
         break;
 
+      case 'delta':
+        removeStatusMessage();
+        appendStreamingDelta(event.content);
+        break;
+
+      case 'stage_complete':
+        // Timing information only; the next stage replaces the status message
+        break;
+
+      case 'tool_call_delta':
+        // Tool arguments are still being generated; the tool_use event follows
+        break;
+
       case 'response':
         removeStatusMessage();
         threadId = event.thread_id;
-        appendMessage(event.content, "bot-message");
+        finishStreamingMessage(event.content);
         break;
 
       case 'end':
@@ -547,6 +585,7 @@ document.addEventListener("DOMContentLoaded", () => {
 
       case 'error':
         removeStatusMessage();
+        streamingMessage = null;
         showError(`Error: ${event.message}`);
         break;
 
@@ -8,6 +8,7 @@ from sqlalchemy import TIMESTAMP, Column, Text
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import Session
+from utils.tokens import with_token_count
 
 Base = declarative_base()
 
@@ -71,6 +72,11 @@ def get_conversation_contents(conversation: Conversation) -> List[Dict[str, Any]
 def update_conversation_contents(
     conversation: Conversation, messages: List[Dict[str, Any]]
 ) -> None:
+    """
+    Appends messages to the stored history. Each is stored with its token
+    count, so building later prompts doesn't tokenize the history again.
+    """
+    messages = [with_token_count(message) for message in messages]
     existing_contents = str(conversation.contents) if conversation.contents else ""
     if existing_contents:
         existing_messages = json.loads(existing_contents)
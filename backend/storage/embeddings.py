@@ -0,0 +1,146 @@
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import TIMESTAMP, Column, Float, String
+from sqlalchemy.dialects.postgresql import ARRAY, insert
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from .conversations import Base
+
+logger = logging.getLogger(__name__)
+
+Embedding = List[float]
+CacheKey = Tuple[str, str]
+
+
+class CachedEmbedding(Base):
+    __tablename__ = "embedding_cache"
+
+    model = Column(String(100), primary_key=True)
+    content_hash = Column(String(64), primary_key=True)
+    embedding = Column(ARRAY(Float), nullable=False)
+    created_at = Column(TIMESTAMP, nullable=False, default=datetime.utcnow)
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Two-tier embedding cache keyed by (model, sha256(text)).
+
+    The first tier is an in-process LRU holding at most ``max_entries``
+    embeddings. Misses fall through to the ``embedding_cache`` table when a
+    session factory is configured. Persistent-tier failures are logged and
+    treated as misses so they never break a chat turn.
+    """
+
+    def __init__(
+        self,
+        max_entries: int,
+        session_factory: Optional[Callable[[], Session]] = None,
+    ) -> None:
+        self.max_entries = max_entries
+        self.session_factory = session_factory
+        self._entries: "OrderedDict[CacheKey, Embedding]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+
+    def get(self, model: str, text: str) -> Optional[Embedding]:
+        """Looks up the in-memory tier only."""
+        key = (model, content_hash(text))
+        with self._lock:
+            embedding = self._entries.get(key)
+            if embedding is not None:
+                self._entries.move_to_end(key)
+                self.memory_hits += 1
+            return embedding
+
+    def put(self, model: str, text: str, embedding: Embedding) -> None:
+        """Stores an embedding in the in-memory tier, evicting the oldest."""
+        self._remember((model, content_hash(text)), embedding)
+
+    def load_persistent(self, model: str, texts: Sequence[str]) -> Dict[str, Embedding]:
+        """
+        Looks up texts in the persistent tier, promoting hits into memory.
+
+        Returns the embeddings found, keyed by text. Blocking; run it off the
+        event loop.
+        """
+        hashes = {content_hash(text): text for text in texts}
+        found: Dict[str, Embedding] = {}
+        if self.session_factory is not None and hashes:
+            try:
+                with self.session_factory() as db:
+                    rows = (
+                        db.query(CachedEmbedding)
+                        .filter(
+                            CachedEmbedding.model == model,
+                            CachedEmbedding.content_hash.in_(list(hashes)),
+                        )
+                        .all()
+                    )
+                for row in rows:
+                    text = hashes[str(row.content_hash)]
+                    found[text] = list(row.embedding)
+                    self._remember((model, str(row.content_hash)), found[text])
+            except SQLAlchemyError as e:
+                logger.warning(f"Embedding cache lookup failed: {e}")
+
+        with self._lock:
+            self.persistent_hits += len(found)
+            self.misses += len(hashes) - len(found)
+        return found
+
+    def store_persistent(self, model: str, embeddings: Dict[str, Embedding]) -> None:
+        """Writes freshly computed embeddings to the persistent tier. Blocking."""
+        if self.session_factory is None or not embeddings:
+            return
+        rows = [
+            {
+                "model": model,
+                "content_hash": content_hash(text),
+                "embedding": embedding,
+            }
+            for text, embedding in embeddings.items()
+        ]
+        try:
+            with self.session_factory() as db:
+                db.execute(
+                    insert(CachedEmbedding).values(rows).on_conflict_do_nothing()
+                )
+                db.commit()
+        except SQLAlchemyError as e:
+            logger.warning(f"Embedding cache write failed: {e}")
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.memory_hits = self.persistent_hits = self.misses = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "memory_hits": self.memory_hits,
+                "persistent_hits": self.persistent_hits,
+                "misses": self.misses,
+            }
+
+    def _remember(self, key: CacheKey, embedding: Embedding) -> None:
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = embedding
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
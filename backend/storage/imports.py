@@ -0,0 +1,191 @@
+import json
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+from pydantic import BaseModel
+from sqlalchemy import TIMESTAMP, Column, Integer, String, Text, and_, or_
+from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.orm import Session
+
+from .conversations import Base
+
+# Job statuses
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+
+# Recipe statuses
+PENDING = "pending"
+DONE = "done"
+FAILED = "failed"
+
+
+class ImportJob(Base):
+    __tablename__ = "import_jobs"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4, index=True)
+    user_id = Column(UUID(as_uuid=True), nullable=False)
+    filename = Column(String(255), nullable=True)
+    status = Column(String(20), nullable=False, default=QUEUED)
+    total = Column(Integer, nullable=False, default=0)
+    processed = Column(Integer, nullable=False, default=0)
+    recipes_added = Column(Integer, nullable=False, default=0)
+    errors = Column(Text, nullable=False, default="[]")
+    created_at = Column(TIMESTAMP, nullable=False, default=datetime.utcnow)
+    updated_at = Column(TIMESTAMP, nullable=False, default=datetime.utcnow)
+
+
+class ImportJobRecipe(Base):
+    __tablename__ = "import_job_recipes"
+
+    job_id = Column(UUID(as_uuid=True), primary_key=True)
+    position = Column(Integer, primary_key=True)
+    contents = Column(Text, nullable=False)
+    status = Column(String(20), nullable=False, default=PENDING)
+    error = Column(Text, nullable=True)
+
+
+class ImportJobResponse(BaseModel):
+    job_id: uuid.UUID
+    status: str
+    total: int
+    processed: int
+    recipes_added: int
+    errors: List[str] = []
+
+
+def create_import_job(
+    db: Session, user_id: uuid.UUID, filename: Optional[str]
+) -> ImportJob:
+    """
+    Starts a job for an upload that is still being parsed.
+
+    Nothing is committed until ``queue_import_job``, so the worker can't claim
+    a job whose recipes are only partly written.
+    """
+    job = ImportJob(
+        id=uuid.uuid4(),
+        user_id=user_id,
+        filename=filename,
+        status=QUEUED,
+        total=0,
+        errors="[]",
+    )
+    db.add(job)
+    db.flush()
+    return job
+
+
+def add_import_job_recipes(
+    db: Session, job: ImportJob, recipes: Sequence[Tuple[int, str]]
+) -> None:
+    """
+    Writes pending rows for a batch of (position, recipe YAML) pairs.
+
+    Rows are flushed and expunged straight away so that queueing a large
+    upload doesn't hold every recipe in the session.
+    """
+    rows = [
+        ImportJobRecipe(job_id=job.id, position=position, contents=contents)
+        for position, contents in recipes
+    ]
+    db.add_all(rows)
+    job.total += len(rows)  # type: ignore
+    db.flush()
+    for row in rows:
+        db.expunge(row)
+
+
+def queue_import_job(db: Session, job: ImportJob, errors: List[str]) -> None:
+    """Commits a fully parsed job, completing it straight away if it's empty."""
+    job.errors = json.dumps(errors)  # type: ignore
+    if not job.total:
+        job.status = COMPLETED  # type: ignore
+    db.commit()
+    db.refresh(job)
+
+
+def get_import_job(db: Session, job_id: uuid.UUID) -> Optional[ImportJob]:
+    return db.query(ImportJob).filter(ImportJob.id == job_id).first()
+
+
+def claim_import_job(db: Session, lease_seconds: int) -> Optional[ImportJob]:
+    """
+    Claims the oldest queued job, or a running job whose worker stopped
+    heartbeating, so that jobs resume after a restart.
+    """
+    stale_before = datetime.utcnow() - timedelta(seconds=lease_seconds)
+    job = (
+        db.query(ImportJob)
+        .filter(
+            or_(
+                ImportJob.status == QUEUED,
+                and_(ImportJob.status == RUNNING, ImportJob.updated_at < stale_before),
+            )
+        )
+        .order_by(ImportJob.created_at)
+        .with_for_update(skip_locked=True)
+        .first()
+    )
+    if job is not None:
+        job.status = RUNNING  # type: ignore
+        job.updated_at = datetime.utcnow()  # type: ignore
+        db.commit()
+    return job
+
+
+def get_pending_import_recipes(
+    db: Session, job_id: uuid.UUID, limit: int
+) -> List[ImportJobRecipe]:
+    return (
+        db.query(ImportJobRecipe)
+        .filter(ImportJobRecipe.job_id == job_id, ImportJobRecipe.status == PENDING)
+        .order_by(ImportJobRecipe.position)
+        .limit(limit)
+        .all()
+    )
+
+
+def record_import_batch(
+    db: Session,
+    job: ImportJob,
+    recipes: List[ImportJobRecipe],
+    results: List[Union[str, Exception]],
+) -> None:
+    """Stores the outcome of one batch and bumps the job's progress counters."""
+    errors = json.loads(str(job.errors))
+    for recipe, result in zip(recipes, results):
+        if isinstance(result, Exception):
+            recipe.status = FAILED  # type: ignore
+            recipe.error = str(result)  # type: ignore
+            errors.append(f"Recipe {recipe.position + 1}: {result}")
+        else:
+            recipe.status = DONE  # type: ignore
+            job.recipes_added += 1  # type: ignore
+        job.processed += 1  # type: ignore
+
+    job.errors = json.dumps(errors)  # type: ignore
+    job.updated_at = datetime.utcnow()  # type: ignore
+    db.commit()
+
+
+def complete_import_job(db: Session, job: ImportJob) -> None:
+    job.status = COMPLETED  # type: ignore
+    job.updated_at = datetime.utcnow()  # type: ignore
+    db.commit()
+
+
+def import_job_response(job: ImportJob) -> ImportJobResponse:
+    return ImportJobResponse(
+        job_id=job.id,
+        status=job.status,
+        total=job.total,
+        processed=job.processed,
+        recipes_added=job.recipes_added,
+        errors=json.loads(str(job.errors)),
+    )
+
+
+def import_job_progress(job: ImportJob) -> Dict[str, Any]:
+    return {"type": "progress", **import_job_response(job).model_dump(mode="json")}
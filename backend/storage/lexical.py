@@ -0,0 +1,289 @@
+import math
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+import yaml
+
+# BM25 parameters; the usual defaults
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Reciprocal rank fusion constant from the original RRF paper
+RRF_K = 60
+# How long a namespace whose load failed is left to vector search before the
+# next search tries to load it again
+LOAD_RETRY_SECONDS = 60.0
+# How many namespaces are kept indexed at once
+MAX_NAMESPACES = 256
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+# Dropped from recipes and queries alike. Besides the usual function words
+# this covers how people phrase "what can I make with X and Y".
+STOPWORDS = frozenset(
+    """
+    a about an and any anything are as at be can could do for from get got
+    have i idea ideas in is it me my of on or please recipe recipes should
+    some something that the there this to tonight use using want we what
+    which with would you make cook cooking need
+    """.split()
+)
+
+LexicalMatch = Tuple[str, float, str]
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercases, drops stopwords and folds simple English plurals."""
+    return [
+        _singular(token)
+        for token in TOKEN_PATTERN.findall(text.casefold())
+        if token not in STOPWORDS
+    ]
+
+
+def recipe_terms(contents: str) -> Tuple[List[str], List[str]]:
+    """
+    Extracts the title and ingredient-name tokens from stored recipe YAML.
+
+    Anything that doesn't look like a recipe yields no terms, so a malformed
+    document is simply never matched lexically.
+    """
+    try:
+        document = yaml.safe_load(contents)
+    except yaml.YAMLError:
+        return [], []
+    recipe = document.get("recipe") if isinstance(document, dict) else None
+    if not isinstance(recipe, dict):
+        return [], []
+
+    title = recipe.get("title")
+    title_terms = tokenize(title) if isinstance(title, str) else []
+    ingredient_terms = []
+    ingredients = recipe.get("ingredients")
+    for ingredient in ingredients if isinstance(ingredients, list) else []:
+        name = ingredient.get("name") if isinstance(ingredient, dict) else None
+        if isinstance(name, str):
+            ingredient_terms.extend(tokenize(name))
+    return title_terms, ingredient_terms
+
+
+def reciprocal_rank_fusion(rankings: Iterable[List[str]], k: int = RRF_K) -> List[str]:
+    """Merges ranked id lists, scoring each id by the sum of 1 / (k + rank)."""
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, start=1):
+            scores[item] = scores.get(item, 0.0) + 1.0 / (k + rank)
+    return sorted(scores, key=lambda item: scores[item], reverse=True)
+
+
+class _Namespace:
+    def __init__(self, version: int) -> None:
+        self.version = version
+        self.contents: Dict[str, str] = {}
+        self.terms: Dict[str, Counter] = {}
+        self.lengths: Dict[str, int] = {}
+        self.postings: Dict[str, Dict[str, int]] = {}
+        self.ingredient_docs: Counter = Counter()
+        self.recipe_ingredients: Dict[str, Set[str]] = {}
+        self.total_length = 0
+
+    def upsert(self, recipe_id: str, contents: str) -> None:
+        self.remove(recipe_id)
+        title_terms, ingredient_terms = recipe_terms(contents)
+        terms = Counter(title_terms + ingredient_terms)
+
+        self.contents[recipe_id] = contents
+        self.terms[recipe_id] = terms
+        self.lengths[recipe_id] = sum(terms.values())
+        self.total_length += self.lengths[recipe_id]
+        for term, frequency in terms.items():
+            self.postings.setdefault(term, {})[recipe_id] = frequency
+        self.recipe_ingredients[recipe_id] = set(ingredient_terms)
+        self.ingredient_docs.update(self.recipe_ingredients[recipe_id])
+
+    def remove(self, recipe_id: str) -> None:
+        if recipe_id not in self.contents:
+            return
+        for term in self.terms.pop(recipe_id):
+            postings = self.postings[term]
+            del postings[recipe_id]
+            if not postings:
+                del self.postings[term]
+        self.ingredient_docs.subtract(self.recipe_ingredients.pop(recipe_id))
+        self.ingredient_docs += Counter()  # Drop terms whose count reached zero
+        self.total_length -= self.lengths.pop(recipe_id)
+        del self.contents[recipe_id]
+
+    def search(self, terms: List[str], top_k: int) -> List[LexicalMatch]:
+        count = len(self.contents)
+        if not count or not terms:
+            return []
+        average_length = self.total_length / count or 1.0
+
+        scores: Dict[str, float] = {}
+        for term in set(terms):
+            postings = self.postings.get(term, {})
+            if not postings:
+                continue
+            idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for recipe_id, frequency in postings.items():
+                norm = 1 - BM25_B + BM25_B * self.lengths[recipe_id] / average_length
+                scores[recipe_id] = scores.get(recipe_id, 0.0) + idf * (
+                    frequency * (BM25_K1 + 1) / (frequency + BM25_K1 * norm)
+                )
+
+        best = sorted(scores, key=lambda recipe_id: scores[recipe_id], reverse=True)
+        return [
+            (recipe_id, scores[recipe_id], self.contents[recipe_id])
+            for recipe_id in best[:top_k]
+        ]
+
+
+class LexicalIndex:
+    """
+    Per-namespace BM25 inverted index over recipe titles and ingredient names.
+
+    A namespace is loaded from the vector store the first time it's searched
+    (``begin_load`` / ``finish_load``) and then kept current by ``upsert``.
+    Each copy remembers the query cache version (see QueryResultCache) it's
+    current for. Searches pass the version they read, and a copy at any other
+    version is ignored. ``upsert`` only advances a copy that saw every write
+    before it, so after a write from another worker the copy is dropped and
+    reloaded. A namespace that can't be loaded stays unindexed until
+    ``retry_seconds`` after the failure, when the next search tries again.
+
+    At most ``max_namespaces`` are kept, least recently searched evicted
+    first. Thread-safe, since loads run on the blocking pool.
+    """
+
+    def __init__(
+        self,
+        max_namespaces: int = MAX_NAMESPACES,
+        retry_seconds: float = LOAD_RETRY_SECONDS,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.max_namespaces = max_namespaces
+        self.retry_seconds = retry_seconds
+        self._clock = clock
+        self._namespaces: "OrderedDict[str, _Namespace]" = OrderedDict()
+        self._loading: Dict[str, int] = {}  # Namespace -> version being loaded
+        self._failed_at: Dict[str, float] = {}  # Namespace -> last failed load
+        self._lock = threading.Lock()
+
+    def begin_load(self, namespace: str, version: int) -> bool:
+        """
+        Claims a namespace for loading at ``version``. False if it needn't be
+        loaded now: it's current, already loading, or recently failed.
+        """
+        with self._lock:
+            store = self._namespaces.get(namespace)
+            if store is not None:
+                if store.version == version:
+                    self._namespaces.move_to_end(namespace)
+                    return False
+                del self._namespaces[namespace]  # Stale; nobody may search it
+            if self._loading.get(namespace, -1) >= version:
+                return False
+            failed_at = self._failed_at.get(namespace)
+            if failed_at is not None and (
+                self._clock() - failed_at < self.retry_seconds
+            ):
+                return False
+            self._loading[namespace] = version
+            return True
+
+    def finish_load(
+        self,
+        namespace: str,
+        version: int,
+        documents: Optional[Iterable[Tuple[str, str]]],
+    ) -> None:
+        """
+        Installs the (recipe_id, contents) pairs loaded at ``version``. ``None``
+        means the store couldn't be listed; the namespace is then left to
+        vector search rather than indexed partially, until it's retried.
+        """
+        store = _Namespace(version)
+        for recipe_id, contents in documents or []:
+            store.upsert(recipe_id, contents)
+        with self._lock:
+            if self._loading.get(namespace) == version:
+                del self._loading[namespace]
+            if documents is None:
+                self._failed_at[namespace] = self._clock()
+                return
+            self._failed_at.pop(namespace, None)
+            current = self._namespaces.get(namespace)
+            if current is not None and current.version >= version:
+                return  # A newer load already finished
+            self._namespaces[namespace] = store
+            self._namespaces.move_to_end(namespace)
+            while len(self._namespaces) > self.max_namespaces:
+                self._namespaces.popitem(last=False)
+
+    def upsert(
+        self, namespace: str, documents: Iterable[Tuple[str, str]], version: int
+    ) -> None:
+        """
+        Indexes recipes written as ``version``. A copy that wasn't at the
+        version before it has missed a write, so it's dropped instead;
+        unloaded namespaces pick the recipes up on load.
+        """
+        with self._lock:
+            store = self._namespaces.get(namespace)
+            if store is None:
+                return
+            if store.version != version - 1:
+                del self._namespaces[namespace]
+                return
+            for recipe_id, contents in documents:
+                store.upsert(recipe_id, contents)
+            store.version = version
+
+    def search(
+        self, namespace: str, query: str, top_k: int, version: int
+    ) -> List[LexicalMatch]:
+        """Returns up to top_k (recipe_id, BM25 score, contents), best first."""
+        with self._lock:
+            store = self._current(namespace, version)
+            return store.search(tokenize(query), top_k) if store else []
+
+    def is_ingredient_query(self, namespace: str, query: str, version: int) -> bool:
+        """
+        True when every meaningful word of the query is an ingredient this user
+        cooks with, e.g. "what can I make with mushrooms and leeks". Such
+        queries are answered lexically without embedding them.
+        """
+        terms = tokenize(query)
+        with self._lock:
+            store = self._current(namespace, version)
+            return bool(
+                store
+                and terms
+                and all(store.ingredient_docs.get(term) for term in terms)
+            )
+
+    def clear(self) -> None:
+        with self._lock:
+            self._namespaces.clear()
+            self._loading.clear()
+            self._failed_at.clear()
+
+    def _current(self, namespace: str, version: int) -> Optional[_Namespace]:
+        store = self._namespaces.get(namespace)
+        if store is None or store.version != version:
+            return None
+        self._namespaces.move_to_end(namespace)
+        return store
+
+
+def _singular(token: str) -> str:
+    if len(token) > 4 and token.endswith("ies"):
+        return token[:-3] + "y"
+    if len(token) > 4 and token.endswith(("oes", "ches", "shes", "xes")):
+        return token[:-2]
+    if len(token) > 3 and token.endswith("s") and not token.endswith(("ss", "us")):
+        return token[:-1]
+    return token
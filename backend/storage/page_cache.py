@@ -0,0 +1,275 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Callable, Dict, NamedTuple, Optional, Sequence
+
+from sqlalchemy import TIMESTAMP, Column, String, Text, or_
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from .conversations import Base
+
+logger = logging.getLogger(__name__)
+
+
+class ExtractedPage(Base):
+    __tablename__ = "extracted_pages"
+
+    url = Column(String(2048), primary_key=True)
+    # The page's own canonical URL, which may be another row's key
+    canonical_url = Column(String(2048), nullable=False, index=True)
+    text = Column(Text, nullable=False)
+    etag = Column(String(255), nullable=True)
+    last_modified = Column(String(64), nullable=True)
+    updated_at = Column(TIMESTAMP, nullable=False, default=datetime.utcnow)
+
+
+class CachedPage(NamedTuple):
+    text: str
+    etag: Optional[str]
+    last_modified: Optional[str]
+    fetched_at: float
+
+    @property
+    def revalidatable(self) -> bool:
+        return bool(self.etag or self.last_modified)
+
+
+class PageCache:
+    """
+    Two-tier cache of text extracted from web pages, keyed by canonical URL.
+
+    The first tier is an in-process LRU. Its entries are served as-is for
+    ``ttl_seconds``. After that, pages that came with an ``ETag`` or
+    ``Last-Modified`` header are kept so the caller can revalidate them with a
+    conditional request; a 304 reply renews the entry without downloading or
+    parsing the page again. Stale pages without validators are dropped.
+
+    With a session factory, extracted pages can also be written to the
+    ``extracted_pages`` table, which every worker shares. Rows age from their
+    ``updated_at`` under the same rules: a page found there within
+    ``ttl_seconds`` is served without any request at all, and an older one is
+    revalidated, or dropped if it has no validators. Persistent-tier failures
+    are logged and treated as misses.
+    """
+
+    def __init__(
+        self,
+        max_entries: int,
+        ttl_seconds: float,
+        session_factory: Optional[Callable[[], Session]] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.session_factory = session_factory
+        self._clock = clock
+        self._entries: "OrderedDict[str, CachedPage]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.revalidations = 0
+        self.persistent_hits = 0
+        self.misses = 0
+
+    def lookup(self, url: str) -> Optional[CachedPage]:
+        """
+        Returns the page from the in-memory tier, fresh or revalidatable, or
+        None. Fresh pages count as hits; check ``is_fresh`` before using one
+        without a request.
+        """
+        with self._lock:
+            page = self._entries.get(url)
+            if page is None:
+                return None
+            if not self.is_fresh(page) and not page.revalidatable:
+                del self._entries[url]
+                return None
+            self._entries.move_to_end(url)
+            if self.is_fresh(page):
+                self.hits += 1
+            return page
+
+    def is_fresh(self, page: CachedPage) -> bool:
+        return self._clock() - page.fetched_at < self.ttl_seconds
+
+    def put(
+        self,
+        urls: Sequence[str],
+        text: str,
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None,
+    ) -> CachedPage:
+        """Stores a freshly downloaded page under each of its URLs."""
+        page = CachedPage(text, etag, last_modified, self._clock())
+        with self._lock:
+            self.misses += 1
+        for url in urls:
+            self._remember(url, page)
+        return page
+
+    def revalidated(self, url: str) -> None:
+        """Renews a page the server confirmed is unchanged."""
+        with self._lock:
+            page = self._entries.get(url)
+            if page is not None:
+                self._entries[url] = page._replace(fetched_at=self._clock())
+            self.revalidations += 1
+
+    def load_persistent(self, url: str) -> Optional[CachedPage]:
+        """
+        Looks a page up in the persistent tier, promoting it into memory if
+        it's fresh or revalidatable. Only fresh pages count as hits. Blocking;
+        run it off the event loop.
+        """
+        if self.session_factory is None:
+            return None
+        try:
+            with self.session_factory() as db:
+                row = db.query(ExtractedPage).filter(ExtractedPage.url == url).first()
+        except SQLAlchemyError as e:
+            logger.warning(f"Page cache lookup failed: {e}")
+            return None
+        if row is None:
+            return None
+
+        age = max((datetime.utcnow() - row.updated_at).total_seconds(), 0.0)
+        page = CachedPage(
+            str(row.text),
+            row.etag,  # type: ignore
+            row.last_modified,  # type: ignore
+            self._clock() - age,
+        )
+        if not self.is_fresh(page) and not page.revalidatable:
+            return None
+        self._remember(url, page)
+        if self.is_fresh(page):
+            with self._lock:
+                self.persistent_hits += 1
+        return page
+
+    def store_persistent(self, urls: Sequence[str], page: CachedPage) -> None:
+        """
+        Writes a page to the persistent tier under each of its URLs, the last
+        being its canonical URL. Blocking.
+        """
+        if self.session_factory is None or not urls:
+            return
+        rows = [
+            {
+                "url": url,
+                "canonical_url": urls[-1],
+                "text": page.text,
+                "etag": page.etag,
+                "last_modified": page.last_modified,
+                "updated_at": datetime.utcnow(),
+            }
+            for url in dict.fromkeys(urls)
+        ]
+        statement = insert(ExtractedPage).values(rows)
+        try:
+            with self.session_factory() as db:
+                db.execute(
+                    statement.on_conflict_do_update(
+                        index_elements=[ExtractedPage.url],
+                        set_={
+                            column: statement.excluded[column]
+                            for column in (
+                                "canonical_url",
+                                "text",
+                                "etag",
+                                "last_modified",
+                                "updated_at",
+                            )
+                        },
+                    )
+                )
+                db.commit()
+        except SQLAlchemyError as e:
+            logger.warning(f"Page cache write failed: {e}")
+
+    def renew_persistent(self, url: str) -> None:
+        """
+        Restarts a persistent page's age after the server confirmed it's
+        unchanged, so other workers find it fresh too. Blocking.
+        """
+        if self.session_factory is None:
+            return
+        try:
+            with self.session_factory() as db:
+                db.query(ExtractedPage).filter(ExtractedPage.url == url).update(
+                    {ExtractedPage.updated_at: datetime.utcnow()},
+                    synchronize_session=False,
+                )
+                db.commit()
+        except SQLAlchemyError as e:
+            logger.warning(f"Page cache write failed: {e}")
+
+    def purge(self, url: Optional[str] = None) -> int:
+        """
+        Drops a page, and every URL whose canonical URL it is, from both tiers;
+        without a URL, drops everything. Returns the number of persistent rows
+        removed. Blocking.
+
+        Only this process's in-memory tier is cleared. Other workers keep
+        serving a purged page from memory until it goes stale; they then
+        revalidate it with the site, which may renew it. Restart the workers
+        to drop a page everywhere at once.
+
+        Raises:
+            SQLAlchemyError: If the persistent tier can't be purged.
+        """
+        with self._lock:
+            if url is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(url, None)
+
+        if self.session_factory is None:
+            return 0
+        with self.session_factory() as db:
+            query = db.query(ExtractedPage)
+            if url is not None:
+                query = query.filter(
+                    or_(ExtractedPage.url == url, ExtractedPage.canonical_url == url)
+                )
+                # Aliases of the page may be cached in memory under their own URLs
+                aliases = [
+                    str(row.url) for row in query.with_entities(ExtractedPage.url)
+                ]
+                with self._lock:
+                    for alias in aliases:
+                        self._entries.pop(alias, None)
+            removed = query.delete(synchronize_session=False)
+            db.commit()
+        return removed
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.revalidations = self.persistent_hits = self.misses = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            served = self.hits + self.revalidations + self.persistent_hits
+            lookups = served + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "revalidations": self.revalidations,
+                "persistent_hits": self.persistent_hits,
+                "misses": self.misses,
+                "hit_rate": round(served / lookups, 3) if lookups else 0.0,
+            }
+
+    def _remember(self, url: str, page: CachedPage) -> None:
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[url] = page
+            self._entries.move_to_end(url)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
@@ -0,0 +1,178 @@
+import logging
+import re
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import BigInteger, Column, String
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from .conversations import Base
+
+logger = logging.getLogger(__name__)
+
+CacheKey = Tuple[str, str, int]
+
+
+class NamespaceVersion(Base):
+    __tablename__ = "namespace_versions"
+
+    namespace = Column(String(255), primary_key=True)
+    version = Column(BigInteger, nullable=False, default=0)
+
+
+def normalize_query(query: str) -> str:
+    """
+    Folds case, Unicode forms, punctuation and whitespace, so that
+    "Pasta recipes?" and "pasta  recipes" share a cache entry.
+    """
+    query = unicodedata.normalize("NFKC", query).casefold()
+    query = re.sub(r"[^\w\s]", " ", query)
+    return " ".join(query.split())
+
+
+class QueryResultCache:
+    """
+    LRU of recipe search results keyed by (namespace, normalized query, top_k).
+
+    Each namespace has a version counter that writes bump. Entries remember the
+    version they were computed under and are ignored once it moves on, so a
+    search never returns recipes from before a write. Callers read the version
+    before searching and pass it to ``put``; a search that overlapped a write
+    is then discarded instead of cached.
+
+    With a session factory, writes also bump a counter in the
+    ``namespace_versions`` table. Callers read it before each search and pass
+    it to ``observe``, so writes made by other workers move this process's
+    version on too. The local version only ever increases. Apart from the
+    blocking ``load_shared_version`` and ``store_shared_bump``, it isn't
+    thread-safe; use it from the event loop.
+    """
+
+    def __init__(
+        self,
+        max_entries: int,
+        session_factory: Optional[Callable[[], Session]] = None,
+    ) -> None:
+        self.max_entries = max_entries
+        self.session_factory = session_factory
+        self._entries: "OrderedDict[CacheKey, Tuple[int, List[Any]]]" = OrderedDict()
+        self._versions: Dict[str, int] = {}
+        # The last shared version seen for each namespace
+        self._shared: Dict[str, int] = {}
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def version(self, namespace: str) -> int:
+        return self._versions.get(namespace, 0)
+
+    def bump(self, namespace: str, shared: Optional[int] = None) -> int:
+        """
+        Marks every cached search in the namespace as stale after a write, and
+        returns the new version. ``shared`` is the shared version the write was
+        stored as, if any. If it shows that another worker wrote since the
+        last one seen, the version moves on by two. A copy that only follows
+        this process's writes can then tell it has missed one.
+        """
+        steps = 1
+        if shared is not None:
+            if shared != self._shared.get(namespace, 0) + 1:
+                steps = 2
+            self._shared[namespace] = shared
+        self._versions[namespace] = self.version(namespace) + steps
+        self.invalidations += 1
+        return self.version(namespace)
+
+    def observe(self, namespace: str, shared: Optional[int]) -> int:
+        """
+        Moves the version on if the shared version changed since it was last
+        seen, which means another worker wrote. Returns the current version.
+        """
+        if shared is not None and shared != self._shared.get(namespace):
+            self._shared[namespace] = shared
+            self._versions[namespace] = self.version(namespace) + 1
+            self.invalidations += 1
+        return self.version(namespace)
+
+    def load_shared_version(self, namespace: str) -> Optional[int]:
+        """
+        Reads the namespace's shared version; None without a session factory
+        or if it can't be read. Blocking; run it off the event loop.
+        """
+        if self.session_factory is None:
+            return None
+        try:
+            with self.session_factory() as db:
+                row = db.get(NamespaceVersion, namespace)
+        except SQLAlchemyError as e:
+            logger.warning(f"Namespace version lookup failed: {e}")
+            return None
+        return int(row.version) if row is not None else 0
+
+    def store_shared_bump(self, namespace: str) -> Optional[int]:
+        """
+        Increments the namespace's shared version and returns it; None without
+        a session factory or if it can't be written. Blocking.
+        """
+        if self.session_factory is None:
+            return None
+        statement = insert(NamespaceVersion).values(namespace=namespace, version=1)
+        statement = statement.on_conflict_do_update(
+            index_elements=[NamespaceVersion.namespace],
+            set_={"version": NamespaceVersion.version + 1},
+        ).returning(NamespaceVersion.version)
+        try:
+            with self.session_factory() as db:
+                version = db.execute(statement).scalar_one()
+                db.commit()
+        except SQLAlchemyError as e:
+            logger.warning(f"Namespace version write failed: {e}")
+            return None
+        return int(version)
+
+    def get(self, namespace: str, query: str, top_k: int) -> Optional[List[Any]]:
+        key = (namespace, normalize_query(query), top_k)
+        entry = self._entries.get(key)
+        if entry is None or entry[0] != self.version(namespace):
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return list(entry[1])
+
+    def put(
+        self,
+        namespace: str,
+        query: str,
+        top_k: int,
+        results: List[Any],
+        version: int,
+    ) -> None:
+        """Caches results computed under ``version``, unless a write followed."""
+        if self.max_entries <= 0 or version != self.version(namespace):
+            return
+        key = (namespace, normalize_query(query), top_k)
+        self._entries[key] = (version, list(results))
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._versions.clear()
+        self._shared.clear()
+        self.hits = self.misses = self.invalidations = 0
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+        }
@@ -0,0 +1,355 @@
+import json
+import logging
+import os
+import re
+import threading
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+Metadata = Dict[str, Any]
+MetadataFilter = Dict[str, Any]
+
+NAMESPACE_PATTERN = re.compile(r"[\w.-]+")
+
+
+class VectorMatch(NamedTuple):
+    id: str
+    score: float
+    values: Optional[List[float]]
+    metadata: Optional[Metadata]
+
+
+class QueryResponse(NamedTuple):
+    matches: List[VectorMatch]
+
+
+class StoredVector(NamedTuple):
+    id: str
+    values: List[float]
+    metadata: Metadata
+
+
+class FetchResponse(NamedTuple):
+    vectors: Dict[str, StoredVector]
+
+
+class VectorStore(ABC):
+    """
+    The subset of the Pinecone index API the assistant uses.
+
+    Vectors are dicts with ``id``, ``values`` and ``metadata``, and every
+    call is scoped to a namespace (one per user). All methods are blocking.
+    """
+
+    @abstractmethod
+    def upsert(self, vectors: Sequence[Dict[str, Any]], namespace: str) -> None: ...
+
+    @abstractmethod
+    def query(
+        self,
+        namespace: str,
+        vector: Sequence[float],
+        top_k: int,
+        filter: Optional[MetadataFilter] = None,
+        include_values: bool = False,
+        include_metadata: bool = True,
+    ) -> QueryResponse: ...
+
+    @abstractmethod
+    def fetch(self, ids: Sequence[str], namespace: str) -> FetchResponse: ...
+
+    @abstractmethod
+    def iter_metadata(self, namespace: str) -> Iterator[Tuple[str, Metadata]]:
+        """
+        Yields (id, metadata) for every vector in a namespace, for building
+        derived indexes. The values aren't kept.
+        """
+
+
+class PineconeVectorStore(VectorStore):
+    """Adapts a Pinecone index client to ``VectorStore``."""
+
+    def __init__(self, index: Any) -> None:
+        self.index = index
+
+    def upsert(self, vectors: Sequence[Dict[str, Any]], namespace: str) -> None:
+        self.index.upsert(vectors=list(vectors), namespace=namespace)
+
+    def query(
+        self,
+        namespace: str,
+        vector: Sequence[float],
+        top_k: int,
+        filter: Optional[MetadataFilter] = None,
+        include_values: bool = False,
+        include_metadata: bool = True,
+    ) -> QueryResponse:
+        response = self.index.query(
+            namespace=namespace,
+            vector=list(vector),
+            top_k=top_k,
+            filter=filter,
+            include_values=include_values,
+            include_metadata=include_metadata,
+        )
+        return QueryResponse(
+            matches=[
+                VectorMatch(
+                    id=match.id,
+                    score=match.score,
+                    values=list(match.values) if include_values else None,
+                    metadata=dict(match.metadata) if match.metadata else None,
+                )
+                for match in response.matches
+            ]
+        )
+
+    def fetch(self, ids: Sequence[str], namespace: str) -> FetchResponse:
+        response = self.index.fetch(ids=list(ids), namespace=namespace)
+        return FetchResponse(
+            vectors={
+                vector_id: StoredVector(
+                    id=vector_id,
+                    values=list(vector.values),
+                    metadata=dict(vector.metadata or {}),
+                )
+                for vector_id, vector in response.vectors.items()
+            }
+        )
+
+    def iter_metadata(self, namespace: str) -> Iterator[Tuple[str, Metadata]]:
+        # Listing ids is only supported by serverless indexes. Pinecone's fetch
+        # can't leave the values out, so they're dropped a page at a time.
+        for ids in self.index.list(namespace=namespace):
+            response = self.index.fetch(ids=list(ids), namespace=namespace)
+            for vector_id, vector in response.vectors.items():
+                yield vector_id, dict(vector.metadata or {})
+
+
+class _Namespace:
+    """One namespace's vectors as a matrix, plus unit rows for cosine scoring."""
+
+    def __init__(self, dimension: int = 0) -> None:
+        self.ids: List[str] = []
+        self.rows: Dict[str, int] = {}
+        self.metadata: List[Metadata] = []
+        self.values = np.zeros((0, dimension), dtype=np.float32)
+        self.unit = np.zeros((0, dimension), dtype=np.float32)
+
+    def upsert(self, vectors: Sequence[Dict[str, Any]]) -> None:
+        # The last write for an id wins, as it would with separate upserts
+        vectors = list({str(v["id"]): v for v in vectors}.values())
+        values = np.asarray([v["values"] for v in vectors], dtype=np.float32)
+        if len(self.ids) == 0:
+            self.values = np.zeros((0, values.shape[1]), dtype=np.float32)
+            self.unit = np.zeros((0, values.shape[1]), dtype=np.float32)
+        elif values.shape[1] != self.values.shape[1]:
+            raise ValueError(
+                f"Vector dimension {values.shape[1]} does not match "
+                f"namespace dimension {self.values.shape[1]}"
+            )
+
+        appended = []
+        for vector, row_values in zip(vectors, values):
+            vector_id = str(vector["id"])
+            metadata = dict(vector.get("metadata") or {})
+            row = self.rows.get(vector_id)
+            if row is None:
+                self.rows[vector_id] = len(self.ids) + len(appended)
+                appended.append((vector_id, metadata, row_values))
+            else:
+                self.metadata[row] = metadata
+                self.values[row] = row_values
+                self.unit[row] = _normalize(row_values)
+
+        if appended:
+            new_values = np.stack([row_values for _, _, row_values in appended])
+            self.ids.extend(vector_id for vector_id, _, _ in appended)
+            self.metadata.extend(metadata for _, metadata, _ in appended)
+            self.values = np.vstack([self.values, new_values])
+            self.unit = np.vstack([self.unit, _normalize(new_values)])
+
+    def matching_rows(self, filter: Optional[MetadataFilter]) -> np.ndarray:
+        if not filter:
+            return np.arange(len(self.ids))
+        return np.asarray(
+            [
+                row
+                for row, metadata in enumerate(self.metadata)
+                if matches_filter(metadata, filter)
+            ],
+            dtype=np.intp,
+        )
+
+
+class LocalVectorStore(VectorStore):
+    """
+    In-process vector store holding each namespace as a NumPy matrix.
+
+    Queries score every candidate with one matrix-vector product against
+    unit-normalized rows, which is cosine similarity like the Pinecone index.
+    For the few hundred recipes a user has, that takes microseconds and no
+    network round trip.
+
+    With a ``path``, each namespace is saved to ``<path>/<namespace>.npz``
+    after every upsert and loaded lazily on first use. Without one, the
+    store lives only in memory. Metadata filters support equality, ``$eq``,
+    ``$ne``, ``$in`` and ``$nin``.
+    """
+
+    def __init__(self, path: Optional[str] = None) -> None:
+        self.path = path
+        self._namespaces: Dict[str, _Namespace] = {}
+        self._lock = threading.RLock()
+
+    def upsert(self, vectors: Sequence[Dict[str, Any]], namespace: str) -> None:
+        if not vectors:
+            return
+        with self._lock:
+            store = self._namespace(namespace)
+            store.upsert(vectors)
+            self._save(namespace, store)
+
+    def query(
+        self,
+        namespace: str,
+        vector: Sequence[float],
+        top_k: int,
+        filter: Optional[MetadataFilter] = None,
+        include_values: bool = False,
+        include_metadata: bool = True,
+    ) -> QueryResponse:
+        with self._lock:
+            store = self._namespace(namespace)
+            rows = store.matching_rows(filter)
+            if top_k <= 0 or len(rows) == 0:
+                return QueryResponse(matches=[])
+
+            query = _normalize(np.asarray(vector, dtype=np.float32))
+            # Indexing copies the rows, so only do it when a filter narrowed them
+            unit = store.unit if len(rows) == len(store.ids) else store.unit[rows]
+            scores = unit @ query
+            if top_k < len(rows):
+                best = np.argpartition(-scores, top_k - 1)[:top_k]
+            else:
+                best = np.arange(len(rows))
+            best = best[np.argsort(-scores[best], kind="stable")]
+
+            return QueryResponse(
+                matches=[
+                    VectorMatch(
+                        id=store.ids[rows[i]],
+                        score=float(scores[i]),
+                        values=(
+                            store.values[rows[i]].tolist() if include_values else None
+                        ),
+                        metadata=(
+                            dict(store.metadata[rows[i]]) if include_metadata else None
+                        ),
+                    )
+                    for i in best
+                ]
+            )
+
+    def fetch(self, ids: Sequence[str], namespace: str) -> FetchResponse:
+        with self._lock:
+            store = self._namespace(namespace)
+            vectors = {}
+            for vector_id in ids:
+                row = store.rows.get(vector_id)
+                if row is not None:
+                    vectors[vector_id] = StoredVector(
+                        id=vector_id,
+                        values=store.values[row].tolist(),
+                        metadata=dict(store.metadata[row]),
+                    )
+            return FetchResponse(vectors=vectors)
+
+    def iter_metadata(self, namespace: str) -> Iterator[Tuple[str, Metadata]]:
+        with self._lock:
+            store = self._namespace(namespace)
+            snapshot = [
+                (vector_id, dict(store.metadata[row]))
+                for row, vector_id in enumerate(store.ids)
+            ]
+        return iter(snapshot)
+
+    def clear(self) -> None:
+        """Drops the in-memory namespaces. Saved files are left alone."""
+        with self._lock:
+            self._namespaces.clear()
+
+    def _namespace(self, namespace: str) -> _Namespace:
+        store = self._namespaces.get(namespace)
+        if store is None:
+            store = self._load(namespace)
+            self._namespaces[namespace] = store
+        return store
+
+    def _file(self, namespace: str) -> str:
+        if not NAMESPACE_PATTERN.fullmatch(namespace):
+            raise ValueError(f"Invalid namespace: {namespace!r}")
+        return os.path.join(str(self.path), f"{namespace}.npz")
+
+    def _load(self, namespace: str) -> _Namespace:
+        store = _Namespace()
+        if self.path is None:
+            return store
+        filename = self._file(namespace)
+        if not os.path.exists(filename):
+            return store
+
+        with np.load(filename, allow_pickle=False) as saved:
+            store.ids = [str(vector_id) for vector_id in saved["ids"]]
+            store.values = saved["values"].astype(np.float32)
+            store.metadata = json.loads(str(saved["metadata"]))
+        store.rows = {vector_id: row for row, vector_id in enumerate(store.ids)}
+        store.unit = _normalize(store.values)
+        return store
+
+    def _save(self, namespace: str, store: _Namespace) -> None:
+        if self.path is None:
+            return
+        os.makedirs(self.path, exist_ok=True)
+        filename = self._file(namespace)
+        # Write to a temporary file first so a crash never leaves a torn save
+        temporary = f"{filename}.tmp"
+        with open(temporary, "wb") as f:
+            np.savez(
+                f,
+                ids=np.asarray(store.ids, dtype=str),
+                values=store.values,
+                metadata=np.asarray(json.dumps(store.metadata)),
+            )
+        os.replace(temporary, filename)
+
+
+def matches_filter(metadata: Metadata, filter: MetadataFilter) -> bool:
+    """Evaluates a Pinecone-style metadata filter against one vector."""
+    for field, condition in filter.items():
+        value = metadata.get(field)
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+        for operator, operand in condition.items():
+            if operator == "$eq":
+                matched = value == operand
+            elif operator == "$ne":
+                matched = value != operand
+            elif operator == "$in":
+                matched = value in operand
+            elif operator == "$nin":
+                matched = value not in operand
+            else:
+                raise ValueError(f"Unsupported filter operator: {operator}")
+            if not matched:
+                return False
+    return True
+
+
+def _normalize(values: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(values, axis=-1, keepdims=True)
+    return values / np.where(norms == 0, 1, norms)
@@ -0,0 +1,215 @@
+import asyncio
+import contextlib
+import logging
+from typing import Any, AsyncIterator, Callable, Dict, NamedTuple, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import httpx
+from httpx import AsyncClient
+
+logger = logging.getLogger(__name__)
+
+# Some recipe sites turn away clients that don't look like a browser
+BROWSER_USER_AGENT = (
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+    "(KHTML, like Gecko) Chrome/117.0.0.0 Safari/537.36"
+)
+
+# Query parameters that only track where a click came from
+TRACKING_PARAMETERS = frozenset(
+    {"fbclid", "gclid", "msclkid", "mc_cid", "mc_eid", "igshid", "ref", "ref_src"}
+)
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+def canonical_url(url: str) -> str:
+    """
+    Normalizes a URL so that links to the same page share a cache key.
+
+    Lowercases the scheme and host, drops default ports, fragments and
+    tracking parameters, and sorts the remaining query parameters.
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    netloc = (parts.hostname or "").lower()
+    try:
+        port = parts.port
+    except ValueError:
+        port = None
+    if port is not None and port != DEFAULT_PORTS.get(scheme):
+        netloc = f"{netloc}:{port}"
+
+    query = urlencode(
+        sorted(
+            (key, value)
+            for key, value in parse_qsl(parts.query, keep_blank_values=True)
+            if not key.lower().startswith("utm_")
+            and key.lower() not in TRACKING_PARAMETERS
+        )
+    )
+    return urlunsplit((scheme, netloc, parts.path or "/", query, ""))
+
+
+def same_site(url: str, other: str) -> bool:
+    """True when both URLs are on the same host, give or take ``www.``."""
+
+    def host(value: str) -> str:
+        hostname = (urlsplit(value).hostname or "").lower()
+        return hostname[4:] if hostname.startswith("www.") else hostname
+
+    return bool(host(url)) and host(url) == host(other)
+
+
+class FetchedPage(NamedTuple):
+    url: str
+    status_code: int
+    content: bytes
+    etag: Optional[str]
+    last_modified: Optional[str]
+    truncated: bool
+
+    @property
+    def not_modified(self) -> bool:
+        return self.status_code == 304
+
+
+class PageFetcher:
+    """
+    Downloads web pages over one pooled ``AsyncClient``.
+
+    At most ``per_host`` requests run against any one host at a time, and
+    bodies are cut off after ``max_bytes`` so a huge page can't exhaust
+    memory. Passing ``etag`` or ``last_modified`` to ``fetch`` makes the
+    request conditional, in which case a 304 comes back with an empty body.
+    An ``until`` callback sees each chunk as it arrives and can stop the
+    download early by returning True.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int,
+        per_host: int,
+        max_connections: int,
+        timeout: float,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ) -> None:
+        self.max_bytes = max_bytes
+        self.per_host = per_host
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self._transport = transport
+        self._client: Optional[AsyncClient] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        # host -> (semaphore, requests holding or waiting for it)
+        self._hosts: Dict[str, Tuple[asyncio.Semaphore, int]] = {}
+
+    async def fetch(
+        self,
+        url: str,
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None,
+        until: Optional[Callable[[bytes], bool]] = None,
+    ) -> FetchedPage:
+        """
+        Raises:
+            httpx.HTTPError: If the request fails or the status is an error.
+        """
+        client = self._get_client()
+        headers = {}
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+
+        host = httpx.URL(url).host
+        semaphore = self._acquire_host(host)
+        try:
+            async with semaphore:
+                async with client.stream("GET", url, headers=headers) as response:
+                    if response.status_code == 304:
+                        return self._page(response, b"", False)
+                    response.raise_for_status()
+
+                    content = bytearray()
+                    truncated = stopped = False
+                    chunks = response.aiter_bytes()
+                    async for chunk in chunks:
+                        content += chunk
+                        if until is not None and until(chunk):
+                            stopped = True
+                            break
+                        if len(content) > self.max_bytes:
+                            del content[self.max_bytes :]
+                            truncated = stopped = True
+                            break
+                    if stopped:
+                        await _abandon(response, chunks)
+                    if truncated:
+                        logger.info(f"Truncated {url} at {self.max_bytes} bytes")
+                    return self._page(response, bytes(content), truncated)
+        finally:
+            self._release_host(host)
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def _get_client(self) -> AsyncClient:
+        # Pooled connections belong to the loop that opened them
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._loop is not loop:
+            kwargs: Dict[str, Any] = {}
+            if self._transport is not None:
+                kwargs["transport"] = self._transport
+            self._client = AsyncClient(
+                headers={"User-Agent": BROWSER_USER_AGENT},
+                timeout=self.timeout,
+                follow_redirects=True,
+                limits=httpx.Limits(max_connections=self.max_connections),
+                **kwargs,
+            )
+            self._loop = loop
+            self._hosts.clear()
+        return self._client
+
+    def _acquire_host(self, host: str) -> asyncio.Semaphore:
+        entry = self._hosts.get(host)
+        semaphore, users = entry or (asyncio.Semaphore(self.per_host), 0)
+        self._hosts[host] = (semaphore, users + 1)
+        return semaphore
+
+    def _release_host(self, host: str) -> None:
+        if host not in self._hosts:  # The client was replaced meanwhile
+            return
+        semaphore, users = self._hosts[host]
+        if users > 1:
+            self._hosts[host] = (semaphore, users - 1)
+        else:
+            del self._hosts[host]
+
+    @staticmethod
+    def _page(response: httpx.Response, content: bytes, truncated: bool) -> FetchedPage:
+        return FetchedPage(
+            url=str(response.url),
+            status_code=response.status_code,
+            content=content,
+            etag=response.headers.get("etag"),
+            last_modified=response.headers.get("last-modified"),
+            truncated=truncated,
+        )
+
+
+async def _abandon(response: httpx.Response, chunks: AsyncIterator[bytes]) -> None:
+    """
+    Stops reading a response part way through. httpx's stream layers are
+    async generators that don't close the ones they read from, so closing
+    ``chunks`` alone would leave the rest for the GC to finalize, possibly
+    after the event loop is gone. Closing the connection and reading on makes
+    every layer finish here instead: only what was already buffered is left,
+    and then the closed connection raises.
+    """
+    await response.aclose()
+    with contextlib.suppress(httpx.HTTPError, httpx.StreamError):
+        async for _ in chunks:
+            pass
@@ -1,9 +1,208 @@
-from typing import List
+import logging
+import math
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
 
 import tiktoken
 
-enc = tiktoken.encoding_for_model("gpt-4o")
+logger = logging.getLogger(__name__)
+
+ENCODING_MODEL = "gpt-4o"
+# Counts of recently seen strings, like the prompt template and recipes
+TOKEN_COUNT_CACHE_SIZE = 4096
+
+_encoding: Optional[tiktoken.Encoding] = None
+_encoding_lock = threading.Lock()
+_counts: "OrderedDict[str, int]" = OrderedDict()
+_counts_lock = threading.Lock()
+
+# Vision pricing for gpt-4o: a high-detail image is scaled to fit 2048 x 2048,
+# then its shortest side to 768, and costs a base charge plus one per tile
+IMAGE_BASE_TOKENS = 85
+IMAGE_TILE_TOKENS = 170
+IMAGE_TILE_SIZE = 512
+IMAGE_MAX_SIDE = 2048
+IMAGE_SHORT_SIDE = 768
+# What an image of unknown size can cost at most: 768 x 2048 is 2 x 4 tiles
+IMAGE_MAX_TOKENS = IMAGE_BASE_TOKENS + IMAGE_TILE_TOKENS * 8
+# How far an image may be shrunk below the model's own scaling to save a tile
+IMAGE_MIN_TILE_TRIM = 0.85
+
+
+def get_encoding() -> tiktoken.Encoding:
+    """
+    The shared encoder, loaded on first use. Loading can read or download the
+    BPE files, so ``prewarm_encoding`` starts it at startup instead.
+    """
+    global _encoding
+    if _encoding is None:
+        with _encoding_lock:
+            if _encoding is None:
+                _encoding = tiktoken.encoding_for_model(ENCODING_MODEL)
+    return _encoding
+
+
+def prewarm_encoding() -> threading.Thread:
+    """Loads the encoder in a background thread, so no request waits for it."""
+
+    def load() -> None:
+        try:
+            get_encoding()
+        except Exception as e:  # Retried on first use
+            logger.warning(f"Couldn't load the {ENCODING_MODEL} encoder: {e}")
+
+    thread = threading.Thread(target=load, name="tiktoken-prewarm", daemon=True)
+    thread.start()
+    return thread
 
 
 def get_tokens(value: str) -> List[int]:
-    return enc.encode(value)
+    return get_encoding().encode_ordinary(value)
+
+
+def count_tokens(value: str) -> int:
+    """Counts tokens, remembering the counts of recently seen strings."""
+    with _counts_lock:
+        count = _counts.get(value)
+        if count is not None:
+            _counts.move_to_end(value)
+            return count
+    count = len(get_tokens(value))
+    _remember_counts({value: count})
+    return count
+
+
+def count_tokens_many(values: Sequence[str]) -> List[int]:
+    """
+    Counts tokens of several strings, encoding the ones not in the cache as
+    one batch across tiktoken's threads.
+    """
+    counts = {}
+    with _counts_lock:
+        for value in values:
+            if value in _counts:
+                _counts.move_to_end(value)
+                counts[value] = _counts[value]
+    missing = list(dict.fromkeys(value for value in values if value not in counts))
+    if missing:
+        encoded = get_encoding().encode_ordinary_batch(missing)
+        new_counts = {value: len(tokens) for value, tokens in zip(missing, encoded)}
+        _remember_counts(new_counts)
+        counts.update(new_counts)
+    return [counts[value] for value in values]
+
+
+def clear_token_counts() -> None:
+    with _counts_lock:
+        _counts.clear()
+
+
+def truncate_tokens(value: str, max_tokens: int) -> str:
+    """Cuts a string down to its first max_tokens tokens."""
+    tokens = get_tokens(value)
+    if len(tokens) <= max_tokens:
+        return value
+    return get_encoding().decode(tokens[: max(max_tokens, 0)])
+
+
+def image_tokens(width: int, height: int) -> int:
+    """What the model charges for a high-detail image of the given size."""
+    scale = _vision_scale(width, height)
+    return IMAGE_BASE_TOKENS + IMAGE_TILE_TOKENS * _tiles(width * scale, height * scale)
+
+
+def vision_image_size(width: int, height: int) -> Tuple[int, int]:
+    """
+    The size to send an image at: no larger than the model would scale it to,
+    never upscaled, and shrunk a little further when that saves a tile, e.g.
+    768 x 1100 (2 x 3 tiles) becomes 715 x 1024 (2 x 2).
+    """
+    scale = _vision_scale(width, height)
+    trim = 1.0
+    for side in (width * scale, height * scale):
+        # Dropping a side to the tile boundary below it saves a row of tiles
+        boundary = math.floor(side / IMAGE_TILE_SIZE) * IMAGE_TILE_SIZE / side
+        if IMAGE_MIN_TILE_TRIM <= boundary < 1.0 and (trim == 1.0 or boundary > trim):
+            trim = boundary
+    scale *= trim
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def estimate_message_tokens(
+    content: Any, image_sizes: Sequence[Tuple[int, int]] = ()
+) -> int:
+    """
+    Estimates the tokens of a message's content, a string or a list of content
+    parts, without tokenizing image data.
+
+    Text parts are counted. Image parts are charged by size, taking
+    ``image_sizes`` in the order the images appear; an image whose size isn't
+    given is charged the most any image can cost.
+    """
+    if isinstance(content, str):
+        return count_tokens(content)
+
+    total = 0
+    sizes = iter(image_sizes)
+    for part in content:
+        if part.get("type") == "text":
+            total += count_tokens(part["text"])
+        elif part.get("type") == "image_url":
+            size = next(sizes, None)
+            detail = part["image_url"].get("detail", "auto")
+            if detail == "low":
+                total += IMAGE_BASE_TOKENS
+            elif size is not None:
+                total += image_tokens(*size)
+            else:
+                total += IMAGE_MAX_TOKENS
+    return total
+
+
+def format_message(message: Dict[str, Any]) -> str:
+    """The message as it's written into the prompt's conversation history."""
+    content = message["content"]
+    if isinstance(content, list):
+        # Content parts; images are noted rather than inlined as base64
+        content = " ".join(
+            part["text"] if part.get("type") == "text" else f"[{part.get('type')}]"
+            for part in content
+        )
+    return f"{message['role']}: {content}"
+
+
+def message_tokens(message: Dict[str, Any]) -> int:
+    """
+    The tokens the message takes up in the history. Stored messages carry
+    their count (see ``with_token_count``); older ones are counted here.
+    """
+    tokens = message.get("tokens")
+    if isinstance(tokens, int):
+        return tokens
+    return count_tokens(format_message(message))
+
+
+def with_token_count(message: Dict[str, Any]) -> Dict[str, Any]:
+    """The message with its history token count attached, for storage."""
+    return {**message, "tokens": message_tokens(message)}
+
+
+def _vision_scale(width: float, height: float) -> float:
+    # Fit within IMAGE_MAX_SIDE, then the shortest side to IMAGE_SHORT_SIDE
+    return min(
+        1.0, IMAGE_MAX_SIDE / max(width, height), IMAGE_SHORT_SIDE / min(width, height)
+    )
+
+
+def _tiles(width: float, height: float) -> int:
+    return math.ceil(width / IMAGE_TILE_SIZE) * math.ceil(height / IMAGE_TILE_SIZE)
+
+
+def _remember_counts(counts: Dict[str, int]) -> None:
+    with _counts_lock:
+        for value, count in counts.items():
+            _counts[value] = count
+            _counts.move_to_end(value)
+        while len(_counts) > TOKEN_COUNT_CACHE_SIZE:
+            _counts.popitem(last=False)
@@ -0,0 +1,121 @@
+import asyncio
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, TypeVar
+
+T = TypeVar("T")
+
+
+class PoolSaturated(Exception):
+    """Raised when a worker pool's queue is full; the caller should retry."""
+
+
+class WorkerPool:
+    """
+    A fixed set of worker threads for CPU-heavy jobs, with a bounded queue.
+
+    At most ``workers`` jobs run at once and ``max_queued`` more may wait for
+    a worker. Past that, ``run`` raises ``PoolSaturated`` straight away rather
+    than letting work pile up behind a busy pool. ``stats`` reports the queue
+    depth and how long jobs waited and ran, for sizing the pool.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        workers: int,
+        max_queued: int,
+        clock: Callable[[], float] = time.perf_counter,
+    ) -> None:
+        self.workers = workers
+        self.max_queued = max_queued
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix=name
+        )
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._pending = 0  # Queued or running
+        self._running = 0
+        self.peak_queued = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.wait_seconds = 0.0
+        self.run_seconds = 0.0
+        self.max_run_seconds = 0.0
+
+    async def run(self, func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """
+        Runs a call on the pool and awaits its result.
+
+        Raises:
+            PoolSaturated: If every worker is busy and the queue is full.
+        """
+        with self._lock:
+            if self._pending >= self.workers + self.max_queued:
+                self.rejected += 1
+                raise PoolSaturated(f"{self._pending} jobs already running or queued")
+            self._pending += 1
+            self.peak_queued = max(self.peak_queued, self._pending - self._running)
+
+        future = self._executor.submit(
+            self._timed, functools.partial(func, *args, **kwargs), self._clock()
+        )
+        try:
+            return await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            if future.cancel():  # Never started, so _timed won't release it
+                with self._lock:
+                    self._pending -= 1
+            raise
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            finished = self.completed + self.failed
+            return {
+                "workers": self.workers,
+                "max_queued": self.max_queued,
+                "running": self._running,
+                "queued": self._pending - self._running,
+                "peak_queued": self.peak_queued,
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "mean_wait_ms": (
+                    round(self.wait_seconds * 1000 / finished, 1) if finished else 0.0
+                ),
+                "mean_run_ms": (
+                    round(self.run_seconds * 1000 / finished, 1) if finished else 0.0
+                ),
+                "max_run_ms": round(self.max_run_seconds * 1000, 1),
+            }
+
+    def clear(self) -> None:
+        """Resets the counters; jobs in flight are still tracked."""
+        with self._lock:
+            self.peak_queued = self.completed = self.failed = self.rejected = 0
+            self.wait_seconds = self.run_seconds = self.max_run_seconds = 0.0
+
+    def _timed(self, call: Callable[[], T], submitted: float) -> T:
+        started = self._clock()
+        with self._lock:
+            self._running += 1
+            self.wait_seconds += started - submitted
+        succeeded = False
+        try:
+            result = call()
+            succeeded = True
+            return result
+        finally:
+            elapsed = self._clock() - started
+            with self._lock:
+                self._running -= 1
+                self._pending -= 1
+                if succeeded:
+                    self.completed += 1
+                else:
+                    self.failed += 1
+                self.run_seconds += elapsed
+                self.max_run_seconds = max(self.max_run_seconds, elapsed)
@@ -27,5 +27,61 @@ CREATE TABLE IF NOT EXISTS conversations (
     contents TEXT NOT NULL
 );
 
+-- Embeddings keyed by model and sha256 of the embedded text
+CREATE TABLE IF NOT EXISTS embedding_cache (
+    model VARCHAR(100) NOT NULL,
+    content_hash VARCHAR(64) NOT NULL,
+    embedding DOUBLE PRECISION[] NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (model, content_hash)
+);
+
+-- Text extracted from recipe pages, shared by all users, keyed by canonical
+-- URL; canonical_url is the page's own <link rel="canonical">
+CREATE TABLE IF NOT EXISTS extracted_pages (
+    url VARCHAR(2048) PRIMARY KEY,
+    canonical_url VARCHAR(2048) NOT NULL,
+    text TEXT NOT NULL,
+    etag VARCHAR(255),
+    last_modified VARCHAR(64),
+    updated_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS extracted_pages_canonical_url_idx
+    ON extracted_pages (canonical_url);
+
+-- Write counters per vector namespace, so every worker's search caches see
+-- every worker's writes
+CREATE TABLE IF NOT EXISTS namespace_versions (
+    namespace VARCHAR(255) PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 0
+);
+
+-- Background recipe imports; recipe ids are assigned up front so resumed
+-- jobs overwrite rather than duplicate vectors
+CREATE TABLE IF NOT EXISTS import_jobs (
+    id UUID PRIMARY KEY,
+    user_id UUID NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    filename VARCHAR(255),
+    status VARCHAR(20) NOT NULL DEFAULT 'queued',
+    total INTEGER NOT NULL DEFAULT 0,
+    processed INTEGER NOT NULL DEFAULT 0,
+    recipes_added INTEGER NOT NULL DEFAULT 0,
+    errors TEXT NOT NULL DEFAULT '[]',
+    created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    updated_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS import_jobs_status_idx ON import_jobs (status, created_at);
+
+CREATE TABLE IF NOT EXISTS import_job_recipes (
+    job_id UUID NOT NULL REFERENCES import_jobs(id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    contents TEXT NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'pending',
+    error TEXT,
+    PRIMARY KEY (job_id, position)
+);
+
 -- Note: Users will now be created through Google OAuth
 -- Remove the hardcoded user insertion
@@ -34,6 +34,7 @@ _mock_pinecone_instance = Mock()
 _mock_index = Mock()
 _mock_index.upsert.return_value = None
 _mock_index.query.return_value = Mock(matches=[])
+_mock_index.fetch.return_value = Mock(vectors={})
 _mock_pinecone_instance.Index.return_value = _mock_index
 
 _mock_openai_instance = Mock()
@@ -81,6 +82,20 @@ def mock_external_services():
         }
 
 
+@pytest.fixture(autouse=True)
+def clear_assistant_caches():
+    """Start every test with empty in-process caches."""
+    assistant = sys.modules.get("assistant")
+    if assistant is not None:
+        assistant.embedding_cache.clear()
+        assistant.index.clear()
+        assistant.query_cache.clear()
+        assistant.lexical_index.clear()
+        assistant.page_cache.clear()
+        assistant.image_pool.clear()
+    yield
+
+
 @pytest.fixture
 def test_user():
     """Create a test user for testing."""
@@ -1,8 +1,50 @@
+import asyncio
+import base64
+import json
+import time
 import uuid
-from unittest.mock import Mock, patch
+from io import BytesIO
+from unittest.mock import AsyncMock, Mock, patch
 
 import assistant
+import httpx
 import pytest
+from PIL import Image
+from storage.page_cache import CachedPage
+from utils.http import PageFetcher
+
+
+def _text_chunk(content):
+    return Mock(choices=[Mock(delta=Mock(content=content, tool_calls=None))])
+
+
+def _tool_call_chunk(index, arguments, name=None, call_id=None):
+    tool_call_delta = Mock(index=index, id=call_id)
+    tool_call_delta.function = Mock(arguments=arguments)
+    tool_call_delta.function.name = name
+    return Mock(choices=[Mock(delta=Mock(content=None, tool_calls=[tool_call_delta]))])
+
+
+def _tool_call(call_id, name, arguments):
+    tool_call = Mock(id=call_id)
+    tool_call.function = Mock(arguments=arguments)
+    tool_call.function.name = name
+    return tool_call
+
+
+def _page_fetcher(transport):
+    return PageFetcher(
+        max_bytes=1000, per_host=2, max_connections=10, timeout=1, transport=transport
+    )
+
+
+def _recipe_match(recipe_id):
+    return assistant.RecipeMatch(recipe_id, f"Recipe {recipe_id}", 0.5, None, 10)
+
+
+async def _stream(*chunks):
+    for chunk in chunks:
+        yield chunk
 
 
 class TestAssistant:
@@ -20,7 +62,7 @@ class TestAssistant:
 
             with patch("assistant.BytesIO") as mock_bytesio:
                 mock_buffer = Mock()
-                mock_buffer.read.return_value = b"fake_jpeg_data"
+                mock_buffer.getvalue.return_value = b"fake_jpeg_data"
                 mock_bytesio.return_value = mock_buffer
 
                 with patch("assistant.base64.b64encode") as mock_b64encode:
@@ -29,89 +71,500 @@ class TestAssistant:
                     result = assistant.normalize_image_to_base64_jpeg(
                         b"fake_image_data"
                     )
-                    assert result == "fake_base64_data"
-
-    def test_extract_url_success(self):
+                    # Already the size the model uses, so not resized
+                    assert result == assistant.EncodedImage(
+                        "fake_base64_data", 1024, 768
+                    )
+                    mock_img.resize.assert_not_called()
+
+    @pytest.mark.parametrize(
+        "size, image_format, expected",
+        [
+            # A phone photo, decoded at reduced scale
+            ((4032, 3024), "JPEG", (1024, 768)),
+            # Not padded up to 1024 x 1024
+            ((768, 1024), "PNG", (768, 1024)),
+            # Trimmed to save a row of tiles
+            ((768, 1100), "PNG", (715, 1024)),
+            ((300, 200), "PNG", (300, 200)),
+        ],
+    )
+    def test_normalize_image_sizes_for_vision(self, size, image_format, expected):
+        """Test that images are sent at the model's size, never upscaled."""
+        source = BytesIO()
+        Image.new("RGBA", size, (200, 120, 40, 255)).convert(
+            "RGB" if image_format == "JPEG" else "RGBA"
+        ).save(source, format=image_format)
+
+        result = assistant.normalize_image_to_base64_jpeg(source.getvalue())
+
+        assert (result.width, result.height) == expected
+        with Image.open(BytesIO(base64.b64decode(result.data))) as output:
+            assert output.format == "JPEG"
+            assert output.size == expected
+
+    async def test_extract_url_success(self):
         """Test successful URL content extraction."""
-        mock_response = Mock()
-        mock_response.content = b"<html><body>Test content</body></html>"
-        mock_response.raise_for_status = Mock()
-
-        with patch("assistant.requests.get", return_value=mock_response):
-            with patch("assistant.BeautifulSoup") as mock_soup:
-                mock_soup.return_value.get_text.return_value = "Test content"
-                mock_soup.return_value.find.return_value = None
+        transport = httpx.MockTransport(
+            lambda request: httpx.Response(
+                200, content=b"<html><body>Test content</body></html>"
+            )
+        )
 
-                result = assistant.extract_url("https://example.com")
-                assert result == "Test content"
+        with patch("assistant.page_fetcher", _page_fetcher(transport)):
+            result = await assistant.extract_url("https://example.com")
+            assert result == "Test content"
 
-    def test_extract_url_failure(self):
+    async def test_extract_url_failure(self):
         """Test URL extraction failure handling."""
-        with patch("assistant.requests.get", side_effect=Exception("Network error")):
-            result = assistant.extract_url("https://example.com")
+
+        def fail(request):
+            raise httpx.ConnectError("Network error")
+
+        with patch("assistant.page_fetcher", _page_fetcher(httpx.MockTransport(fail))):
+            result = await assistant.extract_url("https://example.com")
             assert "An error occurred while processing the URL" in result
+            assert assistant.page_cache.stats()["entries"] == 0
+
+    async def test_extract_url_revalidates_cached_pages(self):
+        """Test that a stale page is revalidated instead of downloaded again."""
+        requests = []
+
+        def handler(request):
+            requests.append(request)
+            if request.headers.get("If-None-Match") == '"v1"':
+                return httpx.Response(304)
+            return httpx.Response(200, content=b"<p>Soup</p>", headers={"ETag": '"v1"'})
+
+        fetcher = _page_fetcher(httpx.MockTransport(handler))
+        with patch("assistant.page_fetcher", fetcher):
+            assert await assistant.extract_url("https://example.com/soup") == "Soup"
+            assert await assistant.extract_url("https://example.com/soup") == "Soup"
+            assert len(requests) == 1
+
+            with patch.object(assistant.page_cache, "ttl_seconds", 0):
+                with patch("assistant.extract_visible_text") as mock_parse:
+                    result = await assistant.extract_url("https://example.com/soup")
+
+            assert result == "Soup"
+            assert len(requests) == 2
+            mock_parse.assert_not_called()
+            assert assistant.page_cache.stats()["revalidations"] == 1
+
+    async def test_extract_url_uses_shared_cache_and_canonical_link(self):
+        """Test that recipes are stored under their canonical link and reused."""
+        transport = httpx.MockTransport(
+            lambda request: httpx.Response(
+                200,
+                content=b'<link rel="canonical" href="https://example.com/soup">'
+                b'<script type="application/ld+json">'
+                b'{"@type": "Recipe", "name": "Soup", "recipeIngredient": ["Leeks"]}'
+                b"</script>",
+            )
+        )
+
+        with (
+            patch("assistant.page_fetcher", _page_fetcher(transport)),
+            patch.object(assistant.page_cache, "store_persistent") as mock_store,
+        ):
+            result = await assistant.extract_url(
+                "https://Example.com/soup?utm_source=feed#comments"
+            )
 
-    def test_process_text_with_urls(self):
+        assert result == "recipe:\n  title: Soup\n  ingredients:\n  - name: Leeks\n"
+        urls, page = mock_store.call_args[0]
+        assert urls == ["https://example.com/soup", "https://example.com/soup"]
+        assert page.text == result
+
+    async def test_extract_url_only_shares_pages_with_a_recipe(self):
+        """Test that plain page text, maybe a bot check, isn't shared."""
+        transport = httpx.MockTransport(
+            lambda request: httpx.Response(200, content=b"<p>Are you human?</p>")
+        )
+
+        with (
+            patch("assistant.page_fetcher", _page_fetcher(transport)),
+            patch.object(assistant.page_cache, "store_persistent") as mock_store,
+        ):
+            result = await assistant.extract_url("https://example.com/soup")
+
+        assert result == "Are you human?"
+        mock_store.assert_not_called()
+
+    async def test_extract_url_revalidates_old_persistent_pages(self):
+        """Test that a stale shared page is revalidated and its age renewed."""
+        stored = CachedPage("Stored soup", '"v1"', None, -3600.0)
+        requests = []
+
+        def handler(request):
+            requests.append(request)
+            return httpx.Response(304)
+
+        with (
+            patch(
+                "assistant.page_fetcher", _page_fetcher(httpx.MockTransport(handler))
+            ),
+            patch.object(assistant.page_cache, "load_persistent", return_value=stored),
+            patch.object(assistant.page_cache, "renew_persistent") as mock_renew,
+        ):
+            result = await assistant.extract_url("https://example.com/soup")
+
+        assert result == "Stored soup"
+        assert requests[0].headers["If-None-Match"] == '"v1"'
+        mock_renew.assert_called_once_with("https://example.com/soup")
+
+    async def test_extract_url_serves_persistent_hits_without_fetching(self):
+        """Test that a page in the shared cache needs no request at all."""
+        stored = CachedPage("Stored soup", None, None, time.monotonic())
+
+        with (
+            patch("assistant.page_fetcher") as mock_fetcher,
+            patch.object(
+                assistant.page_cache, "load_persistent", return_value=stored
+            ) as mock_load,
+        ):
+            result = await assistant.extract_url("https://example.com/soup/")
+
+        assert result == "Stored soup"
+        mock_load.assert_called_once_with("https://example.com/soup/")
+        mock_fetcher.fetch.assert_not_called()
+
+    async def test_process_text_with_urls(self):
         """Test URL processing in text."""
         test_text = "Check out this recipe: https://example.com/recipe"
 
-        with patch("assistant.extract_url", return_value="Recipe content"):
-            result = assistant.process_text_with_urls(test_text)
+        with patch("assistant.extract_url", AsyncMock(return_value="Recipe content")):
+            result = await assistant.process_text_with_urls(test_text)
             assert (
                 "https://example.com/recipe (Extracted Content: Recipe content)"
                 in result
             )
 
-    def test_get_embeddings(self):
+    async def test_process_text_with_urls_fetches_concurrently(self):
+        """Test that every URL in a message is fetched at the same time."""
+        started = []
+        release = asyncio.Event()
+
+        async def extract(url):
+            started.append(url)
+            if len(started) == 2:
+                release.set()
+            await asyncio.wait_for(release.wait(), timeout=1)
+            return url.rsplit("/", 1)[-1]
+
+        with patch("assistant.extract_url", extract):
+            result = await assistant.process_text_with_urls(
+                "Compare https://a.example/soup and https://b.example/stew"
+            )
+
+        assert "https://a.example/soup (Extracted Content: soup)" in result
+        assert "https://b.example/stew (Extracted Content: stew)" in result
+
+    async def test_get_embeddings(self):
         """Test embeddings generation."""
         mock_response = Mock()
         mock_response.data = [Mock(embedding=[0.1, 0.2, 0.3])]
 
         with patch("assistant.openai_client") as mock_client:
-            mock_client.embeddings.create.return_value = mock_response
+            mock_client.embeddings.create = AsyncMock(return_value=mock_response)
 
-            result = assistant.get_embeddings("test content")
+            result = await assistant.get_embeddings("test content")
             assert result == [[0.1, 0.2, 0.3]]
 
-    def test_find_relevant_recipes(self):
+    async def test_embed_texts_uses_cache_for_repeated_inputs(self):
+        """Test that identical texts are embedded once and then served cached."""
+        mock_response = Mock()
+        mock_response.data = [Mock(embedding=[0.1]), Mock(embedding=[0.2])]
+
+        with patch("assistant.openai_client") as mock_client:
+            mock_client.embeddings.create = AsyncMock(return_value=mock_response)
+
+            first = await assistant.embed_texts(["soup", "stew", "soup"])
+            second = await assistant.embed_texts(["stew", "soup"])
+
+            assert first == [[0.1], [0.2], [0.1]]
+            assert second == [[0.2], [0.1]]
+            mock_client.embeddings.create.assert_awaited_once_with(
+                input=["soup", "stew"], model=assistant.EMBEDDINGS_MODEL
+            )
+            assert assistant.embedding_cache.stats()["memory_hits"] == 2
+
+    async def test_find_relevant_recipes(self):
         """Test relevant recipe finding with user isolation."""
         user_id = uuid.uuid4()
         mock_query_results = Mock()
         mock_query_results.matches = [
-            Mock(metadata={"contents": "Recipe 1"}),
-            Mock(metadata={"contents": "Recipe 2"}),
+            Mock(id="r1", score=0.8, metadata={"contents": "Recipe 1"}),
+            Mock(id="r2", score=0.1, metadata={"contents": "Recipe 2"}),
         ]
 
         with patch("assistant.get_embeddings", return_value=[[0.1, 0.2, 0.3]]):
             with patch("assistant.index") as mock_index:
                 mock_index.query.return_value = mock_query_results
 
-                result = assistant.find_relevant_recipes("pasta", user_id)
-                assert result == ["Recipe 1", "Recipe 2"]
+                result = await assistant.find_relevant_recipes("pasta", user_id)
+                # Recipe 2 is below the similarity cutoff
+                assert [match.contents for match in result] == ["Recipe 1"]
+                assert result[0].similarity == 0.8
+                assert result[0].lexical_score is None
 
                 # Verify user namespace isolation
                 mock_index.query.assert_called_with(
                     namespace=f"user_{user_id}",
                     vector=[0.1, 0.2, 0.3],
-                    top_k=5,
+                    top_k=assistant.config.RECIPE_SEARCH_CANDIDATES,
                     include_values=False,
                     include_metadata=True,
                 )
 
-    def test_add_recipe(self):
+    async def test_find_relevant_recipes_caches_until_a_write(self):
+        """Test that repeat searches skip retrieval until the user adds a recipe."""
+        user_id = uuid.uuid4()
+
+        with patch("assistant.get_embeddings", return_value=[[0.1] * 1536]) as embed:
+            await assistant.add_recipe("recipe:\n  title: Soup\n", user_id)
+
+            first = await assistant.find_relevant_recipes("Soup?", user_id)
+            repeat = await assistant.find_relevant_recipes("  soup ", user_id)
+            assert embed.await_count == 1
+            assert repeat == first
+
+            await assistant.add_recipe("recipe:\n  title: Stew\n", user_id)
+            after_write = await assistant.find_relevant_recipes("soup", user_id)
+
+            assert embed.await_count == 2
+            assert len(after_write) == 2
+            assert assistant.query_cache.stats()["hits"] == 1
+
+    async def test_ingredient_query_skips_embedding(self):
+        """Test that a query naming only known ingredients is answered lexically."""
+        user_id = uuid.uuid4()
+        await assistant.add_recipe(
+            "recipe:\n  title: Leek Tart\n  ingredients:\n    - name: leeks\n",
+            user_id,
+        )
+        await assistant.add_recipe("recipe:\n  title: Toast\n", user_id)
+
+        with patch("assistant.get_embeddings") as mock_embeddings:
+            results = await assistant.find_relevant_recipes(
+                "What can I make with leeks?", user_id
+            )
+
+        mock_embeddings.assert_not_called()
+        assert len(results) == 1
+        assert "Leek Tart" in results[0].contents
+        assert results[0].lexical_score > 0
+        assert results[0].similarity is None
+
+    async def test_ingredient_query_sees_other_workers_writes(self):
+        """Test that a write made elsewhere reloads the lexical index."""
+        user_id = uuid.uuid4()
+        namespace = f"user_{user_id}"
+        recipe_id = await assistant.add_recipe(
+            "recipe:\n  title: Leek Tart\n  ingredients:\n    - name: leeks\n",
+            user_id,
+        )
+        await assistant.find_relevant_recipes("leeks", user_id)
+
+        # Another worker edits the recipe and bumps the shared version
+        edited = "recipe:\n  title: Leek Pie\n  ingredients:\n    - name: leeks\n"
+        assistant.index.upsert(
+            [assistant.recipe_vector(recipe_id, edited, [0.1] * 1536, "edited")],
+            namespace=namespace,
+        )
+        with patch.object(assistant.query_cache, "load_shared_version", return_value=7):
+            results = await assistant.find_relevant_recipes("leeks", user_id)
+
+        assert "Leek Pie" in results[0].contents
+
+    async def test_find_relevant_recipes_fuses_lexical_and_vector_ranks(self):
+        """Test that a title match ranks first even when vectors disagree."""
+        user_id = uuid.uuid4()
+        namespace = f"user_{user_id}"
+        assistant.lexical_index.begin_load(namespace, 0)
+        assistant.lexical_index.finish_load(
+            namespace,
+            0,
+            [("curry", "recipe:\n  title: Green Curry\n")],
+        )
+
+        with (
+            patch("assistant.get_embeddings", return_value=[[0.1]]),
+            patch("assistant.index") as mock_index,
+        ):
+            mock_index.query.return_value = Mock(
+                matches=[
+                    Mock(id="soup", score=0.5, metadata={"contents": "soup"}),
+                    Mock(id="curry", score=0.4, metadata={"contents": "curry"}),
+                ]
+            )
+
+            results = await assistant.find_relevant_recipes(
+                "a spicy curry please", user_id
+            )
+
+        assert [match.recipe_id for match in results] == ["curry", "soup"]
+        assert results[0].similarity == 0.4
+        assert results[0].lexical_score > 0
+        # The vector store's copy wins over the lexical index's
+        assert results[0].contents == "curry"
+
+    def test_select_recipes_packs_token_budget(self):
+        """Test that recipes are packed best first, skipping ones that don't fit."""
+        matches = [
+            assistant.RecipeMatch(name, name, 0.9, None, tokens)
+            for name, tokens in [("a", 100), ("big", 500), ("b", 150), ("c", 50)]
+        ]
+        separator = assistant.count_tokens("\n\n")
+
+        selected = assistant.select_recipes(matches, max_tokens=300 + 3 * separator)
+
+        assert [match.recipe_id for match in selected] == ["a", "b", "c"]
+        assert assistant.select_recipes(matches, max_tokens=50) == []
+
+    async def test_add_recipe(self):
         """Test recipe addition with user isolation."""
         user_id = uuid.uuid4()
         test_recipe = "recipe:\n  title: Test Recipe"
 
-        with patch("assistant.update_recipe") as mock_update:
-            with patch("assistant.uuid.uuid4") as mock_uuid:
-                mock_uuid.return_value = "test-uuid"
+        with patch("assistant.add_recipes", return_value=["test-uuid"]) as mock_add:
+            result = await assistant.add_recipe(test_recipe, user_id)
+
+        assert result == "test-uuid"
+        mock_add.assert_awaited_once_with(
+            [{"recipe": {"title": "Test Recipe"}}], user_id
+        )
 
-                result = assistant.add_recipe(test_recipe, user_id)
-                assert result == "test-uuid"
-                mock_update.assert_called_once_with("test-uuid", test_recipe, user_id)
+    async def test_add_recipe_returns_existing_duplicate(self):
+        """Test that adding an identical recipe returns the stored id."""
+        user_id = uuid.uuid4()
+        digest = assistant.content_hash(
+            assistant.canonical_recipe_yaml({"recipe": {"title": "Soup"}})
+        )
+
+        with (
+            patch("assistant.embed_texts", return_value=[[0.1]]),
+            patch("assistant.index") as mock_index,
+        ):
+            mock_index.query.return_value = Mock(
+                matches=[Mock(id="existing-id", metadata={"content_hash": digest})]
+            )
+
+            result = await assistant.add_recipe(
+                "recipe:\n  title: 'Soup'\nrecipe_id: copied-id\n", user_id
+            )
+
+            assert result == "existing-id"
+            assert mock_index.query.call_args[1]["filter"] == {
+                "content_hash": {"$in": [digest]}
+            }
+            mock_index.upsert.assert_not_called()
+
+    async def test_add_recipes_derives_ids_from_content(self):
+        """Test that racing adds of one recipe overwrite a single vector."""
+        user_id = uuid.uuid4()
+
+        with (
+            patch("assistant.embed_texts", return_value=[[0.1]]),
+            patch("assistant.index") as mock_index,
+        ):
+            # Both adds miss the duplicate check, as they would if they raced
+            mock_index.query.return_value = Mock(matches=[])
+
+            first = await assistant.add_recipes([{"recipe": {"title": "A"}}], user_id)
+            second = await assistant.add_recipes([{"recipe": {"title": "A"}}], user_id)
+            other_user = await assistant.add_recipes(
+                [{"recipe": {"title": "A"}}], uuid.uuid4()
+            )
+
+        assert first == second != other_user
+        assert [
+            c[1]["vectors"][0]["id"] for c in mock_index.upsert.call_args_list[:2]
+        ] == first * 2
+
+    async def test_find_recipes_by_hash_looks_up_hashes_crowded_out(self):
+        """Test that duplicates of one hash can't hide another from the check."""
+        user_id = uuid.uuid4()
+        crowded = Mock(
+            matches=[
+                Mock(id=f"a-{i}", metadata={"content_hash": "a"})
+                for i in range(2 * assistant.HASH_MATCHES_PER_RECIPE)
+            ]
+        )
+
+        with patch("assistant.index") as mock_index:
+            mock_index.query.side_effect = [
+                crowded,
+                Mock(matches=[Mock(id="b-0", metadata={"content_hash": "b"})]),
+            ]
+
+            existing = await assistant.find_recipes_by_hash(user_id, ["a", "b"], [0.1])
+
+        assert existing["b"] == "b-0"
+        assert set(existing) == {"a", "b"}
+        first, second = mock_index.query.call_args_list
+        assert first[1]["top_k"] == 2 * assistant.HASH_MATCHES_PER_RECIPE
+        assert second[1]["filter"] == {"content_hash": {"$in": ["b"]}}
+        assert second[1]["top_k"] == 1
+
+    async def test_add_recipes_stores_repeated_recipe_once(self):
+        """Test that identical recipes in one upload share a single vector."""
+        user_id = uuid.uuid4()
+        recipes = [
+            {"recipe": {"title": "A", "serves": 2}},
+            {"recipe": {"serves": 2, "title": "A"}},
+            {"recipe": {"title": "B"}},
+        ]
 
-    def test_update_recipe(self):
+        with (
+            patch("assistant.embed_texts", return_value=[[0.1], [0.2]]) as mock_embed,
+            patch("assistant.index") as mock_index,
+        ):
+            mock_index.query.return_value = Mock(matches=[])
+
+            results = await assistant.add_recipes(recipes, user_id)
+
+            assert len(mock_embed.call_args[0][0]) == 2
+            assert results[0] == results[1] != results[2]
+            vectors = mock_index.upsert.call_args[1]["vectors"]
+            assert [v["id"] for v in vectors] == [results[0], results[2]]
+
+    async def test_add_recipes_batches_embeddings_and_upserts(self):
+        """Test that bulk adds embed and upsert in chunks, failing per chunk."""
+        user_id = uuid.uuid4()
+        recipes = [{"recipe": {"title": f"Recipe {i}"}} for i in range(5)]
+
+        async def embed(texts):
+            return [[0.1] for _ in texts]
+
+        with (
+            patch("assistant.embed_texts", side_effect=embed) as mock_embed,
+            patch("assistant.index") as mock_index,
+            patch("assistant.config.EMBEDDING_BATCH_SIZE", 4),
+            patch("assistant.config.UPSERT_BATCH_SIZE", 2),
+        ):
+            mock_index.upsert.side_effect = [None, RuntimeError("unavailable"), None]
+
+            results = await assistant.add_recipes(recipes, user_id)
+
+            assert [len(c[0][0]) for c in mock_embed.call_args_list] == [4, 1]
+            assert mock_index.upsert.call_count == 3
+            assert all(
+                c[1]["namespace"] == f"user_{user_id}"
+                for c in mock_index.upsert.call_args_list
+            )
+            assert [isinstance(r, RuntimeError) for r in results] == [
+                False,
+                False,
+                True,
+                True,
+                False,
+            ]
+            stored = mock_index.upsert.call_args_list[0][1]["vectors"][0]
+            assert stored["id"] == results[0]
+            assert f"recipe_id: {results[0]}" in stored["metadata"]["contents"]
+
+    async def test_update_recipe(self):
         """Test recipe update with user isolation."""
         user_id = uuid.uuid4()
         test_recipe = "recipe:\n  title: Test Recipe"
@@ -125,7 +578,9 @@ class TestAssistant:
                         mock_yaml_dump.return_value = test_recipe
                         mock_embeddings.return_value = [[0.1, 0.2, 0.3]]
 
-                        result = assistant.update_recipe(test_id, test_recipe, user_id)
+                        result = await assistant.update_recipe(
+                            test_id, test_recipe, user_id
+                        )
                         assert result == test_id
 
                         # Verify user namespace isolation
@@ -133,7 +588,34 @@ class TestAssistant:
                         call_args = mock_index.upsert.call_args
                         assert call_args[1]["namespace"] == f"user_{user_id}"
 
-    def test_update_recipe_with_yaml_parsing_error(self):
+    async def test_update_recipe_skips_unchanged_contents(self):
+        """Test that an update with identical contents doesn't re-embed."""
+        user_id = uuid.uuid4()
+        recipe_data = {"recipe": {"title": "Soup", "serves": 4}}
+        digest = assistant.content_hash(assistant.canonical_recipe_yaml(recipe_data))
+
+        with (
+            patch("assistant.get_embeddings") as mock_embeddings,
+            patch("assistant.index") as mock_index,
+        ):
+            mock_index.fetch.return_value = Mock(
+                vectors={"soup-id": Mock(metadata={"content_hash": digest})}
+            )
+
+            result = await assistant.update_recipe(
+                "soup-id",
+                "recipe_id: soup-id\nrecipe:\n  serves: 4\n  title: Soup\n",
+                user_id,
+            )
+
+            assert result == "soup-id"
+            mock_index.fetch.assert_called_once_with(
+                ids=["soup-id"], namespace=f"user_{user_id}"
+            )
+            mock_embeddings.assert_not_called()
+            mock_index.upsert.assert_not_called()
+
+    async def test_update_recipe_with_yaml_parsing_error(self):
         """Test recipe update handles YAML parsing errors gracefully."""
         # This is the problematic YAML from the bug report
         bad_yaml = '''recipe:
@@ -158,13 +640,13 @@ class TestAssistant:
                 mock_embeddings.return_value = [[0.1, 0.2, 0.3]]
 
                 # This should succeed because our fix handles the unescaped quotes
-                result = assistant.update_recipe(test_id, bad_yaml, user_id)
+                result = await assistant.update_recipe(test_id, bad_yaml, user_id)
                 assert result == test_id
 
                 # Verify the recipe was processed and stored
                 mock_index.upsert.assert_called_once()
 
-    def test_update_recipe_with_unfixable_yaml(self):
+    async def test_update_recipe_with_unfixable_yaml(self):
         """Test recipe update raises error for unfixable YAML."""
         # Completely broken YAML that can't be fixed
         broken_yaml = """
@@ -175,4 +657,208 @@ this: is: not: valid: yaml: at: all
         user_id = uuid.uuid4()
 
         with pytest.raises(ValueError, match="Invalid YAML format in recipe"):
-            assistant.update_recipe("test-broken", broken_yaml, user_id)
+            await assistant.update_recipe("test-broken", broken_yaml, user_id)
+
+    async def test_stream_completion_yields_text_deltas(self):
+        """Test that completion text is forwarded as it arrives."""
+        with patch("assistant.openai_client") as mock_client:
+            mock_client.chat.completions.create = AsyncMock(
+                return_value=_stream(_text_chunk("Hello"), _text_chunk(" there"))
+            )
+
+            events = [
+                event
+                async for event in assistant.stream_completion(
+                    [{"role": "user", "content": "hi"}]
+                )
+            ]
+
+            assert events[:2] == [
+                {"type": "delta", "content": "Hello"},
+                {"type": "delta", "content": " there"},
+            ]
+            assert events[-1] == {
+                "type": "completion",
+                "content": "Hello there",
+                "tool_calls": None,
+            }
+            assert mock_client.chat.completions.create.call_args[1]["stream"] is True
+
+    async def test_stream_completion_assembles_tool_calls(self):
+        """Test that tool-call argument fragments are streamed and reassembled."""
+        with patch("assistant.openai_client") as mock_client:
+            mock_client.chat.completions.create = AsyncMock(
+                return_value=_stream(
+                    _tool_call_chunk(0, '{"recipe_', name="add_recipe", call_id="c1"),
+                    _tool_call_chunk(0, 'yaml": "x"}'),
+                )
+            )
+
+            events = [
+                event
+                async for event in assistant.stream_completion(
+                    [{"role": "user", "content": "add this"}], tools=assistant.TOOLS
+                )
+            ]
+
+            assert [e["arguments"] for e in events[:-1]] == ['{"recipe_', 'yaml": "x"}']
+            assert all(e["tool"] == "add_recipe" for e in events[:-1])
+            tool_call = events[-1]["tool_calls"][0]
+            assert tool_call.id == "c1"
+            assert tool_call.function.name == "add_recipe"
+            assert tool_call.function.arguments == '{"recipe_yaml": "x"}'
+
+    async def test_chat_with_feedback_streams_response(self):
+        """Test that the streaming chat forwards deltas before the final response."""
+        user = Mock(id=uuid.uuid4())
+        thread = Mock(id=uuid.uuid4(), user_id=user.id, contents="")
+
+        with (
+            patch("assistant.openai_client") as mock_client,
+            patch("assistant.find_relevant_recipes", return_value=[]),
+            patch("assistant.upsert_conversation", return_value=thread),
+            patch("assistant.get_conversation_contents", return_value=[]),
+            patch("assistant.update_conversation_contents") as mock_update,
+        ):
+            mock_client.chat.completions.create = AsyncMock(
+                return_value=_stream(_text_chunk("Try "), _text_chunk("risotto."))
+            )
+
+            events = [
+                event
+                async for event in assistant.chat_with_feedback(
+                    Mock(), user, "What should I cook?"
+                )
+            ]
+
+            deltas = [e["content"] for e in events if e["type"] == "delta"]
+            assert deltas == ["Try ", "risotto."]
+            assert events[-1].pop("elapsed_ms") >= 0
+            assert events[-1] == {
+                "type": "response",
+                "content": "Try risotto.",
+                "thread_id": str(thread.id),
+            }
+            assert mock_update.call_args[0][1][1] == {
+                "role": "assistant",
+                "content": "Try risotto.",
+            }
+
+    async def test_chat_with_feedback_progress_events_are_timed(self):
+        """Test that every stage reports start and finish with elapsed times."""
+        user = Mock(id=uuid.uuid4())
+        thread = Mock(id=uuid.uuid4(), user_id=user.id, contents="")
+
+        with (
+            patch("assistant.openai_client") as mock_client,
+            patch(
+                "assistant.find_relevant_recipes", return_value=[_recipe_match("r1")]
+            ),
+            patch("assistant.upsert_conversation", return_value=thread),
+            patch("assistant.get_conversation_contents", return_value=[]),
+            patch("assistant.update_conversation_contents"),
+        ):
+            mock_client.chat.completions.create = AsyncMock(
+                return_value=_stream(_text_chunk("Done."))
+            )
+
+            events = [
+                event
+                async for event in assistant.chat_with_feedback(
+                    Mock(), user, "What should I cook?"
+                )
+            ]
+
+            started = [e["stage"] for e in events if e["type"] == "status"]
+            finished = [e["stage"] for e in events if "duration_ms" in e]
+            assert started == ["initializing", "recipe_search", "generating"]
+            assert finished == started
+
+            search = next(e for e in events if e["type"] == "recipe_search")
+            assert search["count"] == 1
+            assert search["message"] == "Found 1 relevant recipe"
+            assert search["recipes"] == [
+                {
+                    "recipe_id": "r1",
+                    "similarity": 0.5,
+                    "lexical_score": None,
+                    "tokens": 10,
+                }
+            ]
+
+            elapsed = [e["elapsed_ms"] for e in events if "elapsed_ms" in e]
+            assert elapsed == sorted(elapsed)
+
+    async def test_start_turn_tasks_runs_independent_steps(self):
+        """Test that a turn with a link and a photo fans out all three steps."""
+        user_id = uuid.uuid4()
+        attachment = Mock()
+        attachment.read = AsyncMock(return_value=b"image-bytes")
+
+        with (
+            patch("assistant.process_text_with_urls", return_value="text + page"),
+            patch(
+                "assistant.normalize_image_to_base64_jpeg",
+                return_value=assistant.EncodedImage("abc", 512, 512),
+            ),
+            patch(
+                "assistant.find_relevant_recipes", return_value=[_recipe_match("r1")]
+            ) as find,
+        ):
+            tasks = assistant.start_turn_tasks(
+                "see https://example.com", user_id, attachment
+            )
+            await assistant.gather_turn_tasks(tasks)
+
+            assert set(tasks) == {"url_extraction", "image_processing", "recipe_search"}
+            find.assert_awaited_once_with("see https://example.com", user_id)
+
+            text, content, tokens = assistant.build_user_message("see", tasks)
+            assert text == "text + page"
+            assert content[0] == {"type": "text", "text": "text + page"}
+            assert content[1]["image_url"]["url"].endswith("base64,abc")
+            # One tile for the image, not the tokens of its base64 data
+            assert tokens == assistant.count_tokens("text + page") + 85 + 170
+
+    async def test_tool_calls_run_concurrently_in_original_order(self):
+        """Test that tool calls overlap but their results keep the model's order."""
+        user_id = uuid.uuid4()
+        running = 0
+        peak = 0
+
+        async def slow_add_recipe(recipe_yaml, user_id):
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            # Later calls finish first
+            await asyncio.sleep(0.01 * (5 - int(recipe_yaml)))
+            running -= 1
+            return f"id-{recipe_yaml}"
+
+        tool_calls = [
+            _tool_call(f"c{i}", "add_recipe", json.dumps({"recipe_yaml": str(i)}))
+            for i in range(5)
+        ]
+
+        with (
+            patch("assistant.add_recipe", side_effect=slow_add_recipe),
+            patch("assistant.config.TOOL_CALL_CONCURRENCY", 3),
+        ):
+            tasks = assistant.start_tool_call_tasks(tool_calls, user_id)
+            finished = [s async for s in assistant.iterate_finished_turn_tasks(tasks)]
+
+        assert peak == 3
+        assert finished != list(tasks)
+        assert [json.loads(t.result()[0]["content"]) for t in tasks.values()] == [
+            {"recipe_id": f"id-{i}"} for i in range(5)
+        ]
+
+    async def test_execute_tool_call_reports_errors(self):
+        """Test that a failing tool call becomes an error message for the model."""
+        tool_call = _tool_call("c1", "update_recipe", "not json")
+
+        message, error_msg = await assistant.execute_tool_call(tool_call, uuid.uuid4())
+
+        assert error_msg.startswith("Error processing recipe")
+        assert message["name"] == "update_recipe"
+        assert json.loads(message["content"]) == {"error": error_msg}
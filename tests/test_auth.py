@@ -7,6 +7,7 @@ from auth.jwt_handler import JWTHandler
 from auth.models import GoogleUserInfo, User, UserCreate, UserResponse
 from auth.oauth import GoogleOAuth
 from auth.repository import UserRepository
+from config import config
 
 
 class TestUser:
@@ -320,7 +321,7 @@ class TestUserRepository:
 class TestTenancy:
     """Test multi-user tenancy and data isolation."""
 
-    def test_user_namespace_isolation(self):
+    async def test_user_namespace_isolation(self):
         """Test that users get isolated Pinecone namespaces."""
         from assistant import find_relevant_recipes
 
@@ -330,30 +331,30 @@ class TestTenancy:
         with patch("assistant.index") as mock_index:
             with patch("assistant.get_embeddings", return_value=[[0.1, 0.2, 0.3]]):
                 # User 1 searches
-                find_relevant_recipes("pasta", user1_id)
+                await find_relevant_recipes("pasta", user1_id)
 
                 # Verify namespace isolation
                 mock_index.query.assert_called_with(
                     namespace=f"user_{user1_id}",
                     vector=[0.1, 0.2, 0.3],
-                    top_k=5,
+                    top_k=config.RECIPE_SEARCH_CANDIDATES,
                     include_values=False,
                     include_metadata=True,
                 )
 
                 # User 2 searches
-                find_relevant_recipes("pizza", user2_id)
+                await find_relevant_recipes("pizza", user2_id)
 
                 # Verify different namespace
                 mock_index.query.assert_called_with(
                     namespace=f"user_{user2_id}",
                     vector=[0.1, 0.2, 0.3],
-                    top_k=5,
+                    top_k=config.RECIPE_SEARCH_CANDIDATES,
                     include_values=False,
                     include_metadata=True,
                 )
 
-    def test_recipe_storage_isolation(self):
+    async def test_recipe_storage_isolation(self):
         """Test that recipes are stored in user-specific namespaces."""
         from assistant import update_recipe
 
@@ -366,7 +367,7 @@ class TestTenancy:
                 with patch("assistant.get_embeddings", return_value=[[0.1, 0.2, 0.3]]):
                     with patch("assistant.index") as mock_index:
 
-                        update_recipe(recipe_id, recipe_yaml, user_id)
+                        await update_recipe(recipe_id, recipe_yaml, user_id)
 
                         # Verify recipe stored in user namespace
                         mock_index.upsert.assert_called_once()
@@ -380,6 +381,25 @@ class TestTenancy:
                         assert vectors[0]["values"] == [0.1, 0.2, 0.3]
 
 
+class TestAdminAccess:
+    async def test_listed_admin_is_allowed(self):
+        from auth.dependencies import get_admin_user
+
+        user = User(email="Chef@Example.com", name="Chef", provider_id="1")
+        with patch.object(config, "ADMIN_EMAILS", ["chef@example.com"]):
+            assert await get_admin_user(user) is user
+
+    async def test_other_users_are_forbidden(self):
+        from auth.dependencies import get_admin_user
+        from fastapi import HTTPException
+
+        user = User(email="guest@example.com", name="Guest", provider_id="2")
+        with patch.object(config, "ADMIN_EMAILS", ["chef@example.com"]):
+            with pytest.raises(HTTPException) as e:
+                await get_admin_user(user)
+        assert e.value.status_code == 403
+
+
 @pytest.mark.asyncio
 class TestAuthIntegration:
     """Integration tests for authentication flow."""
@@ -54,6 +54,14 @@ class TestConfig:
             # Should not raise an exception
             config.validate_required_vars()
 
+    def test_local_vector_store_needs_no_pinecone_key(self):
+        """Test that the Pinecone key is only required for the Pinecone store."""
+        with (
+            patch.object(Config, "VECTOR_STORE", "local"),
+            patch.object(Config, "PINECONE_API_KEY", ""),
+        ):
+            Config().validate_required_vars()
+
     def test_boolean_config_parsing(self):
         """Test that boolean environment variables are parsed correctly."""
         with patch.object(Config, "DEBUG", True), patch.object(Config, "RELOAD", False):
@@ -0,0 +1,147 @@
+import json
+from unittest.mock import patch
+
+import pytest
+from extraction import RecipeScanner, extract_visible_text
+
+RECIPE_JSON_LD = {
+    "@type": "Recipe",
+    "name": "Mushroom &amp; Leek Risotto",
+    "description": "<p>Creamy and comforting.</p>",
+    "totalTime": "PT1H5M",
+    "recipeYield": ["4", "4 servings"],
+    "recipeIngredient": ["300g arborio rice", "1 1/2 cups stock", "Salt"],
+    "recipeInstructions": [
+        {
+            "@type": "HowToSection",
+            "name": "Prep",
+            "itemListElement": [{"@type": "HowToStep", "text": "Slice the leeks."}],
+        },
+        {"@type": "HowToStep", "text": "Stir in the rice."},
+        "Season to taste.",
+    ],
+}
+
+
+def _page(*blocks, body="<p>Lots of unrelated text</p>"):
+    scripts = "".join(
+        f'<script type="application/ld+json">{json.dumps(block)}</script>'
+        for block in blocks
+    )
+    return f"<html><head>{scripts}</head><body>{body}</body></html>".encode()
+
+
+def _scan(page):
+    scanner = RecipeScanner()
+    scanner.feed(page)
+    return scanner.recipe
+
+
+class TestRecipeScanner:
+    def test_maps_recipe_fields(self):
+        """Test that schema.org fields map onto the recipe YAML structure."""
+        recipe = _scan(_page(RECIPE_JSON_LD))
+
+        assert recipe == {
+            "title": "Mushroom & Leek Risotto",
+            "estimated_cooking_time": "1 hour 5 minutes",
+            "serves": 4,
+            "ingredients": [
+                {"name": "arborio rice", "qty": "300g"},
+                {"name": "stock", "qty": "1 1/2 cups"},
+                {"name": "Salt"},
+            ],
+            "steps": [
+                {"step": "Slice the leeks."},
+                {"step": "Stir in the rice."},
+                {"step": "Season to taste."},
+            ],
+            "notes": "Creamy and comforting.",
+        }
+
+    def test_finds_recipe_in_graph_after_other_blocks(self):
+        """Test that every block, @graph arrays and lists are searched."""
+        page = _page(
+            {"@type": "Organization", "name": "Food Blog"},
+            "not an object",
+            [
+                {
+                    "@context": "https://schema.org",
+                    "@graph": [
+                        {"@type": "WebPage"},
+                        dict(RECIPE_JSON_LD, **{"@type": ["Recipe", "NewsArticle"]}),
+                    ],
+                }
+            ],
+        )
+
+        recipe = _scan(page)
+
+        assert recipe is not None
+        assert recipe["title"] == "Mushroom & Leek Risotto"
+
+    def test_skips_invalid_json_and_empty_recipes(self):
+        """Test that broken blocks and recipes without content are ignored."""
+        page = b'<script type="application/ld+json">{not json</script>' + _page(
+            {"@type": "Recipe", "name": "Just a title"}
+        )
+
+        assert _scan(page) is None
+
+    def test_finds_recipe_split_across_chunks(self):
+        """Test that blocks and tags cut at chunk boundaries are still found."""
+        page = _page({"@type": "WebSite"}, RECIPE_JSON_LD)
+        scanner = RecipeScanner()
+
+        found = [scanner.feed(page[i : i + 7]) for i in range(0, len(page), 7)]
+
+        assert scanner.recipe is not None
+        assert scanner.recipe["title"] == "Mushroom & Leek Risotto"
+        # Everything after the recipe block could have been skipped
+        assert found.index(True) < len(found) - 1
+
+    def test_reads_canonical_link_from_head(self):
+        """Test that the page's canonical link is picked up while streaming."""
+        page = b'<html><head><link href="/soup" rel="canonical">' + _page(
+            RECIPE_JSON_LD
+        )
+        scanner = RecipeScanner()
+
+        scanner.feed(page)
+
+        assert scanner.canonical_link == "/soup"
+
+    def test_ignores_other_scripts(self):
+        """Test that JSON inside ordinary scripts isn't mistaken for JSON-LD."""
+        page = (
+            b"<script>var recipe = "
+            + json.dumps(RECIPE_JSON_LD).encode()
+            + b";</script><p>Soup</p>"
+        )
+        scanner = RecipeScanner()
+
+        assert not scanner.feed(page)
+        assert scanner.recipe is None
+
+
+class TestExtractVisibleText:
+    @pytest.mark.parametrize("selectolax", [True, False])
+    def test_falls_back_to_main_text_without_boilerplate(self, selectolax):
+        """Test that navigation, footers and scripts are left out."""
+        page = (
+            b"<html><body><nav>Home | About</nav><article><h1>Soup</h1>"
+            b"<p>Simmer the leeks.</p><script>track()</script></article>"
+            b"<footer>Copyright</footer></body></html>"
+        )
+
+        if selectolax:
+            assert extract_visible_text(page, 100) == "Soup\nSimmer the leeks."
+        else:
+            with patch("extraction.LexborHTMLParser", None):
+                assert extract_visible_text(page, 100) == "Soup\nSimmer the leeks."
+
+    def test_fallback_text_is_bounded(self):
+        """Test that the fallback never exceeds the token cap."""
+        page = b"<html><body><p>" + b"word " * 5000 + b"</p></body></html>"
+
+        assert extract_visible_text(page, max_tokens=10) == "word " * 9 + "word"
@@ -0,0 +1,116 @@
+import asyncio
+
+import httpx
+import pytest
+from utils.http import PageFetcher, canonical_url, same_site
+
+
+def _fetcher(handler, max_bytes=1000, per_host=2):
+    return PageFetcher(
+        max_bytes=max_bytes,
+        per_host=per_host,
+        max_connections=10,
+        timeout=1,
+        transport=httpx.MockTransport(handler),
+    )
+
+
+class TestPageFetcher:
+    async def test_truncates_large_pages(self):
+        """Test that bodies past the size cap are cut off."""
+        fetcher = _fetcher(lambda request: httpx.Response(200, content=b"x" * 50), 10)
+
+        page = await fetcher.fetch("https://example.com/big")
+
+        assert page.content == b"x" * 10
+        assert page.truncated
+
+    # Stopping early must close the body iterators, not leave them to the GC
+    @pytest.mark.filterwarnings(
+        "error::RuntimeWarning", "error::pytest.PytestUnraisableExceptionWarning"
+    )
+    async def test_until_stops_reading(self):
+        """Test that the download stops once the callback is satisfied."""
+
+        async def body():
+            for _ in range(10):
+                yield b"chunk"
+
+        fetcher = _fetcher(lambda request: httpx.Response(200, content=body()))
+        seen = []
+
+        def until(chunk):
+            seen.append(chunk)
+            return len(seen) == 3
+
+        page = await fetcher.fetch("https://example.com", until=until)
+
+        assert page.content == b"chunk" * 3
+        assert len(seen) == 3
+
+    async def test_conditional_request(self):
+        """Test that validators are sent and a 304 comes back empty."""
+        seen = {}
+
+        def handler(request):
+            seen.update(request.headers)
+            return httpx.Response(304, headers={"ETag": '"v1"'})
+
+        page = await _fetcher(handler).fetch(
+            "https://example.com", etag='"v1"', last_modified="Mon, 01 Jan 2024"
+        )
+
+        assert page.not_modified
+        assert page.content == b""
+        assert seen["if-none-match"] == '"v1"'
+        assert seen["if-modified-since"] == "Mon, 01 Jan 2024"
+
+    async def test_error_status_raises(self):
+        """Test that error responses raise instead of returning a page."""
+        fetcher = _fetcher(lambda request: httpx.Response(404))
+
+        try:
+            await fetcher.fetch("https://example.com/missing")
+        except httpx.HTTPStatusError as e:
+            assert e.response.status_code == 404
+        else:
+            raise AssertionError("Expected HTTPStatusError")
+
+    async def test_limits_requests_per_host(self):
+        """Test that one host never sees more than per_host requests at once."""
+        active = {"a.example": 0, "b.example": 0}
+        peak = {"a.example": 0, "b.example": 0}
+
+        async def handler(request):
+            host = request.url.host
+            active[host] += 1
+            peak[host] = max(peak[host], active[host])
+            await asyncio.sleep(0.01)
+            active[host] -= 1
+            return httpx.Response(200, content=b"ok")
+
+        fetcher = _fetcher(handler, per_host=2)
+        await asyncio.gather(
+            *(fetcher.fetch(f"https://a.example/{i}") for i in range(6)),
+            *(fetcher.fetch(f"https://b.example/{i}") for i in range(6)),
+        )
+
+        assert peak == {"a.example": 2, "b.example": 2}
+        assert fetcher._hosts == {}
+        await fetcher.aclose()
+
+
+class TestCanonicalUrl:
+    def test_normalizes_equivalent_links(self):
+        """Test that tracking, case, ports and fragments don't split the key."""
+        assert canonical_url(
+            "HTTPS://Example.com:443/Soup?utm_source=x&b=2&a=1&fbclid=y#step-3"
+        ) == ("https://example.com/Soup?a=1&b=2")
+        assert canonical_url("http://example.com") == "http://example.com/"
+        assert canonical_url("http://example.com:8080/x") == (
+            "http://example.com:8080/x"
+        )
+
+    def test_same_site(self):
+        assert same_site("https://www.example.com/a", "https://example.com/b")
+        assert not same_site("https://evil.example/a", "https://example.com/a")
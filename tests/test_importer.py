@@ -0,0 +1,231 @@
+import io
+import threading
+import uuid
+from unittest.mock import Mock, patch
+
+import importer
+import pytest
+import yaml
+
+
+def _parse(content: str):
+    return list(importer.iter_upload_recipes(io.BytesIO(content.encode("utf-8"))))
+
+
+class TestIterUploadRecipes:
+    def test_recipes_list(self):
+        """Test the recipes: [...] format."""
+        content = yaml.dump(
+            {"recipes": [{"recipe": {"title": "A"}}, {"title": "B"}, "C"]}
+        )
+
+        assert _parse(content) == [
+            (0, {"recipe": {"title": "A"}}, None),
+            (1, None, "Missing 'recipe' key"),
+            (2, None, "Must be an object"),
+        ]
+
+    def test_multiple_documents(self):
+        """Test recipes separated by --- document markers."""
+        content = "recipe:\n  title: A\n---\nrecipe:\n  title: B\n"
+
+        items = _parse(content)
+
+        assert [recipe["recipe"]["title"] for _, recipe, _ in items] == ["A", "B"]
+
+    def test_invalid_top_level(self):
+        """Test that a single document without recipes is a file-level error."""
+        assert _parse("title: Not a recipe\n") == [
+            (None, None, "Invalid format: YAML must contain 'recipe' or 'recipes' key")
+        ]
+
+    def test_invalid_first_of_several_documents(self):
+        """Test that a bad first document is numbered when more documents follow."""
+        items = _parse("title: Not a recipe\n---\nrecipe:\n  title: B\n")
+
+        assert items == [
+            (0, None, "Missing 'recipe' key"),
+            (1, {"recipe": {"title": "B"}}, None),
+        ]
+
+    def test_resolves_types_anchors_and_merge_keys(self):
+        """Test that streamed items are constructed like yaml.safe_load would."""
+        content = (
+            "defaults: &defaults\n"
+            "  servings: 4\n"
+            "recipes:\n"
+            "  - recipe:\n"
+            "      <<: *defaults\n"
+            "      title: A\n"
+            "      vegetarian: yes\n"
+        )
+
+        assert _parse(content) == [
+            (0, {"recipe": {"servings": 4, "title": "A", "vegetarian": True}}, None)
+        ]
+
+    def test_yields_recipes_before_a_later_error(self):
+        """Test that list items are produced before the rest of the file is read."""
+        content = "recipes:\n  - recipe: {title: A}\n  - recipe: [unclosed\n"
+        items = importer.iter_upload_recipes(io.BytesIO(content.encode("utf-8")))
+
+        assert next(items) == (0, {"recipe": {"title": "A"}}, None)
+        with pytest.raises(yaml.YAMLError):
+            next(items)
+
+    def test_invalid_yaml(self):
+        """Test that unparseable YAML raises for the endpoint to report."""
+        with pytest.raises(yaml.YAMLError):
+            _parse("recipe: [unclosed")
+
+    def test_invalid_utf8(self):
+        """Test that non UTF-8 uploads raise for the endpoint to report."""
+        with pytest.raises(UnicodeDecodeError):
+            list(importer.iter_upload_recipes(io.BytesIO(b"recipe: \xff\xfe")))
+
+
+class TestImportRecipeUpload:
+    async def test_feeds_batches_to_pipeline(self):
+        """Test that recipes are stored one parsed batch at a time."""
+        recipes = [{"recipe": {"title": f"Recipe {i}"}} for i in range(5)]
+        content = yaml.dump({"recipes": recipes[:3] + ["bad"] + recipes[3:]})
+        user_id = uuid.uuid4()
+
+        async def add(recipes, user_id):
+            return [
+                (
+                    ValueError("upsert failed")
+                    if r["recipe"]["title"] == "Recipe 4"
+                    else "id"
+                )
+                for r in recipes
+            ]
+
+        with (
+            patch.object(importer.config, "EMBEDDING_BATCH_SIZE", 2),
+            patch("importer.add_recipes", side_effect=add) as mock_add,
+        ):
+            added, errors = await importer.import_recipe_upload(
+                io.BytesIO(content.encode("utf-8")), user_id
+            )
+
+        assert [len(call[0][0]) for call in mock_add.call_args_list] == [2, 1, 2]
+        assert added == 4
+        assert errors == ["Recipe 4: Must be an object", "Recipe 6: upsert failed"]
+
+    async def test_keeps_recipes_before_yaml_error(self):
+        """Test that a YAML error is reported after earlier batches are stored."""
+        content = "recipes:\n  - recipe: {title: A}\n  - recipe: [unclosed\n"
+
+        async def add(recipes, user_id):
+            return ["id"] * len(recipes)
+
+        with (
+            patch.object(importer.config, "EMBEDDING_BATCH_SIZE", 1),
+            patch("importer.add_recipes", side_effect=add),
+        ):
+            added, errors = await importer.import_recipe_upload(
+                io.BytesIO(content.encode("utf-8")), uuid.uuid4()
+            )
+
+        assert added == 1
+        assert len(errors) == 1
+        assert errors[0].startswith("YAML parsing error:")
+
+
+class TestQueueRecipeUpload:
+    async def test_writes_rows_per_batch(self):
+        """Test that job rows keep their position in the file."""
+        content = "recipe:\n  title: A\n---\n- not a recipe\n---\nrecipe: {title: C}\n"
+        db = Mock()
+        db_threads = set()
+
+        def record_thread(*args):
+            db_threads.add(threading.get_ident())
+
+        with (
+            patch.object(importer.config, "EMBEDDING_BATCH_SIZE", 2),
+            patch(
+                "importer.add_import_job_recipes", side_effect=record_thread
+            ) as mock_add,
+            patch("importer.queue_import_job", side_effect=record_thread) as mock_queue,
+        ):
+            job = await importer.queue_recipe_upload(
+                db, uuid.uuid4(), "recipes.yaml", io.BytesIO(content.encode("utf-8"))
+            )
+
+        # The writes never block the event loop
+        assert db_threads and threading.get_ident() not in db_threads
+
+        batches = [call[0][2] for call in mock_add.call_args_list]
+        assert [[position for position, _ in batch] for batch in batches] == [[0], [2]]
+        assert yaml.safe_load(batches[1][0][1]) == {"recipe": {"title": "C"}}
+        mock_queue.assert_called_once_with(db, job, ["Recipe 2: Must be an object"])
+
+    async def test_rolls_back_on_yaml_error(self):
+        """Test that nothing is queued when the upload isn't valid YAML."""
+        db = Mock()
+
+        with pytest.raises(yaml.YAMLError):
+            await importer.queue_recipe_upload(
+                db, uuid.uuid4(), "recipes.yaml", io.BytesIO(b"recipe: [unclosed")
+            )
+
+        db.rollback.assert_called_once()
+        db.commit.assert_not_called()
+
+
+class TestProcessImportJob:
+    async def test_processes_pending_recipes_in_batches(self):
+        """Test that pending recipes are added and recorded a batch at a time."""
+        job = Mock(id=uuid.uuid4(), user_id=uuid.uuid4())
+        batches = [
+            [
+                Mock(contents="recipe:\n  title: A\n"),
+                Mock(contents="recipe:\n  title: B\n"),
+            ],
+            [Mock(contents="recipe:\n  title: C\n")],
+            [],
+        ]
+        db = Mock()
+        loop_thread = threading.get_ident()
+        db_threads = set()
+
+        def on_db_thread(result=None):
+            def call(*args):
+                db_threads.add(threading.get_ident())
+                return result(*args) if callable(result) else result
+
+            return call
+
+        async def add(recipes, user_id):
+            return [recipe["recipe"]["title"] for recipe in recipes]
+
+        pending = iter(batches)
+        with (
+            patch(
+                "importer.get_pending_import_recipes",
+                side_effect=on_db_thread(lambda *args: next(pending)),
+            ),
+            patch("importer.add_recipes", side_effect=add) as mock_add,
+            patch(
+                "importer.record_import_batch", side_effect=on_db_thread()
+            ) as mock_record,
+            patch(
+                "importer.complete_import_job", side_effect=on_db_thread()
+            ) as mock_complete,
+        ):
+            await importer.process_import_job(db, job)
+
+        # Database calls never block the event loop
+        assert db_threads and loop_thread not in db_threads
+
+        first_call = mock_add.call_args_list[0]
+        assert first_call[0][0] == [
+            {"recipe": {"title": "A"}},
+            {"recipe": {"title": "B"}},
+        ]
+        assert first_call[0][1] == job.user_id
+        assert mock_record.call_count == 2
+        mock_record.assert_called_with(db, job, batches[1], ["C"])
+        mock_complete.assert_called_once_with(db, job)
@@ -57,7 +57,6 @@ def test_mock_setup():
         import assistant
 
         # Test that the mocked objects are being used
-        assert assistant.pc is not None
         assert assistant.index is not None
 
         # Test a basic function
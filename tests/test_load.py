@@ -0,0 +1,519 @@
+"""
+Load tests for the chat pipeline: many concurrent conversations on one event loop.
+"""
+
+import asyncio
+import base64
+import json
+import math
+import random
+import time
+import uuid
+from io import BytesIO
+from unittest.mock import AsyncMock, Mock, patch
+
+import assistant
+import pytest
+import yaml
+from bs4 import BeautifulSoup
+from extraction import (
+    SOUP_FEATURES,
+    LexborHTMLParser,
+    RecipeScanner,
+    extract_visible_text,
+)
+from PIL import Image
+from prompts import get_prompt
+from storage.conversations import (
+    get_conversation_contents,
+    update_conversation_contents,
+)
+from storage.vectors import LocalVectorStore
+from utils.tokens import clear_token_counts, image_tokens
+
+CONCURRENT_REQUESTS = 20
+UPSTREAM_LATENCY = 0.02  # Simulated OpenAI round trip, in seconds
+OVERHEAD_TURNS = 20
+BULK_RECIPES = 50
+MAX_STREAMING_OVERHEAD_MS = 5.0
+NAMESPACE_RECIPES = 500
+EMBEDDING_DIMENSIONS = 1536
+VECTOR_QUERIES = 200
+PARSE_RUNS = 5
+PAGE_CHUNK_BYTES = 65536
+CONVERSATION_TURNS = 500
+PROMPT_BUILDS = 20
+IMAGE_RUNS = 3
+
+
+def _mock_completion() -> Mock:
+    completion = Mock()
+    completion.choices = [Mock()]
+    completion.choices[0].message.content = "Test response"
+    completion.choices[0].message.tool_calls = None
+    completion.choices[0].message.to_dict.return_value = {
+        "role": "assistant",
+        "content": "Test response",
+    }
+    return completion
+
+
+async def _mock_stream(content: str):
+    for word in content.split(" "):
+        yield Mock(choices=[Mock(delta=Mock(content=word + " ", tool_calls=None))])
+
+
+def _mock_openai_client(blocking: bool) -> Mock:
+    """
+    Build an OpenAI client stand-in with a fixed upstream latency.
+
+    With ``blocking=True`` the latency is spent in ``time.sleep``, which is what
+    calling the synchronous client from an ``async def`` used to do to the loop.
+    """
+
+    async def wait() -> None:
+        if blocking:
+            time.sleep(UPSTREAM_LATENCY)
+        else:
+            await asyncio.sleep(UPSTREAM_LATENCY)
+
+    async def create_completion(**kwargs):
+        await wait()
+        if kwargs.get("stream"):
+            return _mock_stream("Test response")
+        return _mock_completion()
+
+    async def create_embeddings(**kwargs):
+        await wait()
+        return Mock(data=[Mock(embedding=[0.1] * 1536) for _ in kwargs["input"]])
+
+    client = Mock()
+    client.chat.completions.create = create_completion
+    client.embeddings.create = create_embeddings
+    return client
+
+
+def _patch_conversation_storage(user: Mock):
+    thread = Mock(id=uuid.uuid4(), user_id=user.id, contents="")
+    return (
+        patch("assistant.upsert_conversation", return_value=thread),
+        patch("assistant.get_conversation_contents", return_value=[]),
+        patch("assistant.update_conversation_contents"),
+    )
+
+
+async def _requests_per_second(blocking: bool) -> float:
+    user = Mock(id=uuid.uuid4())
+    upsert, contents, update = _patch_conversation_storage(user)
+
+    with (
+        patch("assistant.openai_client", _mock_openai_client(blocking)),
+        upsert,
+        contents,
+        update,
+    ):
+        start = time.perf_counter()
+        await asyncio.gather(
+            *(
+                assistant.chat(Mock(), user, f"What can I cook tonight? #{i}")
+                for i in range(CONCURRENT_REQUESTS)
+            )
+        )
+        elapsed = time.perf_counter() - start
+
+    return CONCURRENT_REQUESTS / elapsed
+
+
+@pytest.mark.slow
+class TestChatLoad:
+    async def test_concurrent_chats_do_not_block_event_loop(self):
+        """Test that upstream latency overlaps across concurrent conversations."""
+        before = await _requests_per_second(blocking=True)
+        after = await _requests_per_second(blocking=False)
+
+        print(
+            f"\n{CONCURRENT_REQUESTS} concurrent chats: "
+            f"{before:.1f} req/s blocking, {after:.1f} req/s async"
+        )
+        assert after > before * 5
+
+
+async def _mean_turn_ms(streaming: bool) -> float:
+    user = Mock(id=uuid.uuid4())
+    upsert, contents, update = _patch_conversation_storage(user)
+    client = _mock_openai_client(blocking=False)
+
+    with patch("assistant.openai_client", client), upsert, contents, update:
+        start = time.perf_counter()
+        for i in range(OVERHEAD_TURNS):
+            if streaming:
+                async for _ in assistant.chat_with_feedback(Mock(), user, f"Hi #{i}"):
+                    pass
+            else:
+                await assistant.chat(Mock(), user, f"Hi #{i}")
+        elapsed = time.perf_counter() - start
+
+    return elapsed * 1000 / OVERHEAD_TURNS
+
+
+@pytest.mark.slow
+class TestStreamingOverhead:
+    async def test_streaming_overhead_compared_with_chat(self):
+        """Test that progress events add no fixed delays to the streamed path."""
+        # Warm up tokenizer and executor so neither run pays one-off costs
+        await _mean_turn_ms(streaming=False)
+
+        plain = await _mean_turn_ms(streaming=False)
+        streamed = await _mean_turn_ms(streaming=True)
+
+        print(f"\nMean turn: {plain:.2f} ms /chat, {streamed:.2f} ms /chat/stream")
+        assert streamed - plain < MAX_STREAMING_OVERHEAD_MS
+
+
+@pytest.mark.slow
+class TestTurnConcurrency:
+    async def test_link_and_photo_turn_pays_slowest_step_only(self):
+        """Test that URL extraction, image work and retrieval overlap."""
+        user = Mock(id=uuid.uuid4())
+        upsert, contents, update = _patch_conversation_storage(user)
+        attachment = Mock()
+        attachment.read = AsyncMock(return_value=b"image-bytes")
+
+        async def slow_extract(text):
+            await asyncio.sleep(UPSTREAM_LATENCY)
+            return text + " (Extracted Content: recipe)"
+
+        def slow_normalize(image_bytes):
+            time.sleep(UPSTREAM_LATENCY)
+            return assistant.EncodedImage("base64-image", 512, 512)
+
+        async def slow_search(query, user_id):
+            await asyncio.sleep(UPSTREAM_LATENCY)
+            return []
+
+        with (
+            patch("assistant.openai_client", _mock_openai_client(blocking=False)),
+            patch("assistant.process_text_with_urls", slow_extract),
+            patch("assistant.normalize_image_to_base64_jpeg", slow_normalize),
+            patch("assistant.find_relevant_recipes", slow_search),
+            upsert,
+            contents,
+            update,
+        ):
+            start = time.perf_counter()
+            await assistant.chat(
+                Mock(), user, "Make this: https://example.com/soup", None, attachment
+            )
+            elapsed = time.perf_counter() - start
+
+        # One completion round trip plus the slowest of the three steps
+        assert elapsed < UPSTREAM_LATENCY * 3
+
+
+class SlowLocalIndex(LocalVectorStore):
+    """Local vector store with Pinecone's round trip added to every call."""
+
+    def upsert(self, vectors, namespace):
+        time.sleep(UPSTREAM_LATENCY)
+        super().upsert(vectors, namespace)
+
+    def query(self, *args, **kwargs):
+        time.sleep(UPSTREAM_LATENCY)
+        return super().query(*args, **kwargs)
+
+
+@pytest.mark.slow
+class TestBulkIngestThroughput:
+    async def test_batched_ingest_outpaces_per_recipe_ingest(self):
+        """Test recipes/second of batched bulk ingest against one-at-a-time adds."""
+        sequential_user, batched_user = uuid.uuid4(), uuid.uuid4()
+        recipes = [
+            {"recipe": {"title": f"Recipe {i}", "ingredients": [{"name": "salt"}]}}
+            for i in range(BULK_RECIPES)
+        ]
+
+        with (
+            patch("assistant.openai_client", _mock_openai_client(blocking=False)),
+            patch("assistant.index", SlowLocalIndex()) as index,
+        ):
+            start = time.perf_counter()
+            for recipe in recipes:
+                await assistant.add_recipe(yaml.dump(recipe), sequential_user)
+            sequential = BULK_RECIPES / (time.perf_counter() - start)
+
+            assistant.embedding_cache.clear()
+            start = time.perf_counter()
+            results = await assistant.add_recipes(recipes, batched_user)
+            batched = BULK_RECIPES / (time.perf_counter() - start)
+
+        print(
+            f"\n{BULK_RECIPES} recipes: {sequential:.0f} recipes/s one at a time, "
+            f"{batched:.0f} recipes/s batched"
+        )
+        assert not any(isinstance(result, Exception) for result in results)
+        for user_id in (sequential_user, batched_user):
+            stored = index.query(
+                namespace=f"user_{user_id}", vector=[0.1] * 1536, top_k=1000
+            )
+            assert len(stored.matches) == BULK_RECIPES
+        assert batched > sequential * 10
+
+
+@pytest.mark.slow
+class TestLocalVectorQueryLatency:
+    def test_top_k_over_a_users_recipes(self):
+        """Test that a local top-k query over one namespace is sub-millisecond."""
+        rng = random.Random(0)
+        store = LocalVectorStore()
+        store.upsert(
+            [
+                {
+                    "id": str(i),
+                    "values": [rng.uniform(-1, 1) for _ in range(EMBEDDING_DIMENSIONS)],
+                    "metadata": {"contents": f"Recipe {i}"},
+                }
+                for i in range(NAMESPACE_RECIPES)
+            ],
+            namespace="user_bench",
+        )
+        query = [rng.uniform(-1, 1) for _ in range(EMBEDDING_DIMENSIONS)]
+
+        store.query(namespace="user_bench", vector=query, top_k=5)
+        start = time.perf_counter()
+        for _ in range(VECTOR_QUERIES):
+            response = store.query(namespace="user_bench", vector=query, top_k=5)
+        mean_us = (time.perf_counter() - start) * 1e6 / VECTOR_QUERIES
+
+        print(
+            f"\nLocal top-5 over {NAMESPACE_RECIPES} x {EMBEDDING_DIMENSIONS}: "
+            f"{mean_us:.0f} us/query"
+        )
+        assert len(response.matches) == 5
+        assert mean_us < 1000
+
+
+def _blog_page(recipe_in_head: bool, with_recipe: bool = True) -> bytes:
+    """A large recipe blog page: long story, ads, inline scripts, comments."""
+    recipe = json.dumps(
+        {
+            "@context": "https://schema.org",
+            "@graph": [
+                {"@type": "WebPage", "name": "Best Soup"},
+                {
+                    "@type": "Recipe",
+                    "name": "Best Soup",
+                    "recipeIngredient": [f"{i} cups stock" for i in range(1, 15)],
+                    "recipeInstructions": [
+                        {"@type": "HowToStep", "text": f"Step {i}."} for i in range(12)
+                    ],
+                },
+            ],
+        }
+    )
+    json_ld = f'<script type="application/ld+json">{recipe}</script>'
+    if not with_recipe:
+        json_ld = ""
+    story = "".join(
+        f'<div class="ad"><script>window.ads.push({i})</script></div>'
+        f"<p>Paragraph {i} about why this soup matters to <b>my family</b>.</p>"
+        for i in range(1500)
+    )
+    comments = "".join(
+        f'<li class="comment"><span>Reader {i}</span><p>Loved it!</p></li>'
+        for i in range(300)
+    )
+    return (
+        f"<html><head><title>Best Soup</title>{json_ld if recipe_in_head else ''}"
+        f"<style>.a{{color:red}}</style></head><body><nav>Home | Recipes</nav>"
+        f"<article>{story}{'' if recipe_in_head else json_ld}</article>"
+        f"<footer><ul>{comments}</ul></footer></body></html>"
+    ).encode()
+
+
+def _time_per_page(parse, page: bytes, runs: int = PARSE_RUNS) -> float:
+    parse(page)
+    start = time.perf_counter()
+    for _ in range(runs):
+        parse(page)
+    return (time.perf_counter() - start) * 1000 / runs
+
+
+def _soup_extract(page: bytes) -> str:
+    """What extract_url did before: a full html.parser tree for every page."""
+    soup = BeautifulSoup(page, "html.parser")
+    soup.find("script", type="application/ld+json")
+    return soup.get_text(strip=True)
+
+
+@pytest.mark.slow
+class TestPageParsingSpeed:
+    @pytest.mark.parametrize("recipe_in_head", [True, False])
+    def test_json_ld_scan_beats_full_parse(self, recipe_in_head):
+        """Test that finding a JSON-LD recipe skips building a DOM."""
+        page = _blog_page(recipe_in_head)
+
+        def scan(page):
+            scanner = RecipeScanner()
+            for i in range(0, len(page), PAGE_CHUNK_BYTES):
+                if scanner.feed(page[i : i + PAGE_CHUNK_BYTES]):
+                    break
+            return scanner.recipe
+
+        assert scan(page)["title"] == "Best Soup"
+        soup_ms = _time_per_page(_soup_extract, page)
+        scan_ms = _time_per_page(scan, page)
+
+        print(
+            f"\n{len(page) // 1024} KB page, recipe in "
+            f"{'head' if recipe_in_head else 'body'}: html.parser {soup_ms:.1f} ms, "
+            f"JSON-LD scan {scan_ms:.2f} ms"
+        )
+        assert scan_ms * 10 < soup_ms
+
+    def test_text_fallback_parsers(self):
+        """Compare the fallback parsers on a page without structured data."""
+        page = _blog_page(recipe_in_head=False, with_recipe=False)
+
+        soup_ms = _time_per_page(_soup_extract, page)
+        fallback_ms = _time_per_page(
+            lambda page: extract_visible_text(page, 2000), page
+        )
+        with patch("extraction.LexborHTMLParser", None):
+            soup_fallback_ms = _time_per_page(
+                lambda page: extract_visible_text(page, 2000), page
+            )
+
+        print(
+            f"\n{len(page) // 1024} KB page without JSON-LD: html.parser "
+            f"{soup_ms:.1f} ms, BeautifulSoup ({SOUP_FEATURES}) "
+            f"{soup_fallback_ms:.1f} ms, selectolax {fallback_ms:.1f} ms"
+        )
+        if LexborHTMLParser is not None:
+            assert fallback_ms * 3 < soup_ms
+
+
+def _time_per_prompt(history, recipes) -> float:
+    """The fastest of PROMPT_BUILDS builds in ms, which shrugs off scheduler noise."""
+    timings = []
+    for _ in range(PROMPT_BUILDS):
+        start = time.perf_counter()
+        get_prompt(history, recipes, max_tokens=assistant.MAX_TOKENS)
+        timings.append((time.perf_counter() - start) * 1000)
+    return min(timings)
+
+
+@pytest.mark.slow
+class TestPromptBuildSpeed:
+    def test_prompt_build_time_grows_linearly_with_history(self):
+        """
+        Test that with stored token counts, building a prompt costs the same
+        per turn of history at any length, and far less than re-tokenizing.
+        """
+        thread = Mock(contents="")
+        recipes = [yaml.safe_dump({"recipe": {"title": "Soup", "serves": 4}})]
+        reply = "Simmer the leeks in butter, then add the stock and stir. " * 8
+        timings = {}
+        for turn in range(1, CONVERSATION_TURNS + 1):
+            update_conversation_contents(
+                thread,
+                [
+                    {"role": "user", "content": f"What goes with soup number {turn}?"},
+                    {"role": "assistant", "content": f"{turn}. {reply}"},
+                ],
+            )
+            if turn in (50, CONVERSATION_TURNS):
+                timings[turn] = _time_per_prompt(
+                    get_conversation_contents(thread), recipes
+                )
+
+        # The same history without stored counts, tokenized on every build
+        uncounted = [
+            {key: value for key, value in message.items() if key != "tokens"}
+            for message in get_conversation_contents(thread)
+        ]
+        start = time.perf_counter()
+        clear_token_counts()
+        get_prompt(uncounted, recipes, max_tokens=assistant.MAX_TOKENS)
+        tokenizing_ms = (time.perf_counter() - start) * 1000
+
+        print(
+            f"\nPrompt build: {timings[50]:.2f} ms at 50 turns, "
+            f"{timings[CONVERSATION_TURNS]:.2f} ms at {CONVERSATION_TURNS} turns, "
+            f"{tokenizing_ms:.1f} ms re-tokenizing {CONVERSATION_TURNS} turns"
+        )
+        assert timings[CONVERSATION_TURNS] < 5
+        assert timings[CONVERSATION_TURNS] * 5 < tokenizing_ms
+        # Joining the history is still linear in its length, but nothing is
+        # re-tokenized, so the time per turn of history doesn't grow with it
+        per_turn = {turns: timings[turns] / turns for turns in timings}
+        assert per_turn[CONVERSATION_TURNS] < 2 * per_turn[50]
+
+
+def _photo(size, image_format: str) -> bytes:
+    """A noisy gradient, which compresses about like a real photo."""
+    noise = Image.effect_noise(size, 40)
+    gradient = Image.linear_gradient("L").resize(size)
+    photo = Image.merge("RGB", (noise, gradient, Image.blend(noise, gradient, 0.5)))
+    buffer = BytesIO()
+    photo.save(buffer, format=image_format, quality=90)
+    return buffer.getvalue()
+
+
+def _old_normalize(file_contents: bytes) -> assistant.EncodedImage:
+    """What normalize_image_to_base64_jpeg did before: two resizes, padded up."""
+    with Image.open(BytesIO(file_contents)) as img:
+        img = img.convert("RGB")
+        width, height = img.size
+        if min(width, height) > 768:
+            scale_factor = 768 / min(width, height)
+            img = img.resize(
+                (int(width * scale_factor), int(height * scale_factor)),
+                Image.Resampling.LANCZOS,
+            )
+        width, height = img.size
+        size = (math.ceil(width / 512) * 512, math.ceil(height / 512) * 512)
+        img = img.resize(size, Image.Resampling.LANCZOS)
+        buffer = BytesIO()
+        img.save(buffer, format="JPEG", optimize=True, quality=85)
+        return assistant.EncodedImage(
+            base64.b64encode(buffer.getvalue()).decode(), *size
+        )
+
+
+@pytest.mark.slow
+class TestImagePipelineSpeed:
+    @pytest.mark.parametrize(
+        "size, image_format",
+        [((4032, 3024), "JPEG"), ((1920, 1080), "PNG"), ((768, 1024), "JPEG")],
+    )
+    def test_pipeline_against_double_resize(self, size, image_format):
+        """Compare time, output bytes and tiles with the old pipeline."""
+        photo = _photo(size, image_format)
+        results = {}
+        for name, normalize in [
+            ("old", _old_normalize),
+            ("new", assistant.normalize_image_to_base64_jpeg),
+        ]:
+            image = normalize(photo)
+            start = time.perf_counter()
+            for _ in range(IMAGE_RUNS):
+                normalize(photo)
+            results[name] = (
+                (time.perf_counter() - start) * 1000 / IMAGE_RUNS,
+                len(base64.b64decode(image.data)),
+                image_tokens(image.width, image.height),
+            )
+
+        print(
+            f"\n{size[0]}x{size[1]} {image_format}: "
+            + ", ".join(
+                f"{name} {ms:.0f} ms, {size_bytes // 1024} KB, {tokens} tokens"
+                for name, (ms, size_bytes, tokens) in results.items()
+            )
+        )
+        old_ms, old_bytes, old_tokens = results["old"]
+        new_ms, new_bytes, new_tokens = results["new"]
+        assert new_tokens <= old_tokens
+        assert new_bytes <= old_bytes
+        if size == (4032, 3024):
+            assert new_ms * 1.5 < old_ms
@@ -0,0 +1,90 @@
+import json
+import os
+import uuid
+from unittest.mock import MagicMock, patch
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy.exc import InvalidRequestError
+from storage.imports import COMPLETED, RUNNING, ImportJob
+
+BACKEND_DIR = os.path.join(os.path.dirname(__file__), "..", "backend")
+
+
+@pytest.fixture
+def main(monkeypatch):
+    # The app mounts ./static, relative to the backend directory
+    monkeypatch.chdir(BACKEND_DIR)
+    import main
+
+    yield main
+    main.app.dependency_overrides.clear()
+
+
+def _job(job_id, user_id, status, processed):
+    return ImportJob(
+        id=job_id,
+        user_id=user_id,
+        status=status,
+        total=2,
+        processed=processed,
+        recipes_added=processed,
+        errors="[]",
+    )
+
+
+class TestRecipeImportEvents:
+    def test_streams_progress_after_the_request_session_closes(self, main):
+        """Test that progress is polled with its own session, not the request's."""
+        user = MagicMock(id=uuid.uuid4())
+        job_id = uuid.uuid4()
+        request_db = MagicMock()
+
+        def get_db():
+            yield request_db
+            # As with FastAPI 0.112, the session closes before the body streams
+            request_db.refresh.side_effect = InvalidRequestError("detached")
+
+        main.app.dependency_overrides[main.get_db] = get_db
+        main.app.dependency_overrides[main.get_current_user] = lambda: user
+        jobs = iter(
+            [
+                _job(job_id, user.id, RUNNING, 0),
+                _job(job_id, user.id, RUNNING, 1),
+                _job(job_id, user.id, COMPLETED, 2),
+            ]
+        )
+
+        with (
+            patch("main.get_import_job", side_effect=lambda db, _: next(jobs)),
+            patch("main.SessionLocal") as session_factory,
+            patch("main.IMPORT_PROGRESS_INTERVAL_SECONDS", 0),
+        ):
+            response = TestClient(main.app).get(f"/recipes/imports/{job_id}/events")
+
+        events = [
+            json.loads(line[len("data: ") :])
+            for line in response.text.splitlines()
+            if line.startswith("data: ")
+        ]
+        assert response.status_code == 200
+        assert [event.get("processed") for event in events] == [1, 2, None]
+        assert events[-2]["status"] == COMPLETED
+        assert events[-1] == {"type": "end"}
+        assert session_factory.call_count == 2
+        request_db.refresh.assert_not_called()
+
+    def test_other_users_jobs_are_not_found(self, main):
+        main.app.dependency_overrides[main.get_db] = lambda: MagicMock()
+        main.app.dependency_overrides[main.get_current_user] = lambda: MagicMock(
+            id=uuid.uuid4()
+        )
+        job_id = uuid.uuid4()
+
+        with patch(
+            "main.get_import_job",
+            return_value=_job(job_id, uuid.uuid4(), RUNNING, 0),
+        ):
+            response = TestClient(main.app).get(f"/recipes/imports/{job_id}/events")
+
+        assert response.status_code == 404
@@ -0,0 +1,106 @@
+import prompts
+from prompts import get_prompt, pack_conversation_history
+from utils.tokens import format_message, get_tokens
+
+RISOTTO = 'recipe:\n  title: "Mushroom Risotto"\n  serves: 6\nrecipe_id: r1\n'
+SOUP = 'recipe:\n  title: "Leek Soup"\n  serves: 2\nrecipe_id: r2\n'
+
+
+class TestGetPrompt:
+    def test_includes_history_and_recipes(self):
+        """Test that every recipe is sent in full with the history."""
+        history = [{"role": "user", "content": "Hello"}]
+
+        prompt = get_prompt(history, [RISOTTO, SOUP])
+
+        assert "user: Hello" in prompt
+        assert f"{RISOTTO}\n\n{SOUP}" in prompt
+
+    def test_history_makes_room_for_recipes(self):
+        """Test that the recipes' known token counts come out of the history."""
+        history = [
+            {"role": "user", "content": "Old", "tokens": 10},
+            {"role": "assistant", "content": "New", "tokens": 10},
+        ]
+        get_prompt([], [])  # Loads the template and its token count
+        budget = prompts.prompt_template_tokens + 50
+
+        assert "user: Old" in get_prompt(history, [RISOTTO], budget, [20])
+        trimmed = get_prompt(history, [RISOTTO], budget, [35])
+        assert "user: Old" not in trimmed
+        assert "assistant: New" in trimmed
+        assert RISOTTO in trimmed
+
+
+def _packed(history, max_tokens=50000):
+    """The history as get_prompt writes it, packed into max_tokens."""
+    start = pack_conversation_history(history, max_tokens)
+    return "\n\n".join(map(format_message, history[start:]))
+
+
+class TestPackConversationHistory:
+    def _history(self, count):
+        return [
+            {"role": "user" if i % 2 == 0 else "assistant", "content": f"Message {i}"}
+            for i in range(count)
+        ]
+
+    def test_keeps_everything_that_fits(self):
+        """Test that a short history is kept as-is."""
+        history = self._history(4)
+
+        assert _packed(history) == "\n\n".join(
+            f"{message['role']}: {message['content']}" for message in history
+        )
+
+    def test_keeps_newest_whole_messages_within_budget(self):
+        """Test that truncation drops the oldest messages, never part of one."""
+        history = self._history(50)
+        budget = 60
+
+        result = _packed(history, max_tokens=budget)
+
+        assert len(get_tokens(result)) <= budget
+        assert result.endswith("assistant: Message 49")
+        # Only whole messages, oldest dropped first
+        messages = result.split("\n\n")
+        first = int(messages[0].rsplit(" ", 1)[1])
+        assert messages == [
+            f"{message['role']}: {message['content']}" for message in history[first:]
+        ]
+        assert first > 0
+
+    def test_stops_at_a_message_that_does_not_fit(self):
+        """Test that an oversized message ends the history rather than a gap."""
+        history = [
+            {"role": "user", "content": "Old"},
+            {"role": "user", "content": "word " * 500},
+            {"role": "assistant", "content": "New"},
+        ]
+
+        assert _packed(history, max_tokens=50) == "assistant: New"
+
+    def test_uses_stored_token_counts(self):
+        """Test that a message's stored count is trusted over re-tokenizing."""
+        history = [
+            {"role": "user", "content": "Old", "tokens": 1000},
+            {"role": "assistant", "content": "New", "tokens": 3},
+        ]
+
+        assert _packed(history, max_tokens=50) == "assistant: New"
+
+    def test_notes_images_without_their_data(self):
+        history = [
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": "What is this?"},
+                    {
+                        "type": "image_url",
+                        "image_url": {"url": "data:image/png;base64,QUJD"},
+                    },
+                ],
+            }
+        ]
+
+        assert "user: What is this? [image_url]" in get_prompt(history, [])
@@ -0,0 +1,598 @@
+from datetime import datetime, timedelta
+from unittest.mock import MagicMock
+
+import pytest
+import yaml
+from sqlalchemy.exc import OperationalError
+from storage.embeddings import EmbeddingCache, content_hash
+from storage.imports import (
+    ImportJob,
+    ImportJobRecipe,
+    add_import_job_recipes,
+    queue_import_job,
+    record_import_batch,
+)
+from storage.lexical import LexicalIndex, reciprocal_rank_fusion, tokenize
+from storage.page_cache import CachedPage, PageCache
+from storage.query_cache import QueryResultCache
+from storage.vectors import (
+    LocalVectorStore,
+    PineconeVectorStore,
+    QueryResponse,
+    VectorMatch,
+)
+
+
+class TestEmbeddingCache:
+    def test_memory_hit_and_miss_counters(self):
+        """Test that repeated lookups are served from memory and counted."""
+        cache = EmbeddingCache(max_entries=10)
+
+        assert cache.get("model", "pasta") is None
+        assert cache.load_persistent("model", ["pasta"]) == {}
+        cache.put("model", "pasta", [0.1, 0.2])
+
+        assert cache.get("model", "pasta") == [0.1, 0.2]
+        assert cache.get("other-model", "pasta") is None
+        stats = cache.stats()
+        assert stats["memory_hits"] == 1
+        assert stats["misses"] == 1
+        assert stats["entries"] == 1
+
+    def test_lru_eviction(self):
+        """Test that the least recently used embedding is evicted first."""
+        cache = EmbeddingCache(max_entries=2)
+        cache.put("model", "a", [1.0])
+        cache.put("model", "b", [2.0])
+        cache.get("model", "a")
+        cache.put("model", "c", [3.0])
+
+        assert cache.get("model", "a") == [1.0]
+        assert cache.get("model", "b") is None
+        assert cache.get("model", "c") == [3.0]
+
+    def test_persistent_hits_are_promoted_to_memory(self):
+        """Test that embeddings found in the database are kept in memory."""
+        row = MagicMock(content_hash=content_hash("soup"), embedding=[0.5, 0.5])
+        session = MagicMock()
+        db = session.__enter__.return_value
+        db.query.return_value.filter.return_value.all.return_value = [row]
+        cache = EmbeddingCache(max_entries=10, session_factory=lambda: session)
+
+        found = cache.load_persistent("model", ["soup", "stew"])
+
+        assert found == {"soup": [0.5, 0.5]}
+        assert cache.get("model", "soup") == [0.5, 0.5]
+        stats = cache.stats()
+        assert stats["persistent_hits"] == 1
+        assert stats["misses"] == 1
+
+    def test_persistent_failures_are_treated_as_misses(self):
+        """Test that database errors don't propagate out of the cache."""
+
+        def broken_session():
+            raise OperationalError("SELECT", {}, Exception("connection refused"))
+
+        cache = EmbeddingCache(max_entries=10, session_factory=broken_session)
+
+        assert cache.load_persistent("model", ["soup"]) == {}
+        cache.store_persistent("model", {"soup": [0.1]})
+        assert cache.stats()["misses"] == 1
+
+
+class TestImportJobs:
+    def test_record_import_batch_updates_progress(self):
+        """Test that batch results update recipe rows and job counters."""
+        job = ImportJob(total=3, processed=0, recipes_added=0, errors="[]")
+        recipes = [
+            ImportJobRecipe(position=0, status="pending"),
+            ImportJobRecipe(position=1, status="pending"),
+        ]
+        db = MagicMock()
+
+        record_import_batch(db, job, recipes, ["id-1", ValueError("bad yaml")])
+
+        assert [recipe.status for recipe in recipes] == ["done", "failed"]
+        assert recipes[1].error == "bad yaml"
+        assert job.processed == 2
+        assert job.recipes_added == 1
+        assert job.errors == '["Recipe 2: bad yaml"]'
+        db.commit.assert_called_once()
+
+    def test_add_import_job_recipes_releases_rows(self):
+        """Test that queued rows are counted and expunged after flushing."""
+        job = ImportJob(total=0)
+        db = MagicMock()
+
+        add_import_job_recipes(db, job, [(0, "recipe: a"), (2, "recipe: c")])
+        queue_import_job(db, job, ["Recipe 2: Must be an object"])
+
+        rows = db.add_all.call_args[0][0]
+        assert [row.position for row in rows] == [0, 2]
+        assert job.total == 2
+        assert db.expunge.call_count == 2
+        assert job.status != "completed"
+        assert job.errors == '["Recipe 2: Must be an object"]'
+
+    def test_queue_empty_import_job_completes_it(self):
+        """Test that an upload without valid recipes doesn't wait for a worker."""
+        job = ImportJob(total=0)
+
+        queue_import_job(MagicMock(), job, [])
+
+        assert job.status == "completed"
+
+
+def _vector(vector_id, values, **metadata):
+    return {"id": vector_id, "values": values, "metadata": metadata}
+
+
+class TestLocalVectorStore:
+    def test_query_ranks_by_cosine_similarity(self):
+        """Test that matches come back best first with their scores."""
+        store = LocalVectorStore()
+        store.upsert(
+            [
+                _vector("east", [1.0, 0.0], contents="east"),
+                _vector("north", [0.0, 2.0], contents="north"),
+                _vector("northeast", [3.0, 3.0], contents="northeast"),
+            ],
+            namespace="user_a",
+        )
+
+        response = store.query(namespace="user_a", vector=[0.0, 1.0], top_k=2)
+
+        assert [match.id for match in response.matches] == ["north", "northeast"]
+        assert response.matches[0].score == pytest.approx(1.0)
+        assert response.matches[1].metadata == {"contents": "northeast"}
+        assert response.matches[0].values is None
+
+    def test_namespaces_and_filters(self):
+        """Test that queries only see their namespace and matching metadata."""
+        store = LocalVectorStore()
+        store.upsert([_vector("a", [1.0, 0.0], content_hash="h1")], "user_a")
+        store.upsert([_vector("b", [1.0, 0.0], content_hash="h2")], "user_a")
+        store.upsert([_vector("c", [1.0, 0.0], content_hash="h1")], "user_b")
+
+        response = store.query(
+            namespace="user_a",
+            vector=[1.0, 0.0],
+            top_k=10,
+            filter={"content_hash": {"$in": ["h1", "h3"]}},
+        )
+
+        assert [match.id for match in response.matches] == ["a"]
+        assert store.query(namespace="user_c", vector=[1.0, 0.0], top_k=5) == (
+            QueryResponse(matches=[])
+        )
+
+    def test_upsert_overwrites_and_fetch(self):
+        """Test that re-upserting an id replaces its values and metadata."""
+        store = LocalVectorStore()
+        store.upsert([_vector("a", [1.0, 0.0], v=1)], "ns")
+        store.upsert([_vector("a", [0.0, 1.0], v=2), _vector("b", [1.0, 1.0])], "ns")
+
+        fetched = store.fetch(ids=["a", "missing"], namespace="ns")
+
+        assert list(fetched.vectors) == ["a"]
+        assert fetched.vectors["a"].values == [0.0, 1.0]
+        assert fetched.vectors["a"].metadata == {"v": 2}
+        assert len(store.query(namespace="ns", vector=[1.0, 0.0], top_k=5).matches) == 2
+
+    def test_persists_namespaces_to_disk(self, tmp_path):
+        """Test that a new store loads what an earlier one saved."""
+        LocalVectorStore(str(tmp_path)).upsert(
+            [_vector("a", [0.5, 0.5], contents="soup")], "user_a"
+        )
+
+        reloaded = LocalVectorStore(str(tmp_path))
+        response = reloaded.query(
+            namespace="user_a", vector=[1.0, 1.0], top_k=1, include_values=True
+        )
+
+        assert response.matches[0].id == "a"
+        assert response.matches[0].values == [0.5, 0.5]
+        assert response.matches[0].metadata == {"contents": "soup"}
+
+    def test_rejects_unsafe_namespace(self, tmp_path):
+        """Test that namespaces can't escape the storage directory."""
+        with pytest.raises(ValueError):
+            LocalVectorStore(str(tmp_path)).upsert([_vector("a", [1.0])], "../x")
+
+
+class TestPineconeVectorStore:
+    def test_query_converts_matches(self):
+        """Test that Pinecone responses are converted to store responses."""
+        index = MagicMock()
+        index.query.return_value = MagicMock(
+            matches=[MagicMock(id="a", score=0.9, metadata={"contents": "soup"})]
+        )
+
+        response = PineconeVectorStore(index).query(
+            namespace="user_a", vector=[0.1], top_k=3
+        )
+
+        assert response.matches == [
+            VectorMatch(id="a", score=0.9, values=None, metadata={"contents": "soup"})
+        ]
+        assert index.query.call_args[1]["namespace"] == "user_a"
+
+
+class TestQueryResultCache:
+    def test_normalized_queries_share_an_entry(self):
+        """Test that case, punctuation and spacing don't split the cache."""
+        cache = QueryResultCache(max_entries=10)
+        cache.put("user_a", "Pasta recipes?", 5, ["carbonara"], cache.version("user_a"))
+
+        assert cache.get("user_a", "pasta   RECIPES", 5) == ["carbonara"]
+        assert cache.get("user_a", "pasta recipes", 3) is None
+        assert cache.get("user_b", "pasta recipes", 5) is None
+        assert cache.stats()["hits"] == 1
+
+    def test_bump_invalidates_namespace(self):
+        """Test that a write hides earlier results for that namespace only."""
+        cache = QueryResultCache(max_entries=10)
+        cache.put("user_a", "soup", 5, ["miso"], cache.version("user_a"))
+        cache.put("user_b", "soup", 5, ["pho"], cache.version("user_b"))
+
+        cache.bump("user_a")
+
+        assert cache.get("user_a", "soup", 5) is None
+        assert cache.get("user_b", "soup", 5) == ["pho"]
+
+    def test_results_from_before_a_write_are_not_cached(self):
+        """Test that a search overlapping a write isn't stored."""
+        cache = QueryResultCache(max_entries=10)
+        version = cache.version("user_a")
+        cache.bump("user_a")
+
+        cache.put("user_a", "soup", 5, ["stale"], version)
+
+        assert cache.get("user_a", "soup", 5) is None
+
+    def test_evicts_least_recently_used(self):
+        """Test that the cache holds at most max_entries searches."""
+        cache = QueryResultCache(max_entries=2)
+        for query in ("a", "b"):
+            cache.put("ns", query, 5, [query], 0)
+        cache.get("ns", "a", 5)
+        cache.put("ns", "c", 5, ["c"], 0)
+
+        assert cache.get("ns", "b", 5) is None
+        assert cache.get("ns", "a", 5) == ["a"]
+
+    def test_other_workers_writes_invalidate_namespace(self):
+        """Test that a change in the shared version hides earlier results."""
+        cache = QueryResultCache(max_entries=10)
+        version = cache.observe("user_a", 3)
+        cache.put("user_a", "soup", 5, ["miso"], version)
+
+        assert cache.observe("user_a", 3) == version
+        assert cache.get("user_a", "soup", 5) == ["miso"]
+        assert cache.observe("user_a", 4) > version
+        assert cache.get("user_a", "soup", 5) is None
+
+    def test_bump_skips_a_version_for_unseen_writes(self):
+        """Test that a write after another worker's shows a gap in versions."""
+        cache = QueryResultCache(max_entries=10)
+        version = cache.observe("user_a", 3)
+
+        assert cache.bump("user_a", 4) == version + 1
+        assert cache.bump("user_a", 6) == version + 3
+        assert cache.bump("user_a") == version + 4
+
+    def test_shared_versions_are_kept_in_the_database(self):
+        """Test that versions are read and incremented through the session."""
+        session = MagicMock()
+        db = session.__enter__.return_value
+        db.get.return_value = MagicMock(version=5)
+        db.execute.return_value.scalar_one.return_value = 6
+        cache = QueryResultCache(max_entries=10, session_factory=lambda: session)
+
+        assert cache.load_shared_version("user_a") == 5
+        assert cache.store_shared_bump("user_a") == 6
+        db.commit.assert_called_once()
+        assert QueryResultCache(max_entries=10).load_shared_version("user_a") is None
+
+    def test_shared_version_failures_are_ignored(self):
+        """Test that database errors leave the cache process-local."""
+
+        def broken_session():
+            raise OperationalError("SELECT", {}, Exception("connection refused"))
+
+        cache = QueryResultCache(max_entries=10, session_factory=broken_session)
+
+        assert cache.load_shared_version("user_a") is None
+        assert cache.store_shared_bump("user_a") is None
+
+
+def _recipe_yaml(title, *ingredients):
+    return yaml.dump(
+        {"recipe": {"title": title, "ingredients": [{"name": i} for i in ingredients]}}
+    )
+
+
+class TestLexicalIndex:
+    def _index(self, *recipes):
+        index = LexicalIndex()
+        assert index.begin_load("ns", 0)
+        index.finish_load("ns", 0, recipes)
+        return index
+
+    def test_tokenize_drops_stopwords_and_plurals(self):
+        """Test that query phrasing and plurals don't affect matching."""
+        assert tokenize("What can I make with Mushrooms and leeks?") == [
+            "mushroom",
+            "leek",
+        ]
+        assert tokenize("tomatoes, cherries, peaches, grass") == [
+            "tomato",
+            "cherry",
+            "peach",
+            "grass",
+        ]
+
+    def test_search_ranks_recipes_with_more_query_ingredients_first(self):
+        """Test BM25 ranking over titles and ingredient names."""
+        index = self._index(
+            ("soup", _recipe_yaml("Mushroom Soup", "mushrooms", "leeks", "stock")),
+            ("risotto", _recipe_yaml("Risotto", "rice", "mushrooms", "parmesan")),
+            ("salad", _recipe_yaml("Green Salad", "lettuce")),
+        )
+
+        matches = index.search("ns", "mushrooms and leeks", top_k=5, version=0)
+
+        assert [recipe_id for recipe_id, _, _ in matches] == ["soup", "risotto"]
+        assert matches[0][1] > matches[1][1]
+        assert "Mushroom Soup" in matches[0][2]
+
+    def test_ingredient_queries(self):
+        """Test that only queries made of known ingredients are lexical-only."""
+        index = self._index(
+            ("soup", _recipe_yaml("Mushroom Soup", "mushrooms", "leeks")),
+        )
+
+        assert index.is_ingredient_query("ns", "what can I make with leeks?", 0)
+        assert not index.is_ingredient_query("ns", "something with leeks and tofu", 0)
+        assert not index.is_ingredient_query("ns", "soup", 0)
+        assert not index.is_ingredient_query("other", "leeks", 0)
+
+    def test_upsert_replaces_a_recipes_terms(self):
+        """Test that updating a recipe removes its old ingredients."""
+        index = self._index(("stew", _recipe_yaml("Stew", "beef")))
+
+        index.upsert("ns", [("stew", _recipe_yaml("Stew", "lentils"))], 1)
+
+        assert index.search("ns", "beef", top_k=5, version=1) == []
+        assert index.search("ns", "lentils", top_k=5, version=1)[0][0] == "stew"
+        assert not index.is_ingredient_query("ns", "beef", 1)
+        assert index.search("ns", "lentils", top_k=5, version=0) == []
+
+    def test_copy_that_missed_a_write_is_reloaded(self):
+        """Test that another worker's write makes the copy reload."""
+        index = self._index(("stew", _recipe_yaml("Stew", "beef")))
+
+        index.upsert("ns", [("pho", _recipe_yaml("Pho", "noodles"))], 2)
+
+        assert index.search("ns", "noodles", 5, 2) == []
+        assert index.begin_load("ns", 2)
+        index.finish_load("ns", 2, [("pho", _recipe_yaml("Pho", "noodles"))])
+        assert index.search("ns", "noodles", 5, 2)[0][0] == "pho"
+
+    def test_stale_copy_is_not_searched_while_reloading(self):
+        """Test that a newer version drops the copy until its load finishes."""
+        index = self._index(("stew", _recipe_yaml("Stew", "beef")))
+
+        assert index.begin_load("ns", 1)
+        assert not index.begin_load("ns", 1)
+        assert index.search("ns", "beef", 5, 0) == []
+        # A slower load of the old version doesn't replace the newer one
+        index.finish_load("ns", 1, [("pho", _recipe_yaml("Pho", "noodles"))])
+        index.finish_load("ns", 0, [("stew", _recipe_yaml("Stew", "beef"))])
+        assert index.search("ns", "noodles", 5, 1)[0][0] == "pho"
+
+    def test_evicts_least_recently_searched_namespace(self):
+        """Test that at most max_namespaces are kept indexed."""
+        index = LexicalIndex(max_namespaces=2)
+        for namespace in ("a", "b"):
+            index.begin_load(namespace, 0)
+            index.finish_load(namespace, 0, [("pho", _recipe_yaml("Pho", "noodles"))])
+        index.search("a", "noodles", 5, 0)
+        index.begin_load("c", 0)
+        index.finish_load("c", 0, [])
+
+        assert index.search("b", "noodles", 5, 0) == []
+        assert index.search("a", "noodles", 5, 0)
+        assert index.begin_load("b", 0)
+
+    def test_unloadable_namespace_is_left_to_vector_search(self):
+        """Test that a failed load isn't partially indexed or retried at once."""
+        now = [0.0]
+        index = LexicalIndex(retry_seconds=60, clock=lambda: now[0])
+        index.begin_load("ns", 0)
+        index.finish_load("ns", 0, None)
+        index.upsert("ns", [("a", _recipe_yaml("Pho", "noodles"))], 1)
+
+        now[0] = 59.0
+        assert not index.begin_load("ns", 1)
+        assert index.search("ns", "noodles", 5, 1) == []
+
+    def test_failed_load_is_retried_after_the_backoff(self):
+        """Test that a namespace is loaded again once the backoff has passed."""
+        now = [0.0]
+        index = LexicalIndex(retry_seconds=60, clock=lambda: now[0])
+        index.begin_load("ns", 0)
+        index.finish_load("ns", 0, None)
+
+        now[0] = 60.0
+        assert index.begin_load("ns", 0)
+        index.finish_load("ns", 0, None)
+        now[0] = 119.0
+        assert not index.begin_load("ns", 0)
+
+        now[0] = 120.0
+        assert index.begin_load("ns", 0)
+        index.finish_load("ns", 0, [("a", _recipe_yaml("Pho", "noodles"))])
+        assert index.search("ns", "noodles", 5, 0)[0][0] == "a"
+        assert not index.begin_load("ns", 0)
+
+    def test_reciprocal_rank_fusion(self):
+        """Test that items ranked well by both lists come first."""
+        fused = reciprocal_rank_fusion([["a", "b", "c"], ["b", "d", "a"]])
+
+        assert fused[:2] == ["b", "a"]
+        assert set(fused) == {"a", "b", "c", "d"}
+
+
+class TestPageCache:
+    def test_fresh_pages_are_hits(self):
+        """Test that pages are served until the TTL runs out."""
+        now = [0.0]
+        cache = PageCache(max_entries=10, ttl_seconds=60, clock=lambda: now[0])
+        cache.put(["https://example.com"], "Soup")
+
+        page = cache.lookup("https://example.com")
+        assert page is not None and cache.is_fresh(page)
+        assert page.text == "Soup"
+
+        now[0] = 61
+        assert cache.lookup("https://example.com") is None
+        assert cache.stats()["hits"] == 1
+
+    def test_stale_pages_with_validators_are_kept(self):
+        """Test that stale pages can be revalidated and renewed."""
+        now = [0.0]
+        cache = PageCache(max_entries=10, ttl_seconds=60, clock=lambda: now[0])
+        cache.put(["https://example.com"], "Soup", etag='"v1"')
+
+        now[0] = 61
+        page = cache.lookup("https://example.com")
+        assert page is not None and not cache.is_fresh(page)
+        assert page.etag == '"v1"'
+
+        cache.revalidated("https://example.com")
+        page = cache.lookup("https://example.com")
+        assert page is not None and cache.is_fresh(page)
+        assert cache.stats()["revalidations"] == 1
+
+    def test_evicts_least_recently_used(self):
+        """Test that the cache never grows past max_entries."""
+        cache = PageCache(max_entries=2, ttl_seconds=60)
+        cache.put(["https://a.example"], "A")
+        cache.put(["https://b.example"], "B")
+        cache.lookup("https://a.example")
+        cache.put(["https://c.example"], "C")
+
+        assert cache.lookup("https://b.example") is None
+        assert cache.lookup("https://a.example") is not None
+        assert cache.stats()["entries"] == 2
+
+    def test_persistent_hits_are_promoted_to_memory(self):
+        """Test that pages found in the database are served and kept in memory."""
+        row = MagicMock(
+            text="Soup", etag='"v1"', last_modified=None, updated_at=datetime.utcnow()
+        )
+        session = MagicMock()
+        db = session.__enter__.return_value
+        db.query.return_value.filter.return_value.first.return_value = row
+        cache = PageCache(
+            max_entries=10, ttl_seconds=60, session_factory=lambda: session
+        )
+
+        page = cache.load_persistent("https://example.com/soup")
+
+        assert page is not None and page.text == "Soup"
+        assert cache.lookup("https://example.com/soup") == page
+        stats = cache.stats()
+        assert stats["persistent_hits"] == 1
+        assert stats["hit_rate"] == 1.0
+
+    def test_old_persistent_pages_are_revalidated_or_dropped(self):
+        """Test that persistent pages age from the time they were stored."""
+        updated_at = datetime.utcnow() - timedelta(seconds=120)
+        rows = {
+            "https://example.com/etag": MagicMock(
+                text="Soup", etag='"v1"', last_modified=None, updated_at=updated_at
+            ),
+            "https://example.com/bare": MagicMock(
+                text="Stew", etag=None, last_modified=None, updated_at=updated_at
+            ),
+        }
+        session = MagicMock()
+        db = session.__enter__.return_value
+        db.query.return_value.filter.side_effect = lambda clause: MagicMock(
+            first=lambda: rows[clause.right.value]
+        )
+        cache = PageCache(
+            max_entries=10, ttl_seconds=60, session_factory=lambda: session
+        )
+
+        page = cache.load_persistent("https://example.com/etag")
+        assert page is not None and not cache.is_fresh(page)
+        assert cache.lookup("https://example.com/etag") == page
+        assert cache.load_persistent("https://example.com/bare") is None
+        assert cache.stats()["persistent_hits"] == 0
+
+    def test_renew_persistent_restarts_a_pages_age(self):
+        """Test that a revalidated page is marked as updated for every worker."""
+        session = MagicMock()
+        db = session.__enter__.return_value
+        cache = PageCache(
+            max_entries=10, ttl_seconds=60, session_factory=lambda: session
+        )
+
+        cache.renew_persistent("https://example.com/soup")
+
+        db.query.return_value.filter.return_value.update.assert_called_once()
+        db.commit.assert_called_once()
+
+    def test_store_persistent_writes_every_url(self):
+        """Test that aliases are stored pointing at the canonical URL."""
+        session = MagicMock()
+        db = session.__enter__.return_value
+        cache = PageCache(
+            max_entries=10, ttl_seconds=60, session_factory=lambda: session
+        )
+
+        cache.store_persistent(
+            ["https://example.com/soup?x=1", "https://example.com/soup"],
+            CachedPage("Soup", None, None, 0.0),
+        )
+
+        statement = db.execute.call_args[0][0]
+        rows = statement.compile().params
+        assert rows["url_m0"] == "https://example.com/soup?x=1"
+        assert rows["canonical_url_m0"] == "https://example.com/soup"
+        assert rows["url_m1"] == "https://example.com/soup"
+        db.commit.assert_called_once()
+
+    def test_persistent_failures_are_treated_as_misses(self):
+        """Test that database errors don't propagate out of lookups or writes."""
+
+        def broken_session():
+            raise OperationalError("SELECT", {}, Exception("connection refused"))
+
+        cache = PageCache(
+            max_entries=10, ttl_seconds=60, session_factory=broken_session
+        )
+
+        assert cache.load_persistent("https://example.com") is None
+        cache.store_persistent(["https://example.com"], CachedPage("x", None, None, 0))
+
+    def test_purge_drops_page_and_aliases(self):
+        """Test that purging a canonical URL also forgets its aliases."""
+        session = MagicMock()
+        query = session.__enter__.return_value.query.return_value.filter.return_value
+        query.with_entities.return_value = [MagicMock(url="https://example.com/a")]
+        query.delete.return_value = 2
+        cache = PageCache(
+            max_entries=10, ttl_seconds=60, session_factory=lambda: session
+        )
+        cache.put(["https://example.com/a", "https://example.com/c"], "Soup")
+        cache.put(["https://example.com/other"], "Stew")
+
+        assert cache.purge("https://example.com/c") == 2
+
+        assert cache.lookup("https://example.com/a") is None
+        assert cache.lookup("https://example.com/c") is None
+        assert cache.lookup("https://example.com/other") is not None
@@ -0,0 +1,120 @@
+from unittest.mock import patch
+
+import pytest
+from utils.tokens import (
+    IMAGE_MAX_TOKENS,
+    clear_token_counts,
+    count_tokens,
+    count_tokens_many,
+    estimate_message_tokens,
+    get_encoding,
+    get_tokens,
+    image_tokens,
+    prewarm_encoding,
+    vision_image_size,
+    with_token_count,
+)
+
+
+class TestImageTokens:
+    @pytest.mark.parametrize(
+        "width, height, expected",
+        [
+            (512, 512, 85 + 170),
+            (1024, 1024, 85 + 170 * 4),
+            # Scaled to 768 x 1536: 2 x 3 tiles
+            (2048, 4096, 85 + 170 * 6),
+            # Scaled to fit 2048 first, then to 768 x 768
+            (4096, 4096, 85 + 170 * 4),
+            (100, 300, 85 + 170),
+        ],
+    )
+    def test_tile_formula(self, width, height, expected):
+        assert image_tokens(width, height) == expected
+
+
+class TestWithTokenCount:
+    def test_counts_the_formatted_message(self):
+        message = {"role": "user", "content": "Risotto please"}
+
+        assert with_token_count(message) == {
+            **message,
+            "tokens": len(get_tokens("user: Risotto please")),
+        }
+        assert with_token_count({**message, "tokens": 7})["tokens"] == 7
+
+
+class TestEstimateMessageTokens:
+    def _content(self, detail=None):
+        image_url = {"url": "data:image/png;base64," + "A" * 500000}
+        if detail:
+            image_url["detail"] = detail
+        return [
+            {"type": "text", "text": "What can I make with this?"},
+            {"type": "image_url", "image_url": image_url},
+        ]
+
+    def test_counts_text(self):
+        assert estimate_message_tokens("Leek soup") == len(get_tokens("Leek soup"))
+
+    def test_charges_images_by_size(self):
+        """Test that image data is never tokenized, only its tiles charged."""
+        text_tokens = len(get_tokens("What can I make with this?"))
+
+        assert estimate_message_tokens(self._content(), [(1024, 512)]) == (
+            text_tokens + 85 + 170 * 2
+        )
+        assert estimate_message_tokens(self._content("low"), [(1024, 512)]) == (
+            text_tokens + 85
+        )
+        assert estimate_message_tokens(self._content()) == (
+            text_tokens + IMAGE_MAX_TOKENS
+        )
+
+
+class TestCountTokens:
+    def test_counts_match_the_encoder(self):
+        values = ["Leek soup", "Simmer for 20 minutes.", "Leek soup", ""]
+
+        assert count_tokens_many(values) == [len(get_tokens(v)) for v in values]
+        assert count_tokens("Leek soup") == len(get_tokens("Leek soup"))
+
+    def test_repeated_strings_are_served_from_the_cache(self):
+        clear_token_counts()
+        expected = count_tokens("Leek soup")
+
+        with patch("utils.tokens.get_tokens") as get_tokens_mock:
+            assert count_tokens("Leek soup") == expected
+            assert count_tokens_many(["Leek soup"]) == [expected]
+        get_tokens_mock.assert_not_called()
+
+    def test_special_token_text_is_counted_as_text(self):
+        assert count_tokens("<|endoftext|>") > 1
+
+    def test_prewarm_loads_the_encoder(self):
+        prewarm_encoding().join(timeout=30)
+
+        assert get_encoding() is get_encoding()
+
+
+class TestVisionImageSize:
+    @pytest.mark.parametrize(
+        "size, expected",
+        [
+            ((4032, 3024), (1024, 768)),
+            ((768, 1024), (768, 1024)),
+            ((768, 1100), (715, 1024)),
+            # Too far from a tile boundary to be worth trimming
+            ((1920, 1080), (1365, 768)),
+            ((5000, 1000), (2048, 410)),
+            ((100, 300), (100, 300)),
+        ],
+    )
+    def test_sizes(self, size, expected):
+        assert vision_image_size(*size) == expected
+
+    def test_never_costs_more_than_the_original(self):
+        for width in range(200, 5000, 173):
+            for height in (300, 768, 1100, 3024):
+                fitted = vision_image_size(width, height)
+                assert image_tokens(*fitted) <= image_tokens(width, height)
@@ -0,0 +1,63 @@
+import asyncio
+import threading
+
+import pytest
+from utils.workers import PoolSaturated, WorkerPool
+
+
+class TestWorkerPool:
+    async def test_runs_calls_and_records_timings(self):
+        pool = WorkerPool("test", workers=2, max_queued=2)
+
+        assert await pool.run(lambda x, y=0: x + y, 1, y=2) == 3
+
+        stats = pool.stats()
+        assert stats["completed"] == 1
+        assert stats["running"] == stats["queued"] == 0
+        assert stats["mean_run_ms"] >= 0
+
+    async def test_failures_are_counted_and_raised(self):
+        pool = WorkerPool("test", workers=1, max_queued=0)
+
+        def fail():
+            raise ValueError("bad image")
+
+        with pytest.raises(ValueError):
+            await pool.run(fail)
+        assert pool.stats()["failed"] == 1
+
+    async def test_rejects_work_when_saturated(self):
+        """Test that a full queue turns jobs away instead of growing."""
+        pool = WorkerPool("test", workers=1, max_queued=1)
+        release = threading.Event()
+
+        running = asyncio.create_task(pool.run(release.wait))
+        queued = asyncio.create_task(pool.run(release.wait))
+        await asyncio.sleep(0.05)
+
+        with pytest.raises(PoolSaturated):
+            await pool.run(release.wait)
+        stats = pool.stats()
+        assert (stats["running"], stats["queued"]) == (1, 1)
+        assert stats["peak_queued"] == 1
+        assert stats["rejected"] == 1
+
+        release.set()
+        await asyncio.gather(running, queued)
+        assert pool.stats()["completed"] == 2
+        assert await pool.run(lambda: "ok") == "ok"
+
+    async def test_cancelled_queued_job_frees_its_slot(self):
+        pool = WorkerPool("test", workers=1, max_queued=1)
+        release = threading.Event()
+
+        running = asyncio.create_task(pool.run(release.wait))
+        queued = asyncio.create_task(pool.run(release.wait))
+        await asyncio.sleep(0.05)
+        queued.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await queued
+
+        assert pool.stats()["queued"] == 0
+        release.set()
+        await running